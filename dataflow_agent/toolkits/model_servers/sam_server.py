@@ -38,6 +38,8 @@ class SAMRequest(BaseModel):
     image_path: str
     checkpoint: str = "sam_b.pt"
     device: str = "cuda"
+    # "bool": 每像素 1 字节；"packbits": np.packbits 按位打包（体积约 1/8）
+    mask_encoding: str = "bool"
 
 class SAMItemResponse(BaseModel):
     mask_b64: str
@@ -45,6 +47,7 @@ class SAMItemResponse(BaseModel):
     bbox: List[float]
     score: Optional[float] = None
     area: int
+    mask_encoding: str = "bool"
 
 class SAMResponse(BaseModel):
     items: List[SAMItemResponse]
@@ -64,15 +67,31 @@ def predict(req: SAMRequest):
         # 调用本地的 sam_tool 函数
         # 注意：这里会利用 sam_tool 内部的 caching 机制
         # 如果启动了多个 sam_server 进程，每个进程会维护自己的 cache
+        use_packbits = req.mask_encoding == "packbits"
         items = run_sam_auto(
             image_path=req.image_path,
             checkpoint=req.checkpoint,
-            device=target_device
+            device=target_device,
+            pack_masks=use_packbits,
         )
         
         # 序列化结果
         serialized_items = []
         for it in items:
+            packed = it.get("mask_packed")
+            if packed is not None:
+                # run_sam_auto 已整批 packbits，直接压缩发送
+                compressed_bytes = zlib.compress(packed.tobytes())
+                serialized_items.append(SAMItemResponse(
+                    mask_b64=base64.b64encode(compressed_bytes).decode('utf-8'),
+                    mask_shape=list(it["mask_shape"]),
+                    bbox=it.get("bbox", []),
+                    score=it.get("score"),
+                    area=it.get("area", 0),
+                    mask_encoding="packbits",
+                ))
+                continue
+
             mask = it.get("mask")
             if mask is None:
                 continue
@@ -84,7 +103,12 @@ def predict(req: SAMRequest):
             
             # Use bool type for serialization consistency
             mask_bool = mask.astype(bool)
-            mask_bytes = mask_bool.tobytes()
+            if req.mask_encoding == "packbits":
+                mask_bytes = np.packbits(mask_bool.ravel()).tobytes()
+                mask_encoding = "packbits"
+            else:
+                mask_bytes = mask_bool.tobytes()
+                mask_encoding = "bool"
             # Compress using zlib to reduce payload size
             compressed_bytes = zlib.compress(mask_bytes)
             mask_b64 = base64.b64encode(compressed_bytes).decode('utf-8')
@@ -94,7 +118,8 @@ def predict(req: SAMRequest):
                 mask_shape=list(mask.shape),
                 bbox=it.get("bbox", []),
                 score=it.get("score"),
-                area=it.get("area", 0)
+                area=it.get("area", 0),
+                mask_encoding=mask_encoding,
             ))
             
         return SAMResponse(items=serialized_items)
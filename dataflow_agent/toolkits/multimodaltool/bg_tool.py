@@ -18,7 +18,9 @@
 
 from __future__ import annotations
 
+import errno
 import os
+import shutil
 import subprocess
 from pathlib import Path
 import platform
@@ -29,6 +31,11 @@ import torch
 from torchvision import transforms
 from transformers import AutoModelForImageSegmentation
 
+try:
+    import cairosvg
+except (ImportError, OSError):  # 未安装 cairosvg 或缺少 libcairo 时延迟到调用处报错
+    cairosvg = None
+
 CURRENT_DIR = Path(__file__).resolve().parent
 MODEL_PATH = CURRENT_DIR / "onnx" / "model.onnx"
 OUTPUT_DIR = CURRENT_DIR
@@ -441,8 +448,6 @@ def convert_image_to_svg(
     RuntimeError
         当 vtracer 未安装或转换失败时。
     """
-    from pathlib import Path
-
     input_p = Path(input_path)
     if not input_p.exists():
         raise FileNotFoundError(f"输入文件不存在: {input_p}")
@@ -566,6 +571,22 @@ def get_raster_to_svg_desc(lang: str = "zh") -> str:
 # ======================================================================
 
 
+def _copy_svg_file(in_p: Path, out_p: Path, *, hardlink: bool = False) -> None:
+    """按字节复制 SVG 文件；``hardlink=True`` 时优先创建硬链接。"""
+    if in_p.resolve() == out_p.resolve():
+        return
+    if hardlink:
+        try:
+            if out_p.exists():
+                out_p.unlink()
+            os.link(in_p, out_p)
+            return
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+    shutil.copyfile(str(in_p), str(out_p))
+
+
 def render_svg_to_image(
     svg_source: str,
     output_path: str,
@@ -573,6 +594,7 @@ def render_svg_to_image(
     from_string: bool = False,
     fmt: str | None = None,
     scale: float = 1.0,
+    hardlink: bool = False,
 ) -> str:
     """
     使用 CairoSVG 将 SVG 渲染为图片或文档文件。
@@ -597,6 +619,9 @@ def render_svg_to_image(
         - "pdf"
         - "ps"
         - "svg"
+    hardlink:
+        仅在 ``fmt="svg"`` 且 ``from_string=False`` 时生效：优先用硬链接代替复制，
+        跨文件系统（EXDEV）时自动退回为普通复制。
 
     返回
     ----
@@ -615,14 +640,10 @@ def render_svg_to_image(
     这是对 ``cairosvg.svg2*`` 系列函数的统一封装，用于在
     DataFlow-Agent 中以统一的方式完成 SVG 渲染任务。
     """
-    from pathlib import Path
-
-    try:
-        import cairosvg
-    except ModuleNotFoundError as e:
+    if cairosvg is None:
         raise RuntimeError(
             "cairosvg 未安装，请先运行 `pip install cairosvg`"
-        ) from e
+        )
 
     out_p = Path(output_path)
     out_p.parent.mkdir(parents=True, exist_ok=True)
@@ -642,8 +663,8 @@ def render_svg_to_image(
             elif fmt == "ps":
                 cairosvg.svg2ps(bytestring=data, write_to=str(out_p))
             elif fmt == "svg":
-                # 直接写入文件
-                out_p.write_text(svg_source, encoding="utf-8")
+                # 直接写入已编码的字节，跳过文本 I/O 包装层
+                out_p.write_bytes(data)
             else:
                 raise ValueError(f"不支持的输出格式: {fmt}")
         else:
@@ -659,8 +680,8 @@ def render_svg_to_image(
             elif fmt == "ps":
                 cairosvg.svg2ps(url=str(in_p), write_to=str(out_p))
             elif fmt == "svg":
-                # 复制原始 SVG
-                out_p.write_text(in_p.read_text(encoding="utf-8"), encoding="utf-8")
+                # 复制原始 SVG（按字节复制，无需解码/重新编码）
+                _copy_svg_file(in_p, out_p, hardlink=hardlink)
             else:
                 raise ValueError(f"不支持的输出格式: {fmt}")
     except Exception as e:
@@ -0,0 +1,118 @@
+"""
+多模态请求共享的 httpx 连接池
+
+每次请求都新建 httpx.AsyncClient 会重新做 TCP + TLS 握手；这里按事件循环缓存一个
+AsyncClient，同一批次的生图 / 理解 / OCR / TTS 请求复用 keep-alive 连接。
+
+AsyncClient 与创建它的事件循环绑定（调用方可能多次 asyncio.run），
+所以缓存键是当前运行的事件循环，而不是全局单例。keep-alive 连接的 transport 会反向引用事件循环，
+条目不会被自动回收，因此每个客户端都挂一个异步生成器：asyncio.run 结束前调用
+loop.shutdown_asyncgens() 时它会关闭客户端并移除条目，不依赖调用方使用 MultimodalSession。
+单次请求的超时通过 ``client.post(..., timeout=...)`` 传入。
+安装了 h2 时启用 HTTP/2：并发请求同一网关时在一条连接上多路复用，只做一次 TLS 握手。
+响应压缩由 httpx 自动协商：默认声明 gzip / deflate，安装了 brotli（httpx[brotli]）时额外声明 br 并透明解压；
+不手动设置 Accept-Encoding，以免声明了本地无法解码的编码。
+"""
+import asyncio
+import weakref
+from typing import AsyncIterator, Dict, Iterator, Optional, Tuple
+
+import httpx
+
+from dataflow_agent.toolkits.multimodaltool.providers import iter_payload_chunks
+
+try:
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖 h2（httpx[http2]）
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+# 连接池上限：批量生成时同时在飞的请求数远小于此值
+_LIMITS = httpx.Limits(max_connections=128, max_keepalive_connections=64)
+_DEFAULT_TIMEOUT = httpx.Timeout(300.0)
+
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+    weakref.WeakKeyDictionary()
+)
+# 每个客户端对应的关闭钩子（已启动的异步生成器）；loop._asyncgens 只持有弱引用，这里保持强引用
+_closers: Dict[int, Tuple[httpx.AsyncClient, AsyncIterator[None]]] = {}
+
+
+async def _close_on_loop_shutdown(
+    loop: asyncio.AbstractEventLoop, client: httpx.AsyncClient
+) -> AsyncIterator[None]:
+    try:
+        yield
+    finally:
+        _closers.pop(id(client), None)
+        if _clients.get(loop) is client:
+            del _clients[loop]
+        if not client.is_closed:
+            await client.aclose()
+
+
+def _register_loop_closer(loop: asyncio.AbstractEventLoop, client: httpx.AsyncClient) -> None:
+    """
+    启动一个异步生成器并停在第一个 yield：首次迭代时事件循环会登记它，
+    loop.shutdown_asyncgens()（asyncio.run 退出前会调用）对它 aclose()，从而执行 finally 中的关闭逻辑。
+    """
+    closer = _close_on_loop_shutdown(loop, client)
+    try:
+        closer.asend(None).send(None)
+    except StopIteration:
+        pass
+    _closers[id(client)] = (client, closer)
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    返回当前事件循环共享的 AsyncClient（不存在或已关闭时新建）。
+    必须在协程内调用；事件循环经 shutdown_asyncgens 退出时客户端会被自动关闭。
+    """
+    loop = asyncio.get_running_loop()
+    client: Optional[httpx.AsyncClient] = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(limits=_LIMITS, timeout=_DEFAULT_TIMEOUT, http2=_HTTP2)
+        _clients[loop] = client
+        _register_loop_closer(loop, client)
+    return client
+
+
+async def aclose_async_client() -> None:
+    """关闭当前事件循环的共享 AsyncClient（例如在 asyncio.run 的协程末尾调用）"""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None and not client.is_closed:
+        await client.aclose()
+
+
+async def _aiter_chunks(chunks: Iterator[bytes]) -> AsyncIterator[bytes]:
+    for chunk in chunks:
+        yield chunk
+
+
+def json_body(headers: dict, payload: dict) -> AsyncIterator[bytes]:
+    """
+    分块发送 JSON 请求体：图片 / 视频 base64 逐段写出，不再拼成整块 bytes（大请求可省下一份完整副本）。
+    显式设置 Content-Length，避免退化为 chunked 传输。用法::
+
+        body = json_body(headers, payload)
+        await client.post(url, headers=headers, content=body)
+    """
+    content_length, chunks = iter_payload_chunks(payload)
+    headers["Content-Length"] = str(content_length)
+    return _aiter_chunks(chunks)
+
+
+class MultimodalSession:
+    """
+    在一个 async with 块内复用共享连接池，退出时关闭，例如::
+
+        async with MultimodalSession():
+            await asyncio.gather(*(call_ocr_async(...) for ...))
+    """
+
+    async def __aenter__(self) -> httpx.AsyncClient:
+        return get_async_client()
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await aclose_async_client()
@@ -1,7 +1,10 @@
 from __future__ import annotations
 
+import atexit
 import hashlib
+import math
 import os
+import shutil
 import tempfile
 import subprocess
 from dataclasses import dataclass
@@ -40,11 +43,16 @@ class PptTextFitter:
     Notes:
     - This is slower than heuristic estimation; use it selectively (e.g. titles).
     - It works even when PPT's own wrapping differs from our heuristics, because it measures output.
+    - The spill check renders at ``check_scale`` (default 0.5) of the native page resolution;
+      results that land within one pixel of the tolerance are re-checked at full resolution.
     """
 
-    def __init__(self, dpi: int = 96):
+    def __init__(self, dpi: int = 96, check_scale: float = 0.5):
         self.dpi = dpi
+        self.check_scale = check_scale
         self._cache: Dict[str, int] = {}
+        # Shared soffice user profile, created lazily on first conversion (see _soffice_profile_arg).
+        self._sof_profile_dir: Optional[Path] = None
 
     def fit_font_size_pt(
         self,
@@ -154,6 +162,29 @@ class PptTextFitter:
                 # If conversion fails, be conservative: treat as not fit.
                 return False
 
+            scale = self.check_scale
+            if 0 < scale < 1:
+                img = self._render_pdf_first_page(pdf_path=pdf_path, scale=scale)
+                if img is None:
+                    return False
+
+                scaled_bbox = tuple(int(round(v * scale)) for v in bbox_px)
+                scaled_tol = tolerance_px * scale
+                # Check with a 1px band around the scaled tolerance; if both agree the
+                # low-res answer is reliable, otherwise the result is marginal.
+                strict = self._check_text_pixels_within_bbox(
+                    rendered_rgb=img,
+                    bbox_px=scaled_bbox,
+                    tolerance_px=max(0.0, scaled_tol - 1),
+                )
+                loose = self._check_text_pixels_within_bbox(
+                    rendered_rgb=img,
+                    bbox_px=scaled_bbox,
+                    tolerance_px=scaled_tol + 1,
+                )
+                if strict == loose:
+                    return strict
+
             img = self._render_pdf_first_page(pdf_path=pdf_path)
             if img is None:
                 return False
@@ -212,10 +243,34 @@ class PptTextFitter:
 
         prs.save(str(pptx_path))
 
+    def _soffice_profile_arg(self, soffice: str) -> str:
+        """
+        Return the ``-env:UserInstallation`` arg for a prewarmed, process-wide soffice profile.
+
+        soffice otherwise initializes a fresh user profile on every headless run; the profile
+        is created once (with a ``--terminate_after_init`` warmup) and removed at exit.
+        """
+        if self._sof_profile_dir is None:
+            base = Path("/dev/shm") if Path("/dev/shm").is_dir() else None
+            profile_dir = Path(tempfile.mkdtemp(prefix="sof_profile_", dir=base))
+            atexit.register(shutil.rmtree, profile_dir, ignore_errors=True)
+            arg = f"-env:UserInstallation={profile_dir.as_uri()}"
+            try:
+                subprocess.run(
+                    [soffice, "--headless", "--terminate_after_init", arg],
+                    capture_output=True,
+                    timeout=60,
+                )
+            except Exception as e:
+                log.warning(f"[ppt_text_fit] soffice profile warmup failed: {e}")
+            self._sof_profile_dir = profile_dir
+        return f"-env:UserInstallation={self._sof_profile_dir.as_uri()}"
+
     def _convert_pptx_to_pdf(self, *, pptx_path: Path, out_dir: Path) -> bool:
         soffice = os.environ.get("SOFFICE_BIN") or "soffice"
         cmd = [
             soffice,
+            self._soffice_profile_arg(soffice),
             "--headless",
             "--nologo",
             "--nofirststartwizard",
@@ -235,13 +290,14 @@ class PptTextFitter:
             log.warning(f"[ppt_text_fit] soffice convert exception: {e}")
             return False
 
-    def _render_pdf_first_page(self, *, pdf_path: Path) -> Optional[np.ndarray]:
+    def _render_pdf_first_page(self, *, pdf_path: Path, scale: float = 1.0) -> Optional[np.ndarray]:
         try:
             doc = fitz.open(str(pdf_path))
             try:
                 page = doc[0]
-                # Render at 1x; since the ppt slide is in inches with dpi mapping, this is stable enough.
-                pix = page.get_pixmap(alpha=False)
+                # Render at 1x (or downscaled for the cheap spill check); since the ppt slide
+                # is in inches with dpi mapping, this is stable enough.
+                pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False)
                 img = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, 3)
                 return img
             finally:
@@ -255,14 +311,15 @@ class PptTextFitter:
         *,
         rendered_rgb: np.ndarray,
         bbox_px: Tuple[int, int, int, int],
-        tolerance_px: int,
+        tolerance_px: float,
     ) -> bool:
         """
         Detect whether non-background pixels inside bbox spill outside bbox.
         Strategy:
         - Assume background is mostly white (as we don't add background in minimal pptx).
         - Threshold to detect ink pixels.
-        - Find bounding box of ink pixels and ensure it's within bbox (+ tolerance).
+        - Ensure no ink lies outside bbox (+ tolerance): only the four strips around the
+          expanded bbox are scanned, each with a short-circuiting ``.any()`` reduction.
         """
         x1, y1, x2, y2 = bbox_px
         H, W = rendered_rgb.shape[:2]
@@ -275,32 +332,28 @@ class PptTextFitter:
         if x2c <= x1c or y2c <= y1c:
             return True
 
-        # Convert to grayscale
+        # Convert to grayscale. Keep the truncating float blend: Pillow's convert("L")
+        # rounds, which would flip pixels just below the 245 ink threshold.
         gray = (0.299 * rendered_rgb[:, :, 0] + 0.587 * rendered_rgb[:, :, 1] + 0.114 * rendered_rgb[:, :, 2]).astype(
             np.uint8
         )
 
-        # Ink mask: anything darker than 245 considered ink (titles are dark)
-        ink = gray < 245
-
-        # Get ink bounding box
-        ys, xs = np.where(ink)
-        if len(xs) == 0:
-            return True  # no ink => fits
+        # Ink: anything darker than 245 (titles are dark). Ink at x < left / x >= right
+        # (resp. y < top / y >= bottom) lies outside the bbox + tolerance.
+        left = math.ceil(x1c - tolerance_px)
+        right = math.floor(x2c + tolerance_px) + 1
+        top = math.ceil(y1c - tolerance_px)
+        bottom = math.floor(y2c + tolerance_px) + 1
 
-        minx = int(xs.min())
-        maxx = int(xs.max())
-        miny = int(ys.min())
-        maxy = int(ys.max())
-
-        # Check if ink bbox is within target bbox with tolerance
-        if minx < x1c - tolerance_px:
+        if top > 0 and (gray[:top] < 245).any():
             return False
-        if miny < y1c - tolerance_px:
+        if bottom < H and (gray[bottom:] < 245).any():
             return False
-        if maxx > x2c + tolerance_px:
+
+        rows = gray[max(0, top):min(H, bottom)]
+        if left > 0 and (rows[:, :left] < 245).any():
             return False
-        if maxy > y2c + tolerance_px:
+        if right < W and (rows[:, right:] < 245).any():
             return False
 
         return True
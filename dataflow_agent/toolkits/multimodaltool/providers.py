@@ -1,30 +1,248 @@
 import json
-from abc import ABC, abstractmethod
-from typing import Tuple, Optional, Any, Dict, List
+import re
+import secrets
+from functools import lru_cache
+from typing import (
+    TYPE_CHECKING, Tuple, Optional, Any, Callable, Dict, Iterator, List
+)
 from dataflow_agent.toolkits.multimodaltool.utils import (
     Provider, detect_provider, extract_base64, 
     is_gemini_model, is_gemini_25, is_gemini_3_pro
 )
 from dataflow_agent.logger import get_logger
 
+try:
+    import orjson
+except ImportError:  # 未安装 orjson 时回退到 msgspec / 标准库 json
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    from pybase64 import b64decode as _b64decode  # SIMD 加速的 base64 解码
+except ImportError:
+    from base64 import b64decode as _b64decode
+
+if TYPE_CHECKING:
+    import httpx
+
 log = get_logger(__name__)
 
-class AIProviderStrategy(ABC):
+# --- URL 模板（模块级常量，各 build_*_request 只做一次 format） ---
+_URL_CHAT_COMPLETIONS = "{base}/chat/completions"
+_URL_IMAGES_GENERATIONS = "{base}/images/generations"
+_URL_IMAGES_EDITS = "{base}/images/edits"
+_URL_GEMINI_GENERATE = "{base}/v1beta/models/{model}:generateContent"
+_URL_APIYI_GEMINI25_GEN = "{base}/v1beta/models/gemini-2.5-flash-image:generateContent"
+_URL_APIYI_GEMINI3PRO_GEN = "{base}/v1beta/models/gemini-3-pro-image-preview:generateContent"
+_URL_GOOGLE_GENERATE = "{base}/models/{model}:generateContent"
+
+# --- multipart 上传的固定元数据 ---
+_IMG_MIME = "image/png"
+_IMG_FILENAME = "image.png"
+
+
+@lru_cache(maxsize=32)
+def _base_url(api_url: str) -> str:
+    """去掉 api_url 末尾的 '/'（实际只有少数几个不同的 api_url，结果可缓存）"""
+    return api_url.rstrip("/")
+
+
+@lru_cache(maxsize=32)
+def _apiyi_base_url(api_url: str) -> str:
+    """APIYI Gemini 原生接口的根地址：去掉末尾的 '/' 与 '/v1'"""
+    return _base_url(api_url).removesuffix("/v1")
+
+
+@lru_cache(maxsize=64)
+def _load_mask(path: str, mtime_ns: int) -> bytes:
+    """读取遮罩文件；mtime_ns 参与缓存键，文件被改写后自动失效"""
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@lru_cache(maxsize=16)
+def _data_url_prefix(fmt: str) -> str:
+    """按图片格式缓存 data URL 前缀，例如 ``data:image/png;base64,``"""
+    return f"data:image/{fmt};base64,"
+
+
+@lru_cache(maxsize=32)
+def _apiyi_image_config_items(
+    aspect_ratio: str, resolution: Optional[str] = None
+) -> Tuple[Tuple[str, str], ...]:
+    """APIYI Gemini imageConfig 的字段（只有少数几种比例/分辨率组合，按参数缓存不可变的元组）"""
+    if resolution:
+        return (("aspectRatio", aspect_ratio), ("imageSize", resolution))
+    return (("aspectRatio", aspect_ratio),)
+
+
+def _apiyi_image_config(aspect_ratio: str, resolution: Optional[str] = None) -> Dict[str, str]:
+    """
+    APIYI Gemini 的 generationConfig.imageConfig。
+    每次返回新的 dict，调用方修改 payload 不会影响后续请求。
+    """
+    return dict(_apiyi_image_config_items(aspect_ratio, resolution))
+
+
+@lru_cache(maxsize=32)
+def _local123_image_config_items(aspect_ratio: str, resolution: str) -> Tuple[Tuple[str, str], ...]:
+    """Local123 imageConfig 的字段（下划线风格），同样按参数缓存不可变的元组"""
+    return (("aspect_ratio", aspect_ratio), ("image_size", resolution))
+
+
+def _local123_image_config(aspect_ratio: str, resolution: str) -> Dict[str, str]:
+    """Local123 的 generationConfig.imageConfig，每次返回新的 dict"""
+    return dict(_local123_image_config_items(aspect_ratio, resolution))
+
+
+def serialize_payload(payload: Any) -> bytes:
+    """
+    将 build_*_request 返回的 JSON payload 序列化为请求体 bytes。
+    优先使用 orjson（C 实现，对内嵌的大段 base64 字符串更快），其次 msgspec，
+    都未安装时回退到 json。payload 也可以是 msgspec.Struct。
+    """
+    if msgspec is not None and isinstance(payload, msgspec.Struct):
+        return msgspec.json.encode(payload)
+    if orjson is not None:
+        return orjson.dumps(payload)
+    if msgspec is not None:
+        return msgspec.json.encode(payload)
+    return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+
+def map_image_blobs(payload: Dict[str, Any], fn: Callable[[str], str]) -> Dict[str, Any]:
+    """
+    对 payload 中的图片 base64 字段（chat 格式的 image_url.url、Gemini 格式的 inline_data.data）
+    应用 fn，返回新的 payload。只对这些分支做浅拷贝，原 payload 不变。
+    """
+    if "messages" in payload:
+        messages = []
+        for msg in payload["messages"]:
+            content = msg.get("content")
+            if isinstance(content, list):
+                parts = []
+                for part in content:
+                    if part.get("type") == "image_url" and isinstance(part["image_url"].get("url"), str):
+                        part = {**part, "image_url": {**part["image_url"], "url": fn(part["image_url"]["url"])}}
+                    parts.append(part)
+                msg = {**msg, "content": parts}
+            messages.append(msg)
+        return {**payload, "messages": messages}
+    if "contents" in payload:
+        contents = []
+        for content in payload["contents"]:
+            if "parts" in content:
+                content = {
+                    **content,
+                    "parts": [
+                        {**part, "inline_data": {**part["inline_data"], "data": fn(part["inline_data"]["data"])}}
+                        if "inline_data" in part else part
+                        for part in content["parts"]
+                    ],
+                }
+            contents.append(content)
+        return {**payload, "contents": contents}
+    return payload
+
+
+# 分块序列化时图片字段的占位符：私有区字符（JSON 编码时不转义）+ 每次调用随机生成的 nonce + 序号，
+# 提示词等其他字段即使恰好包含私有区字符也不会被误认为占位符
+_BLOB_MARK = "\ue000"
+# 需要 JSON 转义的字符；含这些字符的字段保留在骨架里正常序列化
+_JSON_ESCAPE_RE = re.compile(r'["\\\x00-\x1f]')
+
+
+def iter_payload_chunks(payload: Dict[str, Any]) -> Tuple[int, Iterator[bytes]]:
+    """
+    分块序列化 payload：先序列化把图片 base64 替换为占位符的 JSON 骨架，
+    发送时再逐段写出各图片，避免把所有图片再拼接成一整块请求体。
+    base64 / data URL 均为 ASCII 且无需 JSON 转义，可直接按字节写出。
+    Returns: (Content-Length, 分块迭代器)
+    """
+    blobs: List[str] = []
+    prefix = f"{_BLOB_MARK}{secrets.token_hex(16)}:"
+
+    def _take(value: str) -> str:
+        if not value.isascii() or _JSON_ESCAPE_RE.search(value):
+            return value
+        blobs.append(value)
+        return f"{prefix}{len(blobs) - 1}{_BLOB_MARK}"
+
+    split_re = re.compile(
+        re.escape(prefix.encode("utf-8")) + rb"(\d+)" + re.escape(_BLOB_MARK.encode("utf-8"))
+    )
+    pieces = split_re.split(serialize_payload(map_image_blobs(payload, _take)))
+    # split 结果为 [骨架, 序号, 骨架, 序号, ..., 骨架]
+    total = sum(len(pieces[i]) for i in range(0, len(pieces), 2))
+    total += sum(len(blobs[int(pieces[i])]) for i in range(1, len(pieces), 2))
+
+    def _chunks() -> Iterator[bytes]:
+        for i, piece in enumerate(pieces):
+            if i % 2 == 0:
+                if piece:
+                    yield piece
+            else:
+                yield blobs[int(piece)].encode("ascii")
+
+    return total, _chunks()
+
+
+# deserialize_response 可能抛出的解析错误（orjson / json 的错误均为 ValueError 子类）
+JSON_DECODE_ERRORS: Tuple[type, ...] = (
+    (ValueError, msgspec.DecodeError) if msgspec is not None else (ValueError,)
+)
+
+
+def deserialize_response(raw: bytes) -> Any:
+    """
+    解析响应体 bytes 为 JSON 对象，与 serialize_payload 对应：
+    优先 orjson，其次 msgspec，最后回退到 json。
+    """
+    if orjson is not None:
+        return orjson.loads(raw)
+    if msgspec is not None:
+        return msgspec.json.decode(raw)
+    return json.loads(raw)
+
+
+class AIProviderStrategy:
     """
     通用 AI 服务商策略基类
     支持：
     1. 图像生成 (Generation)
     2. 多模态理解 (Chat/Vision/Video/OCR)
+
+    策略均为导入时创建的无状态单例，这里用普通基类而非 ABC，
+    子类必须覆盖的方法在基类中直接抛出 NotImplementedError。
     """
     
-    @abstractmethod
     def match(self, api_url: str, model: str) -> bool:
         """判断当前策略是否适用"""
-        pass
+        raise NotImplementedError
+
+    @classmethod
+    def provider_keys(cls) -> Tuple[Provider, ...]:
+        """
+        当前策略可能匹配的服务商 (detect_provider 的结果)，用于预先构建分发表。
+        默认与服务商无关（如仅按模型名前缀匹配的策略）。
+        """
+        return tuple(Provider)
+
+    def get_client(self, api_url: str) -> "httpx.AsyncClient":
+        """
+        发送本策略构造的请求所用的 AsyncClient：默认为按事件循环共享的连接池，
+        httpx 内部按 origin 维护 keep-alive 连接，同一 api_url 的请求复用 TLS 会话。
+        """
+        # 延迟导入：只构造 payload 的调用方不需要 httpx
+        from dataflow_agent.toolkits.multimodaltool.http_client import get_async_client
+        return get_async_client()
         
     # --- Generation Interface ---
     
-    @abstractmethod
     def build_generation_request(
         self, 
         api_url: str, 
@@ -36,7 +254,7 @@ class AIProviderStrategy(ABC):
         构造文生图请求
         Returns: (url, payload, is_stream)
         """
-        pass
+        raise NotImplementedError
 
     def build_edit_request(
         self, 
@@ -69,12 +287,11 @@ class AIProviderStrategy(ABC):
         """
         raise NotImplementedError("Multi-image edit not supported by this provider")
         
-    @abstractmethod
     def parse_generation_response(self, response_data: Dict[str, Any]) -> str:
         """
         解析生图响应，返回图片 Base64 字符串
         """
-        pass
+        raise NotImplementedError
 
     # --- TTS Interface ---
 
@@ -98,6 +315,8 @@ class AIProviderStrategy(ABC):
         api_url: str,
         model: str,
         messages: List[Dict[str, Any]],
+        temperature: float = 0.1,
+        max_tokens: int = 4096,
         **kwargs
     ) -> Tuple[str, Dict[str, Any]]:
         """
@@ -106,12 +325,12 @@ class AIProviderStrategy(ABC):
         
         Default implementation: OpenAI Standard Format
         """
-        url = f"{api_url.rstrip('/')}/chat/completions"
+        url = _URL_CHAT_COMPLETIONS.format(base=_base_url(api_url))
         payload = {
             "model": model,
             "messages": messages,
-            "temperature": kwargs.get("temperature", 0.1),
-            "max_tokens": kwargs.get("max_tokens", 4096),
+            "temperature": temperature,
+            "max_tokens": max_tokens,
         }
         return url, payload
 
@@ -121,8 +340,10 @@ class AIProviderStrategy(ABC):
         
         Default implementation: OpenAI Standard Format
         """
-        if "choices" in response_data and len(response_data["choices"]) > 0:
+        try:
             return response_data["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError):
+            pass
         if "error" in response_data:
              raise RuntimeError(f"API Error: {response_data['error']}")
         raise RuntimeError(f"Unknown API response format: {str(response_data)[:200]}")
@@ -135,91 +356,34 @@ class ApiYiGeminiProvider(AIProviderStrategy):
     def match(self, api_url: str, model: str) -> bool:
         return detect_provider(api_url) is Provider.APIYI and is_gemini_model(model)
 
+    @classmethod
+    def provider_keys(cls) -> Tuple[Provider, ...]:
+        return (Provider.APIYI,)
+
     def _get_base_url(self, api_url: str) -> str:
-        base = api_url.rstrip("/")
-        if base.endswith("/v1"):
-            base = base[:-3]
-        return base
+        return _apiyi_base_url(api_url)
 
     # --- Generation ---
+    # 具体的生图 / 编辑请求由 ApiYiGemini25Provider / ApiYiGemini3ProProvider 实现，
+    # 这里只处理其它 Gemini 型号（不支持生图）。
 
-    def build_generation_request(self, api_url: str, model: str, prompt: str, **kwargs) -> Tuple[str, Dict[str, Any], bool]:
-        base = self._get_base_url(api_url)
-        aspect_ratio = kwargs.get("aspect_ratio", "16:9")
-        resolution = kwargs.get("resolution", "2K")
-
-        if is_gemini_25(model):
-            url = f"{base}/v1beta/models/gemini-2.5-flash-image:generateContent"
-            payload = {
-                "contents": [{"parts": [{"text": prompt}]}],
-                "generationConfig": {
-                    "responseModalities": ["IMAGE"],
-                    "imageConfig": {"aspectRatio": aspect_ratio},
-                },
-            }
-            return url, payload, False
-
-        if is_gemini_3_pro(model):
-            url = f"{base}/v1beta/models/gemini-3-pro-image-preview:generateContent"
-            payload = {
-                "contents": [{"parts": [{"text": prompt}]}],
-                "generationConfig": {
-                    "responseModalities": ["IMAGE"],
-                    "imageConfig": {
-                        "aspectRatio": aspect_ratio,
-                        "imageSize": resolution,
-                    },
-                },
-            }
-            return url, payload, False
-        
+    def build_generation_request(
+        self,
+        api_url: str,
+        model: str,
+        prompt: str,
+        **kwargs
+    ) -> Tuple[str, Dict[str, Any], bool]:
         raise ValueError(f"Unsupported Gemini model for APIYI Generation: {model}")
 
-    def build_edit_request(self, api_url: str, model: str, prompt: str, image_b64: str, **kwargs) -> Tuple[str, Dict[str, Any], bool]:
-        base = self._get_base_url(api_url)
-        aspect_ratio = kwargs.get("aspect_ratio", "1:1")
-        resolution = kwargs.get("resolution", "2K")
-        fmt = kwargs.get("image_fmt", "png")
-
-        if is_gemini_25(model) and aspect_ratio != "1:1":
-             url = f"{base}/v1beta/models/gemini-2.5-flash-image:generateContent"
-             payload = {
-                "contents": [
-                    {
-                        "parts": [
-                            {"text": prompt},
-                            {"inline_data": {"mime_type": f"image/{fmt}", "data": image_b64}}
-                        ]
-                    }
-                ],
-                "generationConfig": {
-                    "responseModalities": ["IMAGE"],
-                    "imageConfig": {"aspectRatio": aspect_ratio},
-                },
-            }
-             return url, payload, False
-
-        if is_gemini_3_pro(model):
-            url = f"{base}/v1beta/models/gemini-3-pro-image-preview:generateContent"
-            payload = {
-                "contents": [
-                    {
-                        "parts": [
-                            {"text": prompt},
-                            {"inline_data": {"mime_type": f"image/{fmt}", "data": image_b64}}
-                        ]
-                    }
-                ],
-                "generationConfig": {
-                    "responseModalities": ["IMAGE"],
-                    "imageConfig": {
-                        "aspectRatio": aspect_ratio,
-                        "imageSize": resolution,
-                    },
-                },
-            }
-            return url, payload, False
-            
+    def build_edit_request(
+        self,
+        api_url: str,
+        model: str,
+        prompt: str,
+        image_b64: str,
+        **kwargs
+    ) -> Tuple[str, Dict[str, Any], bool]:
         raise ValueError(f"Unsupported Gemini Edit combination for APIYI: {model}")
 
     def build_multi_image_edit_request(
@@ -228,11 +392,11 @@ class ApiYiGeminiProvider(AIProviderStrategy):
         model: str,
         prompt: str,
         image_b64_list: List[Tuple[str, str]],
+        aspect_ratio: str = "16:9",
+        resolution: str = "2K",
         **kwargs
     ) -> Tuple[str, Dict[str, Any], bool]:
         base = self._get_base_url(api_url)
-        aspect_ratio = kwargs.get("aspect_ratio", "16:9")
-        resolution = kwargs.get("resolution", "2K")
 
         parts = [{"text": prompt}]
         for b64, fmt in image_b64_list:
@@ -243,40 +407,40 @@ class ApiYiGeminiProvider(AIProviderStrategy):
                 }
             })
 
-        url = f"{base}/v1beta/models/{model}:generateContent"
+        url = _URL_GEMINI_GENERATE.format(base=base, model=model)
         
-        image_config = {"aspectRatio": aspect_ratio}
-        if is_gemini_3_pro(model):
-            image_config["imageSize"] = resolution
-            
         payload = {
             "contents": [{"parts": parts}],
             "generationConfig": {
                 "responseModalities": ["IMAGE"],
-                "imageConfig": image_config
+                "imageConfig": self._image_config(aspect_ratio, resolution),
             }
         }
         return url, payload, False
 
+    def _image_config(self, aspect_ratio: str, resolution: str) -> Dict[str, Any]:
+        """generationConfig.imageConfig；仅 Gemini 3 Pro 支持 imageSize"""
+        return _apiyi_image_config(aspect_ratio)
+
     def parse_generation_response(self, data: Dict[str, Any]) -> str:
         try:
-            candidates = data.get("candidates", [])
-            if not candidates:
-                raise RuntimeError("candidates is empty")
-            content = candidates[0].get("content", {})
-            parts = content.get("parts", [])
-            inline_data = parts[0].get("inlineData", {})
-            return inline_data.get("data")
-        except Exception as e:
+            return data["candidates"][0]["content"]["parts"][0]["inlineData"]["data"]
+        except (KeyError, IndexError, TypeError) as e:
             log.error(f"Failed to parse APIYI Gemini response: {e}")
             log.error(f"Response preview: {str(data)[:500]}")
             raise
 
-    def build_tts_request(self, api_url: str, model: str, text: str, **kwargs) -> Tuple[str, Dict[str, Any], bool]:
+    def build_tts_request(
+        self,
+        api_url: str,
+        model: str,
+        text: str,
+        *,
+        voice_name: str = "Kore",
+        **kwargs
+    ) -> Tuple[str, Dict[str, Any], bool]:
         base = self._get_base_url(api_url)
-        url = f"{base}/v1beta/models/{model}:generateContent"
-        
-        voice_name = kwargs.get("voice_name", "Kore")
+        url = _URL_GEMINI_GENERATE.format(base=base, model=model)
         
         payload = {
             "contents": [{
@@ -299,23 +463,135 @@ class ApiYiGeminiProvider(AIProviderStrategy):
         if "error" in data:
             raise RuntimeError(f"API Error: {data['error']}")
             
-        candidates = data.get("candidates", [])
-        if not candidates:
-            raise RuntimeError(f"No candidates in response: {str(data)[:200]}")
-            
-        content = candidates[0].get("content", {})
-        parts = content.get("parts", [])
-        if not parts:
-            raise RuntimeError("No parts in content")
-            
-        inline_data = parts[0].get("inlineData", {})
-        b64 = inline_data.get("data")
-        
+        try:
+            b64 = data["candidates"][0]["content"]["parts"][0]["inlineData"]["data"]
+        except (KeyError, IndexError, TypeError) as e:
+            raise RuntimeError(f"Failed to parse TTS response: {str(data)[:200]}") from e
+
         if not b64:
              raise RuntimeError("No inlineData.data found")
              
-        import base64
-        return base64.b64decode(b64)
+        return _b64decode(b64)
+
+
+class ApiYiGemini25Provider(ApiYiGeminiProvider):
+    """
+    APIYI Gemini 2.5 (gemini-2.5-flash-image)：固定生图端点，不支持 imageSize
+    """
+    def match(self, api_url: str, model: str) -> bool:
+        return super().match(api_url, model) and is_gemini_25(model)
+
+    def build_generation_request(
+        self,
+        api_url: str,
+        model: str,
+        prompt: str,
+        *,
+        aspect_ratio: str = "16:9",
+        resolution: str = "2K",
+        **kwargs
+    ) -> Tuple[str, Dict[str, Any], bool]:
+        url = _URL_APIYI_GEMINI25_GEN.format(base=self._get_base_url(api_url))
+        payload = {
+            "contents": [{"parts": [{"text": prompt}]}],
+            "generationConfig": {
+                "responseModalities": ["IMAGE"],
+                "imageConfig": _apiyi_image_config(aspect_ratio),
+            },
+        }
+        return url, payload, False
+
+    def build_edit_request(
+        self,
+        api_url: str,
+        model: str,
+        prompt: str,
+        image_b64: str,
+        *,
+        aspect_ratio: str = "1:1",
+        resolution: str = "2K",
+        image_fmt: str = "png",
+        **kwargs
+    ) -> Tuple[str, Dict[str, Any], bool]:
+        if aspect_ratio == "1:1":
+            raise ValueError(f"Unsupported Gemini Edit combination for APIYI: {model}")
+
+        url = _URL_APIYI_GEMINI25_GEN.format(base=self._get_base_url(api_url))
+        payload = {
+            "contents": [
+                {
+                    "parts": [
+                        {"text": prompt},
+                        {"inline_data": {"mime_type": f"image/{image_fmt}", "data": image_b64}}
+                    ]
+                }
+            ],
+            "generationConfig": {
+                "responseModalities": ["IMAGE"],
+                "imageConfig": _apiyi_image_config(aspect_ratio),
+            },
+        }
+        return url, payload, False
+
+
+class ApiYiGemini3ProProvider(ApiYiGeminiProvider):
+    """
+    APIYI Gemini 3 Pro (gemini-3-pro-image-preview)：固定生图端点，支持 imageSize
+    """
+    def match(self, api_url: str, model: str) -> bool:
+        return super().match(api_url, model) and is_gemini_3_pro(model)
+
+    def build_generation_request(
+        self,
+        api_url: str,
+        model: str,
+        prompt: str,
+        *,
+        aspect_ratio: str = "16:9",
+        resolution: str = "2K",
+        **kwargs
+    ) -> Tuple[str, Dict[str, Any], bool]:
+        url = _URL_APIYI_GEMINI3PRO_GEN.format(base=self._get_base_url(api_url))
+        payload = {
+            "contents": [{"parts": [{"text": prompt}]}],
+            "generationConfig": {
+                "responseModalities": ["IMAGE"],
+                "imageConfig": self._image_config(aspect_ratio, resolution),
+            },
+        }
+        return url, payload, False
+
+    def build_edit_request(
+        self,
+        api_url: str,
+        model: str,
+        prompt: str,
+        image_b64: str,
+        *,
+        aspect_ratio: str = "1:1",
+        resolution: str = "2K",
+        image_fmt: str = "png",
+        **kwargs
+    ) -> Tuple[str, Dict[str, Any], bool]:
+        url = _URL_APIYI_GEMINI3PRO_GEN.format(base=self._get_base_url(api_url))
+        payload = {
+            "contents": [
+                {
+                    "parts": [
+                        {"text": prompt},
+                        {"inline_data": {"mime_type": f"image/{image_fmt}", "data": image_b64}}
+                    ]
+                }
+            ],
+            "generationConfig": {
+                "responseModalities": ["IMAGE"],
+                "imageConfig": self._image_config(aspect_ratio, resolution),
+            },
+        }
+        return url, payload, False
+
+    def _image_config(self, aspect_ratio: str, resolution: str) -> Dict[str, Any]:
+        return _apiyi_image_config(aspect_ratio, resolution)
 
 
 class Local123GeminiProvider(AIProviderStrategy):
@@ -325,16 +601,27 @@ class Local123GeminiProvider(AIProviderStrategy):
     def match(self, api_url: str, model: str) -> bool:
         return detect_provider(api_url) is Provider.LOCAL_123 and is_gemini_model(model)
 
-    def build_generation_request(self, api_url: str, model: str, prompt: str, **kwargs) -> Tuple[str, Dict[str, Any], bool]:
-        base = api_url.rstrip("/")
-        aspect_ratio = kwargs.get("aspect_ratio", "")
-        resolution = kwargs.get("resolution", "2K")
+    @classmethod
+    def provider_keys(cls) -> Tuple[Provider, ...]:
+        return (Provider.LOCAL_123,)
+
+    def build_generation_request(
+        self,
+        api_url: str,
+        model: str,
+        prompt: str,
+        *,
+        aspect_ratio: str = "",
+        resolution: str = "2K",
+        **kwargs
+    ) -> Tuple[str, Dict[str, Any], bool]:
+        base = _base_url(api_url)
 
         # Logic from original req_img.py
         if aspect_ratio:
             prompt = f"{prompt} 生成比例：{aspect_ratio}, 4K 分辨率"
 
-        url = f"{base}/chat/completions"
+        url = _URL_CHAT_COMPLETIONS.format(base=base)
         payload = {
             "model": model,
             "group": "default",
@@ -345,22 +632,27 @@ class Local123GeminiProvider(AIProviderStrategy):
             "frequency_penalty": 0,
             "presence_penalty": 0,
             "generationConfig": {
-                "imageConfig": {
-                    "aspect_ratio": aspect_ratio,
-                    "image_size": resolution
-                }
+                "imageConfig": _local123_image_config(aspect_ratio, resolution)
             }
         }
         return url, payload, True
 
-    def build_edit_request(self, api_url: str, model: str, prompt: str, image_b64: str, **kwargs) -> Tuple[str, Dict[str, Any], bool]:
-        base = api_url.rstrip("/")
-        aspect_ratio = kwargs.get("aspect_ratio", "1:1")
-        resolution = kwargs.get("resolution", "2K")
-        fmt = kwargs.get("image_fmt", "png")
+    def build_edit_request(
+        self,
+        api_url: str,
+        model: str,
+        prompt: str,
+        image_b64: str,
+        *,
+        aspect_ratio: str = "1:1",
+        resolution: str = "2K",
+        image_fmt: str = "png",
+        **kwargs
+    ) -> Tuple[str, Dict[str, Any], bool]:
+        base = _base_url(api_url)
 
         if is_gemini_3_pro(model):
-            url = f"{base}/chat/completions"
+            url = _URL_CHAT_COMPLETIONS.format(base=base)
             messages = [
                 {
                     "role": "user",
@@ -369,7 +661,7 @@ class Local123GeminiProvider(AIProviderStrategy):
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/{fmt};base64,{image_b64}",
+                                "url": _data_url_prefix(image_fmt) + image_b64,
                             },
                         },
                     ],
@@ -381,16 +673,13 @@ class Local123GeminiProvider(AIProviderStrategy):
                 "stream": True,
                 "temperature": 0.7,
                 "generationConfig": {
-                    "imageConfig": {
-                        "aspect_ratio": aspect_ratio, 
-                        "image_size": resolution
-                    }
+                    "imageConfig": _local123_image_config(aspect_ratio, resolution)
                 }
             }
             return url, payload, True
 
         if is_gemini_25(model):
-            url = f"{base}/chat/completions"
+            url = _URL_CHAT_COMPLETIONS.format(base=base)
             payload = {
                 "model": model,
                 "messages": [
@@ -398,7 +687,7 @@ class Local123GeminiProvider(AIProviderStrategy):
                         "role": "user",
                         "parts": [
                             {"text": prompt},
-                            {"inline_data": {"mime_type": f"image/{fmt}", "data": image_b64}},
+                            {"inline_data": {"mime_type": f"image/{image_fmt}", "data": image_b64}},
                         ],
                     }
                 ],
@@ -418,22 +707,21 @@ class Local123GeminiProvider(AIProviderStrategy):
         model: str,
         prompt: str,
         image_b64_list: List[Tuple[str, str]],
+        aspect_ratio: str = "16:9",
+        resolution: str = "2K",
         **kwargs
     ) -> Tuple[str, Dict[str, Any], bool]:
-        base = api_url.rstrip("/")
-        aspect_ratio = kwargs.get("aspect_ratio", "16:9")
-        resolution = kwargs.get("resolution", "2K")
+        base = _base_url(api_url)
         
-        content_parts = [{"type": "text", "text": prompt}]
-        for b64, fmt in image_b64_list:
-            content_parts.append({
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/{fmt};base64,{b64}"
-                }
-            })
+        content_parts = [
+            {"type": "text", "text": prompt},
+            *(
+                {"type": "image_url", "image_url": {"url": _data_url_prefix(fmt) + b64}}
+                for b64, fmt in image_b64_list
+            ),
+        ]
 
-        url = f"{base}/chat/completions"
+        url = _URL_CHAT_COMPLETIONS.format(base=base)
         payload = {
             "model": model,
             "messages": [
@@ -445,33 +733,32 @@ class Local123GeminiProvider(AIProviderStrategy):
             "stream": True,
             "temperature": 0.7,
             "generationConfig": {
-                "imageConfig": {
-                    "aspect_ratio": aspect_ratio, 
-                    "image_size": resolution
-                }
+                "imageConfig": _local123_image_config(aspect_ratio, resolution)
             }
         }
         return url, payload, True
 
     def parse_generation_response(self, data: Dict[str, Any]) -> str:
         # Local 123 returns OpenAI-like format
-        if "choices" in data:
+        try:
             content = data["choices"][0]["message"]["content"]
-            if isinstance(content, str):
-                b64 = extract_base64(content)
-            elif isinstance(content, list):
-                joined = " ".join(
-                    part.get("text", "") if isinstance(part, dict) else str(part)
-                    for part in content
-                )
-                b64 = extract_base64(joined)
-            else:
-                raise RuntimeError(f"Unsupported content type: {type(content)}")
-            
-            if not b64:
-                raise RuntimeError("Failed to extract base64 from Local123 response")
-            return b64
-        raise RuntimeError("Unknown Local123 response structure")
+        except (KeyError, IndexError, TypeError) as e:
+            raise RuntimeError("Unknown Local123 response structure") from e
+
+        if isinstance(content, str):
+            b64 = extract_base64(content)
+        elif isinstance(content, list):
+            joined = " ".join(
+                part.get("text", "") if isinstance(part, dict) else str(part)
+                for part in content
+            )
+            b64 = extract_base64(joined)
+        else:
+            raise RuntimeError(f"Unsupported content type: {type(content)}")
+
+        if not b64:
+            raise RuntimeError("Failed to extract base64 from Local123 response")
+        return b64
 
 
 class ApiYiSeeDreamProvider(AIProviderStrategy):
@@ -481,12 +768,18 @@ class ApiYiSeeDreamProvider(AIProviderStrategy):
     def match(self, api_url: str, model: str) -> bool:
         return model.lower().startswith("seedream")
 
-    def build_generation_request(self, api_url: str, model: str, prompt: str, **kwargs) -> Tuple[str, Dict[str, Any], bool]:
-        url = f"{api_url.rstrip('/')}/images/generations"
-        
-        size = kwargs.get("size", "2048x2048")
-        quality = kwargs.get("quality", "standard")
-        response_format = kwargs.get("response_format", "b64_json")
+    def build_generation_request(
+        self,
+        api_url: str,
+        model: str,
+        prompt: str,
+        *,
+        size: str = "2048x2048",
+        quality: str = "standard",
+        response_format: str = "b64_json",
+        **kwargs
+    ) -> Tuple[str, Dict[str, Any], bool]:
+        url = _URL_IMAGES_GENERATIONS.format(base=_base_url(api_url))
         
         payload = {
             "model": model,
@@ -521,12 +814,20 @@ class ApiYiGPTImageProvider(AIProviderStrategy):
     def match(self, api_url: str, model: str) -> bool:
         return model.lower().startswith("gpt-image")
 
-    def build_generation_request(self, api_url: str, model: str, prompt: str, **kwargs) -> Tuple[str, Dict[str, Any], bool]:
-        url = f"{api_url.rstrip('/')}/images/generations"
+    def build_generation_request(
+        self,
+        api_url: str,
+        model: str,
+        prompt: str,
+        *,
+        size: str = "1024x1024",
+        quality: str = "auto",
+        n: int = 1,
+        **kwargs
+    ) -> Tuple[str, Dict[str, Any], bool]:
+        url = _URL_IMAGES_GENERATIONS.format(base=_base_url(api_url))
         
-        size = kwargs.get("size", "1024x1024")
         # 映射 quality 参数: DALL-E 的 standard/hd -> GPT-Image 的 low/medium/high/auto
-        quality = kwargs.get("quality", "auto")
         if quality == "standard":
             quality = "medium"
         elif quality == "hd":
@@ -535,7 +836,7 @@ class ApiYiGPTImageProvider(AIProviderStrategy):
         payload = {
             "model": model,
             "prompt": prompt,
-            "n": kwargs.get("n", 1),
+            "n": n,
             "size": size,
             "quality": quality,
         }
@@ -562,6 +863,9 @@ class ApiYiGPTImageProvider(AIProviderStrategy):
         model: str, 
         prompt: str, 
         image_b64: str, 
+        mask_path: Optional[str] = None,
+        n: int = 1,
+        size: str = "1024x1024",
         **kwargs
     ) -> Tuple[str, Dict[str, Any], bool]:
         """
@@ -572,10 +876,10 @@ class ApiYiGPTImageProvider(AIProviderStrategy):
             model (str): 模型名称 (如 gpt-image-1)
             prompt (str): 文本提示词，描述想要生成的编辑效果
             image_b64 (str): 原始图像的 Base64 编码字符串
+            mask_path (str, optional): 遮罩图像的文件路径 (如果存在)
+            n (int): 生成图像数量，默认为 1
+            size (str): 输出图像尺寸，默认为 1024x1024
             **kwargs: 其他可选参数
-                - mask_path (str): 遮罩图像的文件路径 (如果存在)
-                - n (int): 生成图像数量，默认为 1
-                - size (str): 输出图像尺寸 (如 1024x1024)
                 - response_format (str): 返回格式 (url 或 b64_json)，注意 GPT-Image-1 可能不支持此参数
                 - user (str): 用户标识符
         
@@ -587,31 +891,32 @@ class ApiYiGPTImageProvider(AIProviderStrategy):
             "files": 包含 'image' 和可选的 'mask' 文件数据 (bytes)。
             "data": 包含其他表单字段 (prompt, n, size 等)。
         """
-        import base64
         import os
         
-        url = f"{api_url.rstrip('/')}/images/edits"
+        url = _URL_IMAGES_EDITS.format(base=_base_url(api_url))
         
         # 1. 解码图片 Base64 为二进制
-        image_bytes = base64.b64decode(image_b64)
+        image_bytes = _b64decode(image_b64, validate=False)
         
         files = {
-            "image": ("image.png", image_bytes, "image/png")
+            "image": (_IMG_FILENAME, image_bytes, _IMG_MIME)
         }
         
-        # 2. 处理遮罩 (Mask)
-        mask_path = kwargs.get("mask_path")
-        if mask_path and os.path.exists(mask_path):
-            with open(mask_path, "rb") as f:
-                mask_bytes = f.read()
-            files["mask"] = (os.path.basename(mask_path), mask_bytes, "image/png")
+        # 2. 处理遮罩 (Mask)，同一遮罩在批量编辑中按 (路径, mtime) 复用
+        if mask_path:
+            try:
+                mask_bytes = _load_mask(mask_path, os.stat(mask_path).st_mtime_ns)
+            except FileNotFoundError:
+                mask_bytes = None
+            if mask_bytes is not None:
+                files["mask"] = (os.path.basename(mask_path), mask_bytes, _IMG_MIME)
             
         # 3. 构造表单数据 (Data)
         data = {
             "model": model,
             "prompt": prompt,
-            "n": kwargs.get("n", 1),
-            "size": kwargs.get("size", "1024x1024"),
+            "n": n,
+            "size": size,
         }
         
         # 添加可选参数 (白名单过滤)
@@ -651,13 +956,19 @@ class OpenAIDalleProvider(AIProviderStrategy):
     def match(self, api_url: str, model: str) -> bool:
         return model.lower().startswith(('dall-e', 'dall-e-2', 'dall-e-3'))
 
-    def build_generation_request(self, api_url: str, model: str, prompt: str, **kwargs) -> Tuple[str, Dict[str, Any], bool]:
-        url = f"{api_url.rstrip('/')}/images/generations"
-        
-        size = kwargs.get("size", "1024x1024")
-        quality = kwargs.get("quality", "standard")
-        style = kwargs.get("style", "vivid")
-        response_format = kwargs.get("response_format", "b64_json")
+    def build_generation_request(
+        self,
+        api_url: str,
+        model: str,
+        prompt: str,
+        *,
+        size: str = "1024x1024",
+        quality: str = "standard",
+        style: str = "vivid",
+        response_format: str = "b64_json",
+        **kwargs
+    ) -> Tuple[str, Dict[str, Any], bool]:
+        url = _URL_IMAGES_GENERATIONS.format(base=_base_url(api_url))
         
         payload = {
             "model": model,
@@ -691,7 +1002,7 @@ class OpenAICompatGeminiProvider(AIProviderStrategy):
         return True
 
     def build_generation_request(self, api_url: str, model: str, prompt: str, **kwargs) -> Tuple[str, Dict[str, Any], bool]:
-        url = f"{api_url.rstrip('/')}/chat/completions"
+        url = _URL_CHAT_COMPLETIONS.format(base=_base_url(api_url))
         payload = {
             "model": model,
             "messages": [{"role": "user", "content": prompt}],
@@ -701,9 +1012,17 @@ class OpenAICompatGeminiProvider(AIProviderStrategy):
         }
         return url, payload, False
 
-    def build_edit_request(self, api_url: str, model: str, prompt: str, image_b64: str, **kwargs) -> Tuple[str, Dict[str, Any], bool]:
-        url = f"{api_url.rstrip('/')}/chat/completions"
-        fmt = kwargs.get("image_fmt", "png")
+    def build_edit_request(
+        self,
+        api_url: str,
+        model: str,
+        prompt: str,
+        image_b64: str,
+        *,
+        image_fmt: str = "png",
+        **kwargs
+    ) -> Tuple[str, Dict[str, Any], bool]:
+        url = _URL_CHAT_COMPLETIONS.format(base=_base_url(api_url))
         messages = [
             {
                 "role": "user",
@@ -712,7 +1031,7 @@ class OpenAICompatGeminiProvider(AIProviderStrategy):
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/{fmt};base64,{image_b64}",
+                            "url": _data_url_prefix(image_fmt) + image_b64,
                         },
                     },
                 ],
@@ -735,18 +1054,17 @@ class OpenAICompatGeminiProvider(AIProviderStrategy):
         image_b64_list: List[Tuple[str, str]],
         **kwargs
     ) -> Tuple[str, Dict[str, Any], bool]:
-        base = api_url.rstrip("/")
+        base = _base_url(api_url)
         
-        content_parts = [{"type": "text", "text": prompt}]
-        for b64, fmt in image_b64_list:
-            content_parts.append({
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/{fmt};base64,{b64}"
-                }
-            })
-            
-        url = f"{base}/chat/completions"
+        content_parts = [
+            {"type": "text", "text": prompt},
+            *(
+                {"type": "image_url", "image_url": {"url": _data_url_prefix(fmt) + b64}}
+                for b64, fmt in image_b64_list
+            ),
+        ]
+
+        url = _URL_CHAT_COMPLETIONS.format(base=base)
         payload = {
             "model": model,
             "messages": [
@@ -762,23 +1080,25 @@ class OpenAICompatGeminiProvider(AIProviderStrategy):
         return url, payload, False
 
     def parse_generation_response(self, data: Dict[str, Any]) -> str:
-        if "choices" in data:
+        try:
             content = data["choices"][0]["message"]["content"]
-            if isinstance(content, str):
-                b64 = extract_base64(content)
-            elif isinstance(content, list):
-                joined = " ".join(
-                    part.get("text", "") if isinstance(part, dict) else str(part)
-                    for part in content
-                )
-                b64 = extract_base64(joined)
-            else:
-                raise RuntimeError(f"Unsupported content type: {type(content)}")
-            
-            if not b64:
-                raise RuntimeError("Failed to extract base64 from OpenAI-compat response")
-            return b64
-        raise RuntimeError("Unknown OpenAI-compat response structure")
+        except (KeyError, IndexError, TypeError) as e:
+            raise RuntimeError("Unknown OpenAI-compat response structure") from e
+
+        if isinstance(content, str):
+            b64 = extract_base64(content)
+        elif isinstance(content, list):
+            joined = " ".join(
+                part.get("text", "") if isinstance(part, dict) else str(part)
+                for part in content
+            )
+            b64 = extract_base64(joined)
+        else:
+            raise RuntimeError(f"Unsupported content type: {type(content)}")
+
+        if not b64:
+            raise RuntimeError("Failed to extract base64 from OpenAI-compat response")
+        return b64
 
 
 class GoogleNativeProvider(AIProviderStrategy):
@@ -788,27 +1108,33 @@ class GoogleNativeProvider(AIProviderStrategy):
     def match(self, api_url: str, model: str) -> bool:
         return "googleapis.com" in api_url and is_gemini_model(model)
 
+    @classmethod
+    def provider_keys(cls) -> Tuple[Provider, ...]:
+        return (Provider.OTHER,)
+
     def build_generation_request(self, api_url: str, model: str, prompt: str, **kwargs) -> Tuple[str, Dict[str, Any], bool]:
-        base = api_url.rstrip("/")
+        base = _base_url(api_url)
         if "v1" not in base and "v1beta" not in base:
             base = f"{base}/v1beta"
-        url = f"{base}/models/{model}:generateContent"
+        url = _URL_GOOGLE_GENERATE.format(base=base, model=model)
         payload = {
             "contents": [{"parts": [{"text": prompt}]}]
         }
         return url, payload, False
 
     def parse_generation_response(self, data: Dict[str, Any]) -> str:
-        candidates = data.get("candidates", [])
-        if candidates:
-            return candidates[0]["content"]["parts"][0]["inlineData"]["data"]
-        raise RuntimeError("No candidates in Google response")
+        try:
+            return data["candidates"][0]["content"]["parts"][0]["inlineData"]["data"]
+        except (KeyError, IndexError, TypeError) as e:
+            raise RuntimeError("No candidates in Google response") from e
 
     # Native Chat Implementation can also be added here (e.g., converting messages to contents)
 
 
 # 注册顺序
 STRATEGIES = [
+    ApiYiGemini25Provider(),
+    ApiYiGemini3ProProvider(),
     ApiYiGeminiProvider(),
     ApiYiSeeDreamProvider(),
     ApiYiGPTImageProvider(),
@@ -818,8 +1144,16 @@ STRATEGIES = [
     OpenAICompatGeminiProvider(), # Default Fallback
 ]
 
+# 分发表：detect_provider 结果 -> 该服务商下可能匹配的策略（保持 STRATEGIES 注册顺序）
+_BY_PROVIDER: Dict[Provider, List[AIProviderStrategy]] = {
+    prov: [s for s in STRATEGIES if prov in s.provider_keys()]
+    for prov in Provider
+}
+
+@lru_cache(maxsize=256)
 def get_provider(api_url: str, model: str) -> AIProviderStrategy:
-    for strategy in STRATEGIES:
+    # 策略实例均为无状态单例，按 (api_url, model) 缓存匹配结果是安全的
+    for strategy in _BY_PROVIDER[detect_provider(api_url)]:
         if strategy.match(api_url, model):
             return strategy
     return OpenAICompatGeminiProvider()
@@ -1,24 +1,68 @@
 import os
-import json
-import base64
+import asyncio
+import logging
+import uuid
 from typing import Tuple, Optional, List, Union
 import httpx
 from io import BytesIO
 
 from dataflow_agent.logger import get_logger
 from dataflow_agent.toolkits.multimodaltool.utils import (
-    Provider, detect_provider, extract_base64, encode_image_to_base64 as _encode_image_to_base64,
+    Provider, detect_provider, extract_base64, encode_image_to_base64_cached as _encode_image_to_base64,
+    encode_bytes_to_base64, run_in_encode_pool,
     is_gemini_model as _is_gemini_model, is_gemini_25, is_gemini_3_pro
 )
-from dataflow_agent.toolkits.multimodaltool.providers import get_provider
+from dataflow_agent.toolkits.multimodaltool.providers import (
+    JSON_DECODE_ERRORS, get_provider, serialize_payload, deserialize_response, map_image_blobs,
+)
+from dataflow_agent.toolkits.multimodaltool.http_client import get_async_client, json_body
+
+try:
+    from pybase64 import b64decode as _b64decode  # SIMD 加速的 base64 解码
+except ImportError:
+    from base64 import b64decode as _b64decode
 
 log = get_logger(__name__)
 
+# SSE 帧标记（bytes 常量，流式解析按字节比较）
+_SSE_DATA_PREFIX = b"data: "
+_SSE_DONE = b"[DONE]"
+_SSE_NEWLINE = b"\n"
+
+def _accumulate_sse_line(line: bytes, full_content: List[str]) -> bool:
+    """
+    处理一行流式响应（SSE ``data: {...}`` 或裸 JSON），把 choices[0].delta.content 追加到 full_content。
+    遇到 ``[DONE]`` 返回 True。
+    """
+    line = line.strip()
+    if not line:
+        return False
+
+    if line.startswith(_SSE_DATA_PREFIX):
+        line = line[len(_SSE_DATA_PREFIX):].strip()  # remove "data: " prefix
+
+    if line == _SSE_DONE:
+        return True
+
+    try:
+        chunk = deserialize_response(line)
+    except JSON_DECODE_ERRORS:
+        log.warning(f"Failed to decode stream line: {line.decode('utf-8', 'replace')}")
+        return False
+
+    # 处理 OpenAI 兼容的流式格式 choices[0].delta.content
+    if "choices" in chunk and len(chunk["choices"]) > 0:
+        content = chunk["choices"][0].get("delta", {}).get("content", "")
+        if content:
+            full_content.append(content)
+    return False
+
 async def _post_stream_and_accumulate(
     url: str,
     api_key: str,
     payload: dict,
     timeout: int,
+    client: Optional[httpx.AsyncClient] = None,
 ) -> dict:
     """
     处理流式响应，累积 content 并返回类似非流式的响应结构
@@ -30,60 +74,70 @@ async def _post_stream_and_accumulate(
     
     log.info(f"POST STREAM {url}")
     
-    async with httpx.AsyncClient(timeout=httpx.Timeout(timeout), http2=False) as client:
-        try:
-            full_content = []
-            async with client.stream("POST", url, headers=headers, json=payload) as response:
-                log.info(f"status={response.status_code}")
-                response.raise_for_status()
-                
-                async for line in response.aiter_lines():
-                    if not line or not line.strip():
-                        continue
-                    
-                    if line.startswith("data: "):
-                        line = line[6:]  # remove "data: " prefix
-                    
-                    if line.strip() == "[DONE]":
-                        break
-                        
-                    try:
-                        chunk = json.loads(line)
-                        # 处理 OpenAI 兼容的流式格式 choices[0].delta.content
-                        if "choices" in chunk and len(chunk["choices"]) > 0:
-                            delta = chunk["choices"][0].get("delta", {})
-                            content = delta.get("content", "")
-                            if content:
-                                full_content.append(content)
-                    except json.JSONDecodeError:
-                        log.warning(f"Failed to decode stream line: {line}")
-                        continue
-                        
-            joined_content = "".join(full_content)
+    if client is None:
+        client = get_async_client()
+    body = json_body(headers, payload)
+    try:
+        full_content = []
+        async with client.stream(
+            "POST", url, headers=headers, content=body,
+            timeout=httpx.Timeout(timeout),
+        ) as response:
+            log.info(f"status={response.status_code}")
+            response.raise_for_status()
             
-            # 构造兼容非流式解析的返回结构
-            return {
-                "choices": [
-                    {
-                        "message": {
-                            "role": "assistant",
-                            "content": joined_content
-                        }
+            # 按字节切行，避免 aiter_lines 的逐行 utf-8 解码；每行 JSON 交给 orjson 解析
+            buf = bytearray()
+            done = False
+            async for data in response.aiter_bytes(65536):
+                buf += data
+                start = 0
+                while (nl := buf.find(_SSE_NEWLINE, start)) != -1:
+                    done = _accumulate_sse_line(bytes(buf[start:nl]), full_content)
+                    start = nl + 1
+                    if done:
+                        break
+                del buf[:start]
+                if done:
+                    break
+            if not done and buf:
+                _accumulate_sse_line(bytes(buf), full_content)
+
+        joined_content = "".join(full_content)
+        
+        # 构造兼容非流式解析的返回结构
+        return {
+            "choices": [
+                {
+                    "message": {
+                        "role": "assistant",
+                        "content": joined_content
                     }
-                ]
-            }
-            
-        except httpx.HTTPStatusError as e:
-            log.error(f"HTTPError {e}")
-            await response.aread() # 确保读取响应体以便打印
-            log.error(f"Response body: {response.text}")
-            raise
+                }
+            ]
+        }
+        
+    except httpx.HTTPStatusError as e:
+        log.error(f"HTTPError {e}")
+        await response.aread() # 确保读取响应体以便打印
+        log.error(f"Response body: {response.text}")
+        raise
+
+def _truncate_image_blob(value: str) -> str:
+    return value[:20] + "...[base64]..." if len(value) > 50 else value
+
+def _payload_preview(payload: dict) -> dict:
+    """
+    构造用于日志的 payload 预览：截断图片 base64（只浅拷贝相关分支，不修改原 payload）
+    """
+    return map_image_blobs(payload, _truncate_image_blob)
 
 async def _post_raw(
     url: str,
     api_key: str,
     payload: dict,
     timeout: int,
+    client: Optional[httpx.AsyncClient] = None,
 ) -> dict:
     """
     统一的 POST，不拼接路径，由调用方传入完整 URL
@@ -95,36 +149,81 @@ async def _post_raw(
 
     log.info(f"POST {url}")
     
-    # 调试打印 payload，截断 base64
+    # 调试打印 payload，截断 base64（INFO 关闭时完全跳过）
+    if log.isEnabledFor(logging.INFO):
+        try:
+            preview = serialize_payload(_payload_preview(payload)).decode("utf-8")
+            log.info(f"Payload Preview: {preview}")
+        except Exception:
+            pass
+
+    if client is None:
+        client = get_async_client()
+    body = json_body(headers, payload)
     try:
-        debug_payload = json.loads(json.dumps(payload))
-        if "messages" in debug_payload:
-            for msg in debug_payload["messages"]:
-                if isinstance(msg.get("content"), list):
-                    for part in msg["content"]:
-                        if part.get("type") == "image_url":
-                            url_str = part["image_url"].get("url", "")
-                            if len(url_str) > 50:
-                                part["image_url"]["url"] = url_str[:20] + "...[base64]..."
-        elif "contents" in debug_payload:
-             for content in debug_payload["contents"]:
-                 for part in content.get("parts", []):
-                     if "inline_data" in part:
-                         part["inline_data"]["data"] = " ...[base64]... "
-                         
-        log.info(f"Payload Preview: {json.dumps(debug_payload, ensure_ascii=False)}")
-    except Exception:
+        resp = await client.post(
+            url, headers=headers, content=body,
+            timeout=httpx.Timeout(timeout),
+        )
+        log.info(f"status={resp.status_code}")
+        resp.raise_for_status()
+        return deserialize_response(resp.content)
+    except httpx.HTTPStatusError as e:
+        log.error(f"HTTPError {e}")
+        log.error(f"Response body: {e.response.text}")
+        raise
+
+def _read_file_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+def _save_image_bytes(save_path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(save_path)), exist_ok=True)
+    with open(save_path, "wb") as f:
+        f.write(data)
+
+def _save_image_b64(save_path: str, b64: str) -> None:
+    _save_image_bytes(save_path, _b64decode(b64))
+
+_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# 下载内容攒够该大小再交给线程池写盘，避免每个 64KB 分块都切换一次线程
+_DOWNLOAD_FLUSH_BYTES = 1024 * 1024
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
         pass
 
-    async with httpx.AsyncClient(timeout=httpx.Timeout(timeout), http2=False) as client:
+async def _download_to_file(client: httpx.AsyncClient, url: str, save_path: str, timeout: int) -> None:
+    """
+    流式下载 url 到 save_path：先写入同目录的 .part 临时文件（按 _DOWNLOAD_FLUSH_BYTES 批量写盘，
+    写盘在线程池中执行），完整下载后原子替换为 save_path；中途失败或超时则删除临时文件，
+    不会留下被截断的结果文件。
+    """
+    await run_in_encode_pool(os.makedirs, os.path.dirname(os.path.abspath(save_path)), 0o777, True)
+    part_path = f"{save_path}.{uuid.uuid4().hex}.part"
+    async with client.stream("GET", url, timeout=httpx.Timeout(timeout)) as resp:
+        resp.raise_for_status()
+        f = await run_in_encode_pool(open, part_path, "wb")
         try:
-            resp = await client.post(url, headers=headers, json=payload)
-            log.info(f"status={resp.status_code}")
-            resp.raise_for_status()
-            return resp.json()
-        except httpx.HTTPStatusError as e:
-            log.error(f"HTTPError {e}")
-            log.error(f"Response body: {e.response.text}")
+            try:
+                pending: List[bytes] = []
+                pending_size = 0
+                async for chunk in resp.aiter_bytes(_DOWNLOAD_CHUNK_SIZE):
+                    pending.append(chunk)
+                    pending_size += len(chunk)
+                    if pending_size >= _DOWNLOAD_FLUSH_BYTES:
+                        await run_in_encode_pool(f.writelines, pending)
+                        pending, pending_size = [], 0
+                if pending:
+                    await run_in_encode_pool(f.writelines, pending)
+            finally:
+                await run_in_encode_pool(f.close)
+            await run_in_encode_pool(os.replace, part_path, save_path)
+        except BaseException:
+            # 取消时也要清理，这里直接同步删除
+            _remove_quietly(part_path)
             raise
 
 def _is_dalle_model(model: str) -> bool:
@@ -161,35 +260,39 @@ async def call_dalle_image_edit_async(
         "response_format": response_format,
     }
 
-    with open(image_path, "rb") as f:
-        files["image"] = (os.path.basename(image_path), f.read(), "image/png")
-
+    # 图片与遮罩各读取一次，在线程中并发执行，避免大图阻塞事件循环
+    read_paths = [image_path]
     if mask_path and os.path.exists(mask_path):
-        with open(mask_path, "rb") as f:
-            files["mask"] = (os.path.basename(mask_path), f.read(), "image/png")
+        read_paths.append(mask_path)
+    contents = await asyncio.gather(*(run_in_encode_pool(_read_file_bytes, p) for p in read_paths))
+
+    # 直接传 bytes：httpx 的 multipart 对 bytes 原样写出，不再额外复制
+    files["image"] = (os.path.basename(image_path), contents[0], "image/png")
+    if len(contents) > 1:
+        files["mask"] = (os.path.basename(mask_path), contents[1], "image/png")
 
     log.info(f"POST {url}")
     log.debug(f"data: {data}")
 
-    async with httpx.AsyncClient(timeout=httpx.Timeout(timeout)) as client:
-        try:
-            resp = await client.post(url, headers=headers, data=data, files=files)
-            log.info(f"status={resp.status_code}")
-            resp.raise_for_status()
-            data = resp.json()
+    client = get_async_client()
+    try:
+        resp = await client.post(url, headers=headers, data=data, files=files, timeout=httpx.Timeout(timeout))
+        log.info(f"status={resp.status_code}")
+        resp.raise_for_status()
+        data = deserialize_response(resp.content)
+        
+        if response_format == "b64_json":
+            return data["data"][0]["b64_json"]
+        else:
+            image_url = data["data"][0]["url"]
+            image_resp = await client.get(image_url, timeout=httpx.Timeout(timeout))
+            image_resp.raise_for_status()
+            return encode_bytes_to_base64(image_resp.content)
             
-            if response_format == "b64_json":
-                return data["data"][0]["b64_json"]
-            else:
-                image_url = data["data"][0]["url"]
-                image_resp = await client.get(image_url)
-                image_resp.raise_for_status()
-                return base64.b64encode(image_resp.content).decode("utf-8")
-                
-        except httpx.HTTPStatusError as e:
-            log.error(f"HTTPError {e}")
-            log.error(f"Response body: {e.response.text}")
-            raise
+    except httpx.HTTPStatusError as e:
+        log.error(f"HTTPError {e}")
+        log.error(f"Response body: {e.response.text}")
+        raise
 
 async def gemini_multi_image_edit_async(
     prompt: str,
@@ -205,13 +308,14 @@ async def gemini_multi_image_edit_async(
     """
     专门针对 Gemini 的多图编辑
     """
-    image_b64_list = []
     for img_path in image_paths:
         if not os.path.exists(img_path):
             raise FileNotFoundError(f"Image not found: {img_path}")
-        
-        b64, fmt = _encode_image_to_base64(img_path)
-        image_b64_list.append((b64, fmt))
+
+    # 各图片的读取 / 压缩 / base64 编码在线程中并行执行（gather 保持原顺序）
+    image_b64_list = list(await asyncio.gather(
+        *(run_in_encode_pool(_encode_image_to_base64, p) for p in image_paths)
+    ))
         
     # 根据 Provider 选择策略
     provider = get_provider(api_url, model)
@@ -245,9 +349,7 @@ async def gemini_multi_image_edit_async(
         log.error(f"Full response: {resp_data}")
         raise
         
-    os.makedirs(os.path.dirname(os.path.abspath(save_path)), exist_ok=True)
-    with open(save_path, "wb") as f:
-        f.write(base64.b64decode(b64_res))
+    await run_in_encode_pool(_save_image_b64, save_path, b64_res)
         
     log.info(f"Multi-image edit saved to {save_path}")
     return b64_res
@@ -272,11 +374,15 @@ async def generate_or_edit_and_save_image_async(
     style: str = "vivid",
     response_format: str = "b64_json",
     timeout: int = 120,
+    return_base64: bool = True,
     **kwargs,
 ) -> str:
     """
     根据模型类型选择不同的API进行图像生成/编辑
     重构后：使用 Strategy Pattern 自动匹配 Provider
+
+    默认返回图片的 Base64 字符串；只需要落盘文件的调用方可传 return_base64=False，
+    此时返回 save_path，服务商返回图片 URL 时也不再把下载内容重新编码为 Base64。
     """
     
     # 动态调整超时（保留原有针对 Gemini-3 Pro 的逻辑）
@@ -305,7 +411,7 @@ async def generate_or_edit_and_save_image_async(
                 raise ValueError("Edit模式必须提供image_path")
             
             # 读取并编码图片
-            b64_input, fmt = _encode_image_to_base64(image_path)
+            b64_input, fmt = await run_in_encode_pool(_encode_image_to_base64, image_path)
             
             url, payload, is_stream = provider.build_edit_request(
                 api_url=api_url,
@@ -348,16 +454,16 @@ async def generate_or_edit_and_save_image_async(
                 "Authorization": f"Bearer {api_key}",
             }
             
-            async with httpx.AsyncClient(timeout=httpx.Timeout(timeout)) as client:
-                try:
-                    resp = await client.post(url, headers=headers, data=data, files=files)
-                    log.info(f"status={resp.status_code}")
-                    resp.raise_for_status()
-                    resp_data = resp.json()
-                except httpx.HTTPStatusError as e:
-                    log.error(f"HTTPError {e}")
-                    log.error(f"Response body: {e.response.text}")
-                    raise
+            client = get_async_client()
+            try:
+                resp = await client.post(url, headers=headers, data=data, files=files, timeout=httpx.Timeout(timeout))
+                log.info(f"status={resp.status_code}")
+                resp.raise_for_status()
+                resp_data = deserialize_response(resp.content)
+            except httpx.HTTPStatusError as e:
+                log.error(f"HTTPError {e}")
+                log.error(f"Response body: {e.response.text}")
+                raise
         elif is_stream:
             resp_data = await _post_stream_and_accumulate(url, api_key, payload, timeout)
         else:
@@ -368,25 +474,25 @@ async def generate_or_edit_and_save_image_async(
         # 因为 DALL-E/GPT-Image 的返回结构通常是一样的
         b64 = provider.parse_generation_response(resp_data)
 
-    # 保存文件
-    os.makedirs(os.path.dirname(os.path.abspath(save_path)), exist_ok=True)
-    
+    # 保存文件（目录创建、解码与写盘放到线程中执行）
     # 检查是否返回的是 URL (例如 GPT-Image-1)
     if b64.startswith("http"):
         log.info(f"Received URL, downloading image: {b64}")
-        async with httpx.AsyncClient(timeout=httpx.Timeout(timeout)) as client:
-            resp = await client.get(b64)
+        client = get_async_client()
+        if return_base64:
+            resp = await client.get(b64, timeout=httpx.Timeout(timeout))
             resp.raise_for_status()
-            with open(save_path, "wb") as f:
-                f.write(resp.content)
+            await run_in_encode_pool(_save_image_bytes, save_path, resp.content)
             # 同时更新 b64 变量为实际的 base64 内容，以便保持返回值一致性
-            b64 = base64.b64encode(resp.content).decode("utf-8")
+            b64 = encode_bytes_to_base64(resp.content)
+        else:
+            # 不需要 base64 时边下载边写盘，不把整张图留在内存中
+            await _download_to_file(client, b64, save_path, timeout)
     else:
-        with open(save_path, "wb") as f:
-            f.write(base64.b64decode(b64))
+        await run_in_encode_pool(_save_image_b64, save_path, b64)
 
     log.info(f"图片已保存至 {save_path}")
-    return b64
+    return b64 if return_base64 else save_path
 
 if __name__ == "__main__":
     import asyncio
@@ -2,8 +2,9 @@ import os
 import httpx
 from typing import List, Dict, Any, Optional
 from dataflow_agent.logger import get_logger
-from dataflow_agent.toolkits.multimodaltool.utils import encode_image_to_base64
-from dataflow_agent.toolkits.multimodaltool.providers import get_provider
+from dataflow_agent.toolkits.multimodaltool.utils import encode_image_to_base64, run_in_encode_pool
+from dataflow_agent.toolkits.multimodaltool.providers import get_provider, serialize_payload, deserialize_response
+from dataflow_agent.toolkits.multimodaltool.http_client import get_async_client
 
 log = get_logger(__name__)
 
@@ -12,6 +13,7 @@ async def _post_raw(
     api_key: str,
     payload: dict,
     timeout: int,
+    client: Optional[httpx.AsyncClient] = None,
 ) -> dict:
     """Helper for POST request"""
     headers = {
@@ -21,17 +23,21 @@ async def _post_raw(
     
     log.info(f"[OCR] POST {url}")
     
-    async with httpx.AsyncClient(timeout=httpx.Timeout(timeout)) as client:
-        try:
-            resp = await client.post(url, headers=headers, json=payload)
-            resp.raise_for_status()
-            return resp.json()
-        except httpx.HTTPStatusError as e:
-            log.error(f"OCR Request failed: {e.response.text}")
-            raise
-        except Exception as e:
-            log.error(f"OCR Error: {e}")
-            raise
+    if client is None:
+        client = get_async_client()
+    try:
+        resp = await client.post(
+            url, headers=headers, content=serialize_payload(payload),
+            timeout=httpx.Timeout(timeout),
+        )
+        resp.raise_for_status()
+        return deserialize_response(resp.content)
+    except httpx.HTTPStatusError as e:
+        log.error(f"OCR Request failed: {e.response.text}")
+        raise
+    except Exception as e:
+        log.error(f"OCR Error: {e}")
+        raise
 
 async def call_ocr_async(
     model: str,
@@ -49,37 +55,38 @@ async def call_ocr_async(
     使用 Provider 策略进行请求构建
     """
     
-    # 1. 准备消息列表 (深拷贝以避免修改原列表)
-    processed_messages = [msg.copy() for msg in messages]
+    # 1. 准备消息列表：不带图片时直接使用原列表；注入图片时只重建目标消息，其余消息共享引用
+    processed_messages = messages
     
     # 2. 处理图像注入 (这部分逻辑通常是通用的，可以在这里保留，也可以移到 Provider)
     # 目前保持在这里，因为这是业务层面的“如何组合消息”
     if image_path:
-        b64, fmt = encode_image_to_base64(image_path)
+        b64, fmt = await run_in_encode_pool(encode_image_to_base64, image_path)
+        image_part = {"type": "image_url", "image_url": {"url": f"data:image/{fmt};base64,{b64}"}}
+        processed_messages = list(messages)
         
         # 找到最后一条 user 消息注入图片
-        target_msg = None
-        for m in reversed(processed_messages):
-            if m["role"] == "user":
-                target_msg = m
+        target_idx = None
+        for i in range(len(processed_messages) - 1, -1, -1):
+            if processed_messages[i]["role"] == "user":
+                target_idx = i
                 break
         
-        if target_msg:
+        if target_idx is not None:
+            target_msg = processed_messages[target_idx]
             original_text = target_msg.get("content", "")
             if isinstance(original_text, str):
-                target_msg["content"] = [
-                    {"type": "image_url", "image_url": {"url": f"data:image/{fmt};base64,{b64}"}},
-                    {"type": "text", "text": original_text}
-                ]
+                processed_messages[target_idx] = {
+                    **target_msg,
+                    "content": [image_part, {"type": "text", "text": original_text}],
+                }
             elif isinstance(original_text, list):
-                target_msg["content"].append(
-                    {"type": "image_url", "image_url": {"url": f"data:image/{fmt};base64,{b64}"}}
-                )
+                processed_messages[target_idx] = {**target_msg, "content": [*original_text, image_part]}
         else:
             processed_messages.append({
                 "role": "user",
                 "content": [
-                    {"type": "image_url", "image_url": {"url": f"data:image/{fmt};base64,{b64}"}},
+                    image_part,
                     {"type": "text", "text": "Describe this image."}
                 ]
             })
@@ -1,13 +1,42 @@
 import os
-import wave
-import base64
+import struct
 from typing import Optional
 from dataflow_agent.logger import get_logger
 from dataflow_agent.toolkits.multimodaltool.providers import get_provider
 from dataflow_agent.toolkits.multimodaltool.req_img import _post_raw
+from dataflow_agent.toolkits.multimodaltool.utils import run_in_encode_pool
 
 log = get_logger(__name__)
 
+# Gemini TTS 输出的 PCM 参数 (24kHz, 16bit, Mono as per user doc)
+_WAV_CHANNELS = 1
+_WAV_SAMPLE_WIDTH = 2      # 16 bit = 2 bytes
+_WAV_FRAME_RATE = 24000
+_WAV_FMT_CHUNK = b"WAVEfmt " + struct.pack(
+    "<IHHIIHH",
+    16,                                                     # fmt chunk size
+    1,                                                      # PCM
+    _WAV_CHANNELS,
+    _WAV_FRAME_RATE,
+    _WAV_FRAME_RATE * _WAV_CHANNELS * _WAV_SAMPLE_WIDTH,    # byte rate
+    _WAV_CHANNELS * _WAV_SAMPLE_WIDTH,                      # block align
+    _WAV_SAMPLE_WIDTH * 8,                                  # bits per sample
+)
+
+def _wav_header(data_size: int) -> bytes:
+    """44 字节的 PCM WAV 文件头（只有两个长度字段随数据变化）"""
+    return (
+        b"RIFF" + struct.pack("<I", 36 + data_size)
+        + _WAV_FMT_CHUNK
+        + b"data" + struct.pack("<I", data_size)
+    )
+
+def _save_wav(save_path: str, audio_bytes: bytes) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(save_path)), exist_ok=True)
+    with open(save_path, "wb") as f:
+        f.write(_wav_header(len(audio_bytes)))
+        f.write(audio_bytes)
+
 async def generate_speech_and_save_async(
     text: str,
     save_path: str,
@@ -46,14 +75,8 @@ async def generate_speech_and_save_async(
         log.error(f"Response: {resp_data}")
         raise
     
-    os.makedirs(os.path.dirname(os.path.abspath(save_path)), exist_ok=True)
-    
-    # Save as WAV (assuming 24kHz, 16bit, Mono as per user doc)
-    with wave.open(save_path, "wb") as wav_file:
-        wav_file.setnchannels(1)        # 1 Channel
-        wav_file.setsampwidth(2)        # 16 bit = 2 bytes
-        wav_file.setframerate(24000)    # 24kHz
-        wav_file.writeframes(audio_bytes)
+    # Save as WAV：直接写固定文件头 + PCM 数据，放到线程池中执行避免阻塞事件循环
+    await run_in_encode_pool(_save_wav, save_path, audio_bytes)
         
     log.info(f"Audio saved to {save_path}")
     return save_path
@@ -4,9 +4,10 @@ from typing import List, Dict, Any, Optional
 
 from dataflow_agent.logger import get_logger
 from dataflow_agent.toolkits.multimodaltool.utils import (
-    encode_image_to_base64
+    encode_image_to_base64, run_in_encode_pool
 )
-from dataflow_agent.toolkits.multimodaltool.providers import get_provider
+from dataflow_agent.toolkits.multimodaltool.providers import get_provider, serialize_payload, deserialize_response
+from dataflow_agent.toolkits.multimodaltool.http_client import get_async_client
 
 log = get_logger(__name__)
 
@@ -15,6 +16,7 @@ async def _post_raw(
     api_key: str,
     payload: dict,
     timeout: int,
+    client: Optional[httpx.AsyncClient] = None,
 ) -> dict:
     """Helper for POST request"""
     headers = {
@@ -24,10 +26,14 @@ async def _post_raw(
     
     log.info(f"[Understanding] POST {url}")
     
-    async with httpx.AsyncClient(timeout=httpx.Timeout(timeout)) as client:
-        resp = await client.post(url, headers=headers, json=payload)
-        resp.raise_for_status()
-        return resp.json()
+    if client is None:
+        client = get_async_client()
+    resp = await client.post(
+        url, headers=headers, content=serialize_payload(payload),
+        timeout=httpx.Timeout(timeout),
+    )
+    resp.raise_for_status()
+    return deserialize_response(resp.content)
 
 async def call_image_understanding_async(
     model: str,
@@ -44,38 +50,33 @@ async def call_image_understanding_async(
     调用通用图像理解模型
     """
     
-    # 1. 准备消息
-    processed_messages = [msg.copy() for msg in messages]
+    # 1. 准备消息：不带图片时直接使用原列表；注入图片时只重建最后一条消息，其余消息共享引用
+    processed_messages = messages
 
     # 2. 处理图像
     if image_path:
-        b64, fmt = encode_image_to_base64(image_path)
+        b64, fmt = await run_in_encode_pool(encode_image_to_base64, image_path)
+        image_part = {"type": "image_url", "image_url": {"url": f"data:image/{fmt};base64,{b64}"}}
+        processed_messages = list(messages)
         
-        target_msg = None
-        if processed_messages:
+        if processed_messages and processed_messages[-1]["role"] == "user":
             last_msg = processed_messages[-1]
-            if last_msg["role"] == "user":
-                target_msg = last_msg
-
-        if target_msg:
-            original_content = target_msg["content"]
+            original_content = last_msg["content"]
             
             if isinstance(original_content, str):
-                target_msg["content"] = [
-                    {"type": "text", "text": original_content},
-                    {"type": "image_url", "image_url": {"url": f"data:image/{fmt};base64,{b64}"}}
-                ]
+                processed_messages[-1] = {
+                    **last_msg,
+                    "content": [{"type": "text", "text": original_content}, image_part],
+                }
             elif isinstance(original_content, list):
-                target_msg["content"].append(
-                    {"type": "image_url", "image_url": {"url": f"data:image/{fmt};base64,{b64}"}}
-                )
+                processed_messages[-1] = {**last_msg, "content": [*original_content, image_part]}
         else:
              # 如果没有 user 消息或列表为空，追加一条
             processed_messages.append({
                 "role": "user",
                 "content": [
                     {"type": "text", "text": "Describe this image."},
-                    {"type": "image_url", "image_url": {"url": f"data:image/{fmt};base64,{b64}"}}
+                    image_part
                 ]
             })
 
@@ -1,102 +1,569 @@
 import os
-import base64
+import glob
+import hashlib
+import random
+import shutil
+import tempfile
+import asyncio
 import httpx
 import subprocess
+import time
 import uuid
-from typing import List, Dict, Any, Optional
+import weakref
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple
 from dataflow_agent.logger import get_logger
-from dataflow_agent.toolkits.multimodaltool.providers import get_provider
+from dataflow_agent.toolkits.multimodaltool.providers import get_provider, deserialize_response
+from dataflow_agent.toolkits.multimodaltool.http_client import get_async_client, json_body
+
+try:
+    from pybase64 import b64encode as _b64encode  # SIMD 加速的 base64 编码
+except ImportError:
+    from base64 import b64encode as _b64encode
 
 log = get_logger(__name__)
 
-def _compress_video(input_path: str) -> str:
+@lru_cache(maxsize=None)
+def _ffmpeg_list(option: str) -> str:
+    """`ffmpeg -hide_banner <option>`（-encoders / -hwaccels）的输出，每种只探测一次；找不到 ffmpeg 时返回空串"""
+    try:
+        proc = subprocess.run(
+            ["ffmpeg", "-hide_banner", option],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+        )
+    except OSError:
+        return ""
+    return proc.stdout
+
+
+# 硬件加速方式 -> 对应的 H.264 编码器（按优先级）
+_HW_ENCODERS = (("cuda", "h264_nvenc"), ("qsv", "h264_qsv"), ("vaapi", "h264_vaapi"))
+_VAAPI_DEVICE = "/dev/dri/renderD128"
+
+
+@lru_cache(maxsize=1)
+def _hw_accels() -> Tuple[str, ...]:
     """
-    使用 ffmpeg 压缩视频。
-    返回压缩后的临时文件路径，如果失败返回原路径。
+    本机 ffmpeg 可用的硬件转码方式（按 _HW_ENCODERS 的优先级），
+    要求 -hwaccels 中列出该方式且 -encoders 中有对应编码器；VAAPI 还要求渲染节点存在。
     """
-    output_path = f"/tmp/compressed_{uuid.uuid4()}.mp4"
-    
-    # 压缩策略：缩放至720p，CRF 28 (平衡画质与大小)
-    cmd = [
+    # -hwaccels 输出首行是标题 "Hardware acceleration methods:"
+    hwaccels = {line.strip() for line in _ffmpeg_list("-hwaccels").splitlines()[1:]}
+    encoders = set(_ffmpeg_list("-encoders").split())
+    return tuple(
+        accel for accel, encoder in _HW_ENCODERS
+        if accel in hwaccels and encoder in encoders
+        and (accel != "vaapi" or os.path.exists(_VAAPI_DEVICE))
+    )
+
+
+# 接口允许的视频大小上限；压缩目标留出余量，保证输出落在上限内
+_MAX_VIDEO_BYTES = 20 * 1024 * 1024
+# 请求体上限（Gemini OpenAI 兼容接口约 32MB），按 base64 编码后的大小计算
+_MAX_PAYLOAD_BYTES = 32 * 1024 * 1024
+_TARGET_VIDEO_BYTES = 18 * 1024 * 1024
+_AUDIO_BITRATE = 128 * 1000
+_MIN_VIDEO_BITRATE = 100 * 1000
+
+# 压缩结果缓存目录（默认位于系统临时目录下）及容量 / 时效上限，超出时按最近使用时间淘汰
+_COMPRESS_CACHE_DIR = os.getenv(
+    "VIDEO_COMPRESS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "paper2any_video_cache")
+)
+_COMPRESS_CACHE_MAX_BYTES = int(os.getenv("VIDEO_COMPRESS_CACHE_MAX_MB", "500")) * 1024 * 1024
+_COMPRESS_CACHE_MAX_AGE = float(os.getenv("VIDEO_COMPRESS_CACHE_MAX_AGE_HOURS", "24")) * 3600
+
+# 按 3 的整数倍分块读取，各块独立编码后直接拼接即与整体编码结果一致
+_B64_READ_CHUNK = 57 * 1024
+# ffmpeg 写入不可 seek 的管道时必须输出分片 mp4（moov 在前，无需回写文件头）
+_PIPE_MP4 = ["-f", "mp4", "-movflags", "frag_keyframe+empty_moov", "pipe:1"]
+
+
+# 同时运行的 ffmpeg 进程数上限（ffmpeg 自身是多线程的，并发过多只会互相抢 CPU）
+_FFMPEG_CONCURRENCY = max(1, (os.cpu_count() or 2) // 2)
+# 同时上传的视频请求数上限（视频接口通常在 4 个左右并发时开始限流）
+# 至少为 1：0 或负数会得到永远无法获取的信号量，所有上传都会卡住
+_UPLOAD_CONCURRENCY = max(1, int(os.getenv("VIDEO_MAX_CONCURRENCY", "4")))
+
+_SemaphoreCache = "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]"
+_ffmpeg_sems: _SemaphoreCache = weakref.WeakKeyDictionary()
+_upload_sems: _SemaphoreCache = weakref.WeakKeyDictionary()
+
+
+def _loop_semaphore(sems: _SemaphoreCache, limit: int) -> asyncio.Semaphore:
+    """当前事件循环的信号量（与 http_client 一样按循环缓存，兼容多次 asyncio.run）"""
+    loop = asyncio.get_running_loop()
+    sem = sems.get(loop)
+    if sem is None:
+        sem = sems[loop] = asyncio.Semaphore(limit)
+    return sem
+
+
+def _ffmpeg_semaphore() -> asyncio.Semaphore:
+    return _loop_semaphore(_ffmpeg_sems, _FFMPEG_CONCURRENCY)
+
+
+def _upload_semaphore() -> asyncio.Semaphore:
+    return _loop_semaphore(_upload_sems, _UPLOAD_CONCURRENCY)
+
+
+async def _run_cmd(cmd: List[str]) -> bytes:
+    """
+    异步执行外部命令（不阻塞事件循环），返回 stdout；
+    返回码非 0 时抛出 subprocess.CalledProcessError（携带 stderr）。
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        out, err = await proc.communicate()
+    except asyncio.CancelledError:
+        # 调用方被取消时不留下孤儿 ffmpeg 进程
+        proc.kill()
+        await proc.wait()
+        raise
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, out, err)
+    return out
+
+
+def _discard_tee(tee, part_path: str) -> None:
+    """关闭并删除未完成的缓存文件（尽力而为）"""
+    try:
+        tee.close()
+    except OSError:
+        pass
+    try:
+        os.remove(part_path)
+    except OSError:
+        pass
+
+
+async def _run_ffmpeg_to_base64(
+    cmd: List[str],
+    tee_path: Optional[str] = None,
+) -> Tuple[bytearray, int]:
+    """
+    执行输出到 stdout 的 ffmpeg 命令，边读边做 Base64 编码（压缩与编码重叠进行）。
+    tee_path 不为空时同时把原始视频写入该文件（先写 .part，成功后原子替换），用作压缩结果缓存；
+    缓存写入是尽力而为的：写失败（如磁盘已满）只丢弃缓存文件，编码照常完成。
+    返回 (Base64 字节, 原始视频字节数)；返回码非 0 时抛出 subprocess.CalledProcessError。
+    无论以何种方式退出，仍在运行的 ffmpeg 都会被终止并回收。
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+    )
+    # stderr 需要并发读取，否则 ffmpeg 日志写满管道后会阻塞住 stdout
+    stderr_task = asyncio.ensure_future(proc.stderr.read())
+    out = bytearray()
+    raw_size = 0
+    pending = b""
+    part_path = f"{tee_path}.{uuid.uuid4().hex}.part" if tee_path else None
+    tee = None
+    if part_path:
+        try:
+            tee = open(part_path, "wb")
+        except OSError as e:
+            log.warning(f"Compressed video cache disabled for this run: {e}")
+    try:
+        while chunk := await proc.stdout.read(_B64_READ_CHUNK):
+            raw_size += len(chunk)
+            if tee is not None:
+                try:
+                    await asyncio.to_thread(tee.write, chunk)
+                except OSError as e:
+                    log.warning(f"Compressed video cache write failed, continuing without cache: {e}")
+                    _discard_tee(tee, part_path)
+                    tee = None
+            # 管道每次返回的长度不定：只编码 3 的整数倍，余下的字节并入下一块
+            data = pending + chunk if pending else chunk
+            cut = len(data) - len(data) % 3
+            out += _b64encode(memoryview(data)[:cut])
+            pending = data[cut:]
+        out += _b64encode(pending)
+        err = await stderr_task
+        await proc.wait()
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd, None, err)
+        if tee is not None:
+            try:
+                tee.close()
+                os.replace(part_path, tee_path)
+            except OSError as e:
+                log.warning(f"Failed to store compressed video cache: {e}")
+                _discard_tee(tee, part_path)
+            tee = None
+    finally:
+        # 取消或任何异常（包括读写出错）都不能留下阻塞在满管道上的 ffmpeg
+        if proc.returncode is None:
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+            await proc.wait()
+        if not stderr_task.done():
+            stderr_task.cancel()
+        if tee is not None:
+            _discard_tee(tee, part_path)
+    return out, raw_size
+
+
+def _read_file_to_base64(path: str, prefix: bytes = b"") -> bytearray:
+    """
+    按 _B64_READ_CHUNK 分块读取文件并编码为 Base64，结果前面带上 prefix（如 data URL 头）。
+    编码后长度可由文件大小算出，输出缓冲区一次分配到位，逐块原地写入，不随增长反复扩容。
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        out = bytearray(len(prefix) + (size + 2) // 3 * 4)
+        out[:len(prefix)] = prefix
+        pos = len(prefix)
+        while chunk := f.read(_B64_READ_CHUNK):
+            enc = _b64encode(chunk)
+            out[pos:pos + len(enc)] = enc
+            pos += len(enc)
+    # 读取期间文件变短时截掉未写入的尾部
+    del out[pos:]
+    return out
+
+
+def _compressed_cache_path(input_path: str, st: os.stat_result) -> str:
+    """压缩结果的缓存路径：按 (绝对路径, mtime, 大小) 取摘要，源文件未变化时重试/批处理可直接复用"""
+    key = hashlib.blake2b(
+        f"{os.path.abspath(input_path)}:{st.st_mtime_ns}:{st.st_size}".encode(), digest_size=16
+    ).hexdigest()
+    os.makedirs(_COMPRESS_CACHE_DIR, exist_ok=True)
+    return os.path.join(_COMPRESS_CACHE_DIR, f"compressed_{key}.mp4")
+
+
+def _evict_compressed_cache() -> None:
+    """
+    清理压缩结果缓存：删除超过 _COMPRESS_CACHE_MAX_AGE 未使用的文件，
+    总大小仍超过 _COMPRESS_CACHE_MAX_BYTES 时按 mtime（命中时会刷新）从旧到新删除。
+    写入中的 .part 文件不参与统计。
+    """
+    try:
+        entries = []
+        with os.scandir(_COMPRESS_CACHE_DIR) as it:
+            for entry in it:
+                if entry.name.endswith(".mp4") and entry.is_file():
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+    except OSError:
+        return
+
+    now = time.time()
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, path in entries:
+        if now - mtime <= _COMPRESS_CACHE_MAX_AGE and total <= _COMPRESS_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
+async def _probe_duration(path: str) -> Optional[float]:
+    """用 ffprobe 读取时长（秒），失败返回 None"""
+    try:
+        out = await _run_cmd(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+             "-of", "default=nw=1:nk=1", path]
+        )
+        duration = float(out.strip())
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+    return duration if duration > 0 else None
+
+
+async def _probe_codec(path: str) -> Optional[str]:
+    """用 ffprobe 读取首个视频流的编码名（如 h264 / hevc），失败返回 None"""
+    try:
+        out = await _run_cmd(
+            ["ffprobe", "-v", "error", "-select_streams", "v:0",
+             "-show_entries", "stream=codec_name", "-of", "csv=p=0", path]
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.decode("ascii", "replace").strip() or None
+
+
+async def _remux_to_base64(input_path: str, cache_path: str) -> Optional[Tuple[bytearray, int]]:
+    """
+    快速路径：源视频已是 H.264/HEVC 时只做 -c copy 重封装为 mp4（不解码不编码），
+    结果不超过 _MAX_VIDEO_BYTES 则直接使用；否则返回 None，交给转码流程。
+    """
+    if await _probe_codec(input_path) not in ("h264", "hevc"):
+        return None
+    try:
+        async with _ffmpeg_semaphore():
+            out, size = await _run_ffmpeg_to_base64(
+                ["ffmpeg", "-i", input_path, "-c", "copy", *_PIPE_MP4], cache_path
+            )
+    except (OSError, subprocess.CalledProcessError) as e:
+        log.warning(f"Remux failed, falling back to transcode: {e}")
+        return None
+    if 0 < size <= _MAX_VIDEO_BYTES:
+        log.info(f"Remux success. Size: {size/1024/1024:.2f}MB")
+        return out, size
+    try:
+        # 缓存写入失败时文件可能不存在
+        os.remove(cache_path)
+    except OSError:
+        pass
+    return None
+
+
+def _target_video_bitrate(duration: Optional[float]) -> Optional[int]:
+    """按时长把视频码率压到 _TARGET_VIDEO_BYTES 以内；时长未知时返回 None（退回 CRF）"""
+    if not duration:
+        return None
+    bitrate = int(_TARGET_VIDEO_BYTES * 8 / duration) - _AUDIO_BITRATE
+    return max(bitrate, _MIN_VIDEO_BITRATE)
+
+
+def _compress_cmds(
+    input_path: str,
+    bitrate: Optional[int],
+    passlog: str,
+    hw_accels: Tuple[str, ...],
+) -> List[List[List[str]]]:
+    """
+    按优先级返回候选压缩方案（每个方案是依次执行的一组命令），前一个失败时尝试下一个：
+    1. cuda：NVDEC(h264_cuvid) 解码 + scale_cuda + NVENC 编码，全程留在 GPU；
+       某些构建没有 h264_cuvid（Unknown decoder），再退化为仅 -hwaccel cuda；
+    2. qsv：Intel Quick Sync 解码 + scale_qsv + h264_qsv；
+    3. vaapi：VAAPI 解码 + scale_vaapi + h264_vaapi；
+    4. CPU libx264（ultrafast）。
+
+    bitrate 不为 None 时按目标码率限速（libx264 走两遍编码），否则使用 CRF 28（libx264 为 30）或等效的质量参数。
+    hw_accels 为 _hw_accels() 的结果，只为可用的硬件方式生成方案。
+    每个方案的最后一条命令把分片 mp4 写到 stdout（见 _run_ffmpeg_to_base64）。
+    """
+    tail = ["-c:a", "aac", "-b:a", "128k", *_PIPE_MP4]
+    rate = ["-b:v", str(bitrate), "-maxrate", str(bitrate), "-bufsize", str(bitrate * 2)] if bitrate else []
+    plans: List[List[List[str]]] = []
+    if "cuda" in hw_accels:
+        nvenc = [
+            "-vf", "scale_cuda='min(1280,iw)':-2",
+            "-c:v", "h264_nvenc", "-preset", "p4", "-rc", "vbr",
+        ] + (rate or ["-cq", "28", "-b:v", "0"])
+        hwaccel = ["ffmpeg", "-y", "-hwaccel", "cuda", "-hwaccel_output_format", "cuda"]
+        plans.append([hwaccel + ["-c:v", "h264_cuvid", "-i", input_path] + nvenc + tail])
+        plans.append([hwaccel + ["-i", input_path] + nvenc + tail])
+    if "qsv" in hw_accels:
+        plans.append([[
+            "ffmpeg", "-y", "-hwaccel", "qsv", "-hwaccel_output_format", "qsv", "-i", input_path,
+            "-vf", "scale_qsv=w='min(1280,iw)':h=-2",
+            "-c:v", "h264_qsv", "-preset", "faster",
+        ] + (rate or ["-global_quality", "28"]) + tail])
+    if "vaapi" in hw_accels:
+        plans.append([[
+            "ffmpeg", "-y", "-hwaccel", "vaapi", "-hwaccel_device", _VAAPI_DEVICE,
+            "-hwaccel_output_format", "vaapi", "-i", input_path,
+            "-vf", "scale_vaapi=w='min(1280,iw)':h=-2",
+            "-c:v", "h264_vaapi",
+        ] + (rate or ["-rc_mode", "CQP", "-qp", "28"]) + tail])
+
+    # 压缩策略：缩放至720p；输出只给模型看一次，用 ultrafast + fastdecode 以速度换码率效率
+    x264 = [
         "ffmpeg", "-y", "-i", input_path,
-        "-c:v", "libx264", "-crf", "28", "-preset", "faster",
+        "-c:v", "libx264", "-preset", "ultrafast", "-tune", "fastdecode",
         "-vf", "scale='min(1280,iw)':-2",
-        "-c:a", "aac", "-b:a", "128k",
-        output_path
     ]
-    
+    if bitrate:
+        two_pass = x264 + rate + ["-passlogfile", passlog, "-pass"]
+        plans.append([
+            two_pass + ["1", "-an", "-f", "null", os.devnull],
+            two_pass + ["2"] + tail,
+        ])
+    else:
+        # CRF 30（ultrafast 下码率效率较低，略放宽质量以控制大小）
+        plans.append([x264 + ["-crf", "30"] + tail])
+    return plans
+
+
+async def _compress_video_to_base64(
+    input_path: str,
+    st: os.stat_result,
+) -> Optional[Tuple[bytearray, int]]:
+    """
+    使用 ffmpeg 压缩视频：H.264/HEVC 源先尝试仅重封装；否则转码（有硬件编码器时优先走 GPU），
+    按时长计算码率使输出不超过约 18MB。ffmpeg 输出经管道边压缩边编码。
+    压缩结果同时写入按源文件 (路径, mtime, 大小) 命名的缓存文件，同一视频再次调用时直接读取。
+    返回 (Base64 字节, 压缩后字节数)，全部方案失败时返回 None。
+    """
+    cache_path = _compressed_cache_path(input_path, st)
+    try:
+        cached_size = os.stat(cache_path).st_size
+    except FileNotFoundError:
+        cached_size = 0
+    if cached_size:
+        log.info(f"Using cached compressed video: {cache_path}")
+        try:
+            # 刷新 mtime，淘汰时按最近使用排序
+            os.utime(cache_path)
+        except OSError:
+            pass
+        return await asyncio.to_thread(_read_file_to_base64, cache_path), cached_size
+
     log.info(f"Compressing video > 20MB: {input_path}")
+    remuxed = await _remux_to_base64(input_path, cache_path)
+    if remuxed is not None:
+        await asyncio.to_thread(_evict_compressed_cache)
+        return remuxed
+
+    # 探测 ffmpeg 硬件加速能力只在首次调用时真正执行，放到线程里避免阻塞事件循环
+    hw_accels = await asyncio.to_thread(_hw_accels)
+    bitrate = _target_video_bitrate(await _probe_duration(input_path))
+    passlog = f"/tmp/ffpass_{uuid.uuid4()}"
+
+    log.info(f"Transcoding {input_path} (video bitrate: {bitrate or 'crf'})")
     try:
-        subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if os.path.exists(output_path):
-            new_size = os.path.getsize(output_path)
-            log.info(f"Compression success. Size: {new_size/1024/1024:.2f}MB")
-            return output_path
-    except subprocess.CalledProcessError as e:
-        log.error(f"FFmpeg compression failed: {e.stderr.decode() if e.stderr else str(e)}")
-    except Exception as e:
-        log.error(f"Compression error: {e}")
-    
-    return input_path
+        for plan in _compress_cmds(input_path, bitrate, passlog, hw_accels):
+            try:
+                async with _ffmpeg_semaphore():
+                    for cmd in plan[:-1]:
+                        await _run_cmd(cmd)
+                    out, new_size = await _run_ffmpeg_to_base64(plan[-1], cache_path)
+                if new_size:
+                    log.info(f"Compression success. Size: {new_size/1024/1024:.2f}MB")
+                    await asyncio.to_thread(_evict_compressed_cache)
+                    return out, new_size
+            except subprocess.CalledProcessError as e:
+                log.error(f"FFmpeg compression failed: {e.stderr.decode() if e.stderr else str(e)}")
+            except Exception as e:
+                log.error(f"Compression error: {e}")
+    finally:
+        # 清理两遍编码的统计文件（passlog-0.log / passlog-0.log.mbtree）
+        for leftover in glob.glob(f"{passlog}*"):
+            try:
+                os.remove(leftover)
+            except OSError:
+                pass
+
+    return None
+
+# 默认 MIME 类型处理
+_VIDEO_MIME = {
+    "mp4": "video/mp4",
+    "mov": "video/quicktime",
+    "quicktime": "video/quicktime",
+    "avi": "video/x-msvideo",
+    "mpeg": "video/mpeg",
+    "wmv": "video/x-ms-wmv"
+}
 
-def _encode_video_to_base64(video_path: str) -> tuple[str, str]:
+async def _encode_video_to_base64(
+    video_path: str,
+    max_b64_bytes: int = _MAX_PAYLOAD_BYTES,
+    as_data_url: bool = False,
+) -> tuple[str, str]:
     """
     读取视频文件并编码为Base64。如果视频大于20MB，尝试自动压缩。
-    返回: (base64_str, mime_type)
+    编码后的长度可由文件大小直接算出，超过 max_b64_bytes 时抛出 ValueError（未压缩时在读取前即拒绝）。
+    as_data_url=True 时直接返回 "data:<mime>;base64,..."：前缀与 base64 写在同一缓冲区后一次解码，
+    省去先解码为 str 再用 f-string 拼接产生的一整份拷贝。
+    返回: (base64_str 或 data URL, mime_type)
     """
-    if not os.path.exists(video_path):
-        raise FileNotFoundError(f"Video file not found: {video_path}")
-        
+    # 一次 stat 同时完成存在性检查与取大小
+    try:
+        st = os.stat(video_path)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Video file not found: {video_path}") from None
+    file_size = st.st_size
+
     ext = video_path.rsplit(".", 1)[-1].lower()
-    
-    # 默认 MIME 类型处理
-    mime_map = {
-        "mp4": "video/mp4",
-        "mov": "video/quicktime",
-        "quicktime": "video/quicktime",
-        "avi": "video/x-msvideo",
-        "mpeg": "video/mpeg",
-        "wmv": "video/x-ms-wmv"
-    }
-    mime_type = mime_map.get(ext, "video/mp4")
-    if ext not in mime_map:
+    mime_type = _VIDEO_MIME.get(ext)
+    if mime_type is None:
+        mime_type = "video/mp4"
         log.warning(f"Unknown video extension {ext}, defaulting to video/mp4")
 
     # 检查文件大小 (20MB)
-    file_size = os.path.getsize(video_path)
-    final_path = video_path
-    is_compressed = False
-
-    if file_size > 20 * 1024 * 1024:
+    encoded: Optional[Tuple[bytearray, int]] = None
+    if file_size > _MAX_VIDEO_BYTES:
         log.warning(f"Video size {file_size/1024/1024:.2f}MB > 20MB, attempting compression...")
-        compressed_path = _compress_video(video_path)
-        if compressed_path != video_path:
-            final_path = compressed_path
-            mime_type = "video/mp4" # ffmpeg 输出总是 mp4
-            is_compressed = True
-    
+        encoded = await _compress_video_to_base64(video_path, st)
+
+    if encoded is not None:
+        out, final_size = encoded
+        mime_type = "video/mp4" # ffmpeg 输出总是 mp4
+    else:
+        final_size = file_size
+
+    b64_size = (final_size + 2) // 3 * 4
+    if b64_size > max_b64_bytes:
+        raise ValueError(
+            f"Video still too large after compression: {final_size} bytes "
+            f"({b64_size} bytes as base64, limit {max_b64_bytes})"
+        )
+
+    prefix = f"data:{mime_type};base64,".encode("ascii") if as_data_url else b""
+    if encoded is None:
+        # 读取与编码放到线程中执行，不阻塞并发中的其他请求
+        out = await asyncio.to_thread(_read_file_to_base64, video_path, prefix)
+    elif prefix:
+        out[:0] = prefix
+    b64 = out.decode("ascii")
+
+    return b64, mime_type
+
+def _read_frames_b64(frame_paths: List[str]) -> List[str]:
+    """读取抽出的 JPEG 帧并编码为 Base64"""
+    frames = []
+    for path in frame_paths:
+        with open(path, "rb") as f:
+            frames.append(_b64encode(f.read()).decode("ascii"))
+    return frames
+
+
+async def _extract_keyframes(video_path: str, max_frames: int) -> List[str]:
+    """
+    只解码关键帧（I 帧，-skip_frame nokey），缩放至 720p 输出为 JPEG，
+    在全部关键帧中均匀选取至多 max_frames 帧，返回 Base64 列表（按时间顺序）。
+    ffmpeg 不可用或抽帧失败时返回空列表。
+    """
+    if not os.path.exists(video_path):
+        raise FileNotFoundError(f"Video file not found: {video_path}")
+
+    frame_dir = tempfile.mkdtemp(prefix="keyframes_")
     try:
-        with open(final_path, "rb") as f:
-            raw = f.read()
-        b64 = base64.b64encode(raw).decode("utf-8")
+        try:
+            async with _ffmpeg_semaphore():
+                await _run_cmd([
+                    "ffmpeg", "-y", "-skip_frame", "nokey", "-i", video_path,
+                    "-vsync", "vfr", "-vf", "scale='min(1280,iw)':-2", "-q:v", "3",
+                    os.path.join(frame_dir, "frame_%05d.jpg"),
+                ])
+        except subprocess.CalledProcessError as e:
+            log.error(f"FFmpeg keyframe extraction failed: {e.stderr.decode() if e.stderr else str(e)}")
+            return []
+        except OSError as e:
+            log.error(f"Keyframe extraction error: {e}")
+            return []
+
+        names = sorted(os.listdir(frame_dir))
+        if len(names) > max_frames:
+            step = len(names) / max_frames
+            names = [names[int(i * step)] for i in range(max_frames)]
+        return await asyncio.to_thread(_read_frames_b64, [os.path.join(frame_dir, n) for n in names])
     finally:
-        # 清理临时压缩文件
-        if is_compressed and os.path.exists(final_path):
-            try:
-                os.remove(final_path)
-                log.info(f"Removed temp compressed video: {final_path}")
-            except Exception as e:
-                log.warning(f"Failed to remove temp video: {e}")
+        shutil.rmtree(frame_dir, ignore_errors=True)
+
+
+# 上传失败（连接错误 / 超时 / 429 / 5xx）时的最大尝试次数
+_POST_MAX_ATTEMPTS = 5
 
-    return b64, mime_type
 
 async def _post_raw(
     url: str,
     api_key: str,
     payload: dict,
     timeout: int,
+    client: Optional[httpx.AsyncClient] = None,
 ) -> dict:
-    """Helper for POST request"""
+    """Helper for POST request（限制并发上传数，瞬时错误按指数退避重试）"""
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json",
@@ -104,10 +571,29 @@ async def _post_raw(
     
     log.info(f"[Video] POST {url}")
     
-    async with httpx.AsyncClient(timeout=httpx.Timeout(timeout)) as client:
-        resp = await client.post(url, headers=headers, json=payload)
-        resp.raise_for_status()
-        return resp.json()
+    if client is None:
+        client = get_async_client()
+    for attempt in range(_POST_MAX_ATTEMPTS):
+        try:
+            async with _upload_semaphore():
+                # 分块写出请求体：视频 data URL 不再随 JSON 骨架整体序列化一遍；
+                # 请求体是一次性的异步迭代器，每次重试都要重新构造
+                body = json_body(headers, payload)
+                resp = await client.post(url, headers=headers, content=body, timeout=httpx.Timeout(timeout))
+                resp.raise_for_status()
+            return deserialize_response(resp.content)
+        except (httpx.TransportError, httpx.HTTPStatusError) as e:
+            retryable = (
+                isinstance(e, httpx.TransportError)
+                or e.response.status_code >= 500 or e.response.status_code == 429
+            )
+            if not retryable or attempt == _POST_MAX_ATTEMPTS - 1:
+                raise
+            # 指数退避 + 抖动；等待期间不占用上传名额
+            delay = min(2 ** attempt, 30) + random.random()
+            reason = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else repr(e)
+            log.warning(f"[Video] POST failed ({reason}), retry {attempt + 1}/{_POST_MAX_ATTEMPTS - 1} in {delay:.1f}s")
+            await asyncio.sleep(delay)
 
 async def call_video_understanding_async(
     model: str,
@@ -118,48 +604,62 @@ async def call_video_understanding_async(
     max_tokens: int = 4096,
     temperature: float = 0.2,
     timeout: int = 300, # Video processing might take longer
+    frame_sample: Optional[int] = None,
     **kwargs,
 ) -> str:
     """
     调用视频理解模型
+
+    frame_sample: 不为 None 时不上传整段视频，而是抽取至多 frame_sample 个关键帧，
+        以多张 JPEG 图片发送（体积通常小一到两个数量级）；抽帧失败时回退为发送视频。
     """
-    b64, mime_type = _encode_video_to_base64(video_path)
-    log.info(f"[Video] Encoded video {video_path}, mime={mime_type}, size={len(b64)/1024/1024:.2f}MB")
+    media_parts: List[Dict[str, Any]] = []
+    if frame_sample:
+        frames = await _extract_keyframes(video_path, frame_sample)
+        media_parts = [
+            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{frame}"}}
+            for frame in frames
+        ]
+        log.info(f"[Video] Sampled {len(frames)} keyframes from {video_path}")
+
+    if not media_parts:
+        data_url, mime_type = await _encode_video_to_base64(video_path, as_data_url=True)
+        log.info(f"[Video] Encoded video {video_path}, mime={mime_type}, size={len(data_url)/1024/1024:.2f}MB")
+
+        # OpenAI Vision Format / Gemini OpenAI-Compat Format
+        media_parts = [{
+            "type": "image_url",
+            "image_url": {
+                "url": data_url
+            },
+            "mime_type": mime_type
+        }]
+
+    # 1. Prepare Messages：只重建要注入视频的那条消息，其余消息共享引用
+    processed_messages = list(messages)
 
-    # 1. Prepare Messages
-    processed_messages = [msg.copy() for msg in messages]
-    
     # Inject video into the last user message
-    target_msg = None
-    for m in reversed(processed_messages):
-        if m["role"] == "user":
-            target_msg = m
-            break
-            
-    # OpenAI Vision Format / Gemini OpenAI-Compat Format
-    video_content = {
-        "type": "image_url",
-        "image_url": {
-            "url": f"data:{mime_type};base64,{b64}"
-        },
-        "mime_type": mime_type
-    }
-            
-    if target_msg:
+    target_idx = next(
+        (i for i in range(len(processed_messages) - 1, -1, -1) if processed_messages[i]["role"] == "user"),
+        None,
+    )
+
+    if target_idx is not None:
+        target_msg = processed_messages[target_idx]
         original_content = target_msg["content"]
         if isinstance(original_content, str):
-            target_msg["content"] = [
-                {"type": "text", "text": original_content},
-                video_content
-            ]
+            processed_messages[target_idx] = {
+                **target_msg,
+                "content": [{"type": "text", "text": original_content}, *media_parts],
+            }
         elif isinstance(original_content, list):
-            target_msg["content"].append(video_content)
+            processed_messages[target_idx] = {**target_msg, "content": [*original_content, *media_parts]}
     else:
          processed_messages.append({
             "role": "user",
             "content": [
                 {"type": "text", "text": "Analyze this video."},
-                video_content
+                *media_parts
             ]
         })
 
@@ -189,10 +689,22 @@ if __name__ == "__main__":
     # 创建一个空的 dummy 视频文件是不容易被 ffmpeg 处理的
     # 所以视频测试仅当用户提供了有效路径时才尝试，或者尝试查找
     def find_any_mp4():
-        for root, dirs, files in os.walk("."):
-            for f in files:
-                if f.endswith(".mp4"):
-                    return os.path.join(root, f)
+        # 广度优先 + os.scandir：找到第一个就返回，跳过隐藏目录与依赖/缓存目录
+        skip_dirs = {"node_modules", "venv", "__pycache__"}
+        pending = ["."]
+        while pending:
+            subdirs = []
+            try:
+                with os.scandir(pending.pop(0)) as it:
+                    for entry in it:
+                        if entry.is_file() and entry.name.endswith(".mp4"):
+                            return entry.path
+                        if (entry.is_dir(follow_symlinks=False)
+                                and not entry.name.startswith(".") and entry.name not in skip_dirs):
+                            subdirs.append(entry.path)
+            except OSError:
+                continue
+            pending.extend(subdirs)
         return None
 
     async def _test():
@@ -15,30 +15,52 @@ Design philosophy:
 - Normalize outputs into Python dict / list structures that are easy to consume
 
 # 函数一览（中文说明）：
-# _ensure_ultralytics_sam_available: 校验 ultralytics.SAM 是否可用，否则抛出安装提示。
-# _ensure_ultralytics_yolo_available: 校验 ultralytics.YOLO 是否可用，否则抛出安装提示。
-# _ensure_hf_pipeline_available: 校验 transformers.pipeline 是否可用，否则抛出安装提示。
-# _ensure_skimage_available: 校验 scikit-image 是否可用，否则抛出安装提示。
-# _ensure_matplotlib_available: 校验 matplotlib 是否可用，否则抛出安装提示。
+# _load_torch: 懒加载 torch（未安装时返回 None）。
+# _ensure_ultralytics_sam_available: 首次调用时懒加载 ultralytics.SAM，不可用则抛出安装提示。
+# _ensure_ultralytics_yolo_available: 首次调用时懒加载 ultralytics.YOLO，不可用则抛出安装提示。
+# _ensure_hf_pipeline_available: 首次调用时懒加载 transformers.pipeline，不可用则抛出安装提示。
+# _ensure_skimage_available: 首次调用时懒加载 scikit-image，不可用则抛出安装提示。
+# _ensure_matplotlib_available: 首次调用时懒加载 matplotlib，不可用则抛出安装提示。
 # _load_image_pil: 从路径读取图片并转为 RGB 的 PIL.Image。
-# _get_image_size: 返回图片的宽高 (width, height)。
-# _get_sam_model: 懒加载并缓存指定 checkpoint 的 SAM 模型。
+# _get_image_size_fast: 只读文件头返回图片的宽高 (width, height)，按路径 + mtime 缓存。
+# _normalize_xyxy: 将像素 xyxy 批量裁剪并归一化到 [0, 1]。
+# _masks_to_bool_numpy: mask 张量阈值化后拷回主机（CUDA 上先在 GPU 上阈值化）。
+# _iter_batches: 按 batch_size 切分图片列表。
+# _release_model: 模型移出缓存后回收引用并清理 CUDA 显存（不原地迁移可能仍在使用的模型）。
+# _infer_kwargs / _maybe_compile / _warmup_model: SAM_TOOL_COMPILE=1 时的编译、半精度推理与预热。
+# _get_sam_model: 懒加载并缓存指定 checkpoint 的 SAM 模型（LRU，容量由 SAM_MODEL_CACHE_SIZE 控制）。
 # free_sam_model: 显式释放指定 checkpoint 的 SAM 模型并清理 CUDA 显存。
 # run_sam_auto: 对单张图片运行 SAM 自动分割，返回每个实例的 mask、归一化 bbox 等信息。
-# run_sam_auto_batch: 对多张图片批量运行 SAM 自动分割，按图片返回实例列表。
+# SamResult: 单张图片 SAM 实例的结构化数组（SoA）表示，可转回字典列表（可选 packbits 压缩 mask）。
+# unpack_mask: 取实例的布尔 mask，必要时从 mask_packed 解包。
+# _sam_result_from_ultralytics: 将单张图片的 SAM 推理结果转换为 SamResult。
+# _decode_server_mask: 解码 SAM 服务端返回的 base64 + zlib（可选 packbits）mask。
+# run_sam_auto_server: 通过 SAM 服务端对单张图片做自动分割（共享 requests.Session）。
+# run_sam_auto_server_batch(_async): 将多张图片轮询分发到多个 SAM 服务端并发分割。
+# run_sam_auto_batch: 对多张图片按 batch_size 分块批量运行 SAM 自动分割（给定 server_urls 时并发分发到服务端），按图片返回实例列表。
 # _get_yolo_model: 懒加载并缓存指定权重和设备的 YOLOv8 分割模型。
 # run_yolov8_seg: 对单张图片运行 YOLOv8 实例分割，返回带类别标签和分数的实例信息。
-# run_yolov8_seg_batch: 对多张图片批量运行 YOLOv8 实例分割，按图片返回实例列表。
+# _yolo_items_from_result: 将单张图片的 YOLO 推理结果转换为实例列表。
+# run_yolov8_seg_batch: 对多张图片按 batch_size 分块批量运行 YOLOv8 实例分割，按图片返回实例列表。
 # _get_hf_seg_pipeline: 懒加载并缓存 Hugging Face 语义分割 pipeline。
 # run_hf_semantic_seg: 使用 HF pipeline 对单张图片做语义分割，返回每个类别的前景掩膜。
 # run_hf_semantic_seg_batch: 对多张图片批量做语义分割，按图片返回类别掩膜列表。
-# run_felzenszwalb: 调用 Felzenszwalb 图分割算法，返回标签图或每个 segment 的布尔掩膜。
+# _get_felzenszwalb_segments: 按路径 + mtime + 参数缓存的 Felzenszwalb 标签图。
+# _label_pixel_index: 一次排序建立“标签 → 像素下标”的 CSR 索引。
+# _labels_to_masks: numba 可用时单次并行扫描标签图，写出 [L, H, W] 掩膜。
+# run_felzenszwalb: 调用 Felzenszwalb 图分割算法，返回标签图、每个 segment 的布尔掩膜或 CSR 像素索引。
 # save_felzenszwalb_visualization: 运行 Felzenszwalb 并保存带分割边界的可视化图片。
-# save_sam_instances: 将 SAM 分割得到的每个实例按 bbox 或 RGBA mask 截图后保存为单独图片。
+# _RGBABufferPool: 按容量复用 save_sam_instances 中 RGBA 局部图的缓冲区。
+# _write_png: 在内存中编码 PNG 后一次性写出文件。
+# _submit_png_save: 把实例截图提交到共享线程池并行编码写出 PNG（压缩级别由 SAM_PNG_COMPRESS_LEVEL 控制）。
+# _save_indexed_instances: 按 CSR 像素索引逐个保存实例，只在 bbox 范围内构造 mask。
+# save_sam_instances: 将 SAM 分割得到的每个实例（或 Felzenszwalb 像素索引）按 bbox 或 RGBA mask 截图后保存为单独图片。
 # 过滤/后处理函数：
+# _order_items: 按 score / area 一次性提取排序键并用 argsort 稳定排序实例列表。
 # filter_sam_items_by_area_and_score: 按最小面积、最小得分过滤 SAM 实例。
 # bbox_iou: 计算两个归一化 bbox 的 IoU。
 # mask_iou: 计算两个布尔 mask 的 IoU。
+# _pairwise_mask_iou: 用一次矩阵乘法计算一组 mask 两两之间的 IoU 矩阵。
 # nms_sam_items_by_bbox: 基于 bbox IoU 的 SAM 实例 NMS 去重。
 # nms_sam_items_by_mask: 基于 mask IoU 的 SAM 实例 NMS 去重。
 # topk_sam_items: 只保留 Top-K 个 SAM 实例。
@@ -47,60 +69,130 @@ Design philosophy:
 """
 
 from pathlib import Path
-from typing import Any, Dict, List, Sequence, Union, Optional
+from collections import OrderedDict
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+from itertools import cycle, islice
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Tuple, Union, Optional
+import asyncio
 import base64
+import threading
 import requests
 import random
+import gc
 import zlib
 import os
 
 import numpy as np
 from PIL import Image
-
-# Optional imports (lazy usage, we guard them at call-time)
-try:
-    from ultralytics import SAM as UltralyticsSAM
-    from ultralytics import YOLO
-except Exception:  # pragma: no cover - optional dependency
-    UltralyticsSAM = None  # type: ignore
-    YOLO = None  # type: ignore
-
-try:
-    from transformers import pipeline as hf_pipeline
-except Exception:  # pragma: no cover - optional dependency
-    hf_pipeline = None  # type: ignore
-
+from requests.adapters import HTTPAdapter
+
+# Optional heavy dependencies are imported lazily by the _ensure_* helpers on
+# first use (ultralytics alone pulls in torch / torchvision / opencv), so that
+# importing this module for Felzenszwalb or post-processing stays cheap.
+UltralyticsSAM: Any = None
+YOLO: Any = None
+hf_pipeline: Any = None
 # scikit-image & matplotlib for classical segmentation
-try:
-    from skimage import io as skio, segmentation
-except Exception:  # pragma: no cover - optional dependency
-    skio = None  # type: ignore
-    segmentation = None  # type: ignore
-
-try:
-    import matplotlib.pyplot as plt
-except Exception:  # pragma: no cover - optional dependency
-    plt = None  # type: ignore
-
-# torch 仅用于显式释放 CUDA 显存（free_sam_model 等场景）
+skio: Any = None
+segmentation: Any = None
+plt: Any = None
+
+# numba 可选：存在时对 mask IoU 数值核心及标签图展开做 JIT 编译
 try:  # pragma: no cover - optional dependency
-    import torch
+    from numba import njit, prange
 except Exception:  # pragma: no cover
-    torch = None  # type: ignore
+    njit = None  # type: ignore
+    prange = range  # type: ignore
+
+# torch 用于显式释放 CUDA 显存（free_sam_model 等场景）及 GPU 侧处理，首次使用时由 _load_torch 导入
+torch: Any = None
+_TORCH_LOADED = False
 
 
 # -----------------------------------------------------------------------------
 # 0. Simple global caches to avoid re-loading heavy models
 # -----------------------------------------------------------------------------
-_SAM_MODELS: Dict[str, Any] = {}
-_YOLO_MODELS: Dict[tuple, Any] = {}
-_HF_SEG_PIPELINES: Dict[str, Any] = {}
+class _LRUModelCache(OrderedDict):
+    """
+    容量受限的模型缓存：命中时移到末尾，超过 max_size 时淘汰最久未使用的条目。
+    淘汰只丢弃缓存的引用（其他调用方可能仍在使用该模型，不能原地迁移设备），
+    随后调用 on_evict（回收并清理显存），避免不同权重长期占满显存。
+    """
+
+    def __init__(self, max_size: int, on_evict: Callable[[], None]):
+        super().__init__()
+        self.max_size = max(1, int(max_size))
+        self.on_evict = on_evict
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value) -> None:
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > self.max_size:
+            self.popitem(last=False)
+            self.on_evict()
+
+
+# SAM_TOOL_COMPILE=1 时在 CUDA 上对 SAM / YOLO 做 torch.compile 并以半精度推理；
+# 首次编译有冷启动开销，默认关闭
+_COMPILE_MODELS = os.getenv("SAM_TOOL_COMPILE", "0") == "1"
+_WARMUP_IMAGE_SIZE = 1024
+
+# 每类模型最多同时缓存的实例数（不同 checkpoint / 权重 / 设备各算一个）
+_MODEL_CACHE_SIZE = int(os.getenv("SAM_MODEL_CACHE_SIZE", "2"))
+
+_SAM_MODELS: Dict[str, Any] = _LRUModelCache(_MODEL_CACHE_SIZE, lambda: _release_model())
+_YOLO_MODELS: Dict[tuple, Any] = _LRUModelCache(_MODEL_CACHE_SIZE, lambda: _release_model())
+_HF_SEG_PIPELINES: Dict[str, Any] = _LRUModelCache(_MODEL_CACHE_SIZE, lambda: _release_model())
+# run_sam_auto_server 解码 mask 用的线程池，首次使用时创建
+_MASK_DECODE_POOL: Optional[ThreadPoolExecutor] = None
+# save_sam_instances 编码 / 写出 PNG 用的线程池（Pillow 压缩时释放 GIL），首次使用时创建
+_PNG_SAVE_POOL: Optional[ThreadPoolExecutor] = None
+# 实例截图的 PNG 压缩级别：默认 1，以体积略大换取明显更快的 deflate
+_PNG_COMPRESS_LEVEL = int(os.getenv("SAM_PNG_COMPRESS_LEVEL", "1"))
+
+# 访问 SAM 服务端的共享 Session：keep-alive + 连接池，多线程调用时复用连接
+_SAM_SERVER_TIMEOUT = 300
+_HTTP_SESSION = requests.Session()
+_HTTP_ADAPTER = HTTPAdapter(pool_connections=32, pool_maxsize=32)
+_HTTP_SESSION.mount("http://", _HTTP_ADAPTER)
+_HTTP_SESSION.mount("https://", _HTTP_ADAPTER)
 
 
 # -----------------------------------------------------------------------------
 # Utils
 # -----------------------------------------------------------------------------
+def _load_torch() -> Any:
+    """
+    懒加载 torch（只尝试一次），未安装时返回 None。
+    """
+    global torch, _TORCH_LOADED
+    if not _TORCH_LOADED:
+        _TORCH_LOADED = True
+        try:  # pragma: no cover - optional dependency
+            import torch as _torch
+        except Exception:  # pragma: no cover
+            _torch = None
+        torch = _torch
+    return torch
+
+
 def _ensure_ultralytics_sam_available() -> None:
+    global UltralyticsSAM
+    if UltralyticsSAM is None:
+        try:  # pragma: no cover - optional dependency
+            from ultralytics import SAM as _UltralyticsSAM
+
+            UltralyticsSAM = _UltralyticsSAM
+        except Exception:  # pragma: no cover
+            pass
     if UltralyticsSAM is None:
         raise ImportError(
             "ultralytics.SAM is not available. Please install `ultralytics`:\n"
@@ -109,6 +201,14 @@ def _ensure_ultralytics_sam_available() -> None:
 
 
 def _ensure_ultralytics_yolo_available() -> None:
+    global YOLO
+    if YOLO is None:
+        try:  # pragma: no cover - optional dependency
+            from ultralytics import YOLO as _YOLO
+
+            YOLO = _YOLO
+        except Exception:  # pragma: no cover
+            pass
     if YOLO is None:
         raise ImportError(
             "ultralytics.YOLO is not available. Please install `ultralytics`:\n"
@@ -117,6 +217,14 @@ def _ensure_ultralytics_yolo_available() -> None:
 
 
 def _ensure_hf_pipeline_available() -> None:
+    global hf_pipeline
+    if hf_pipeline is None:
+        try:  # pragma: no cover - optional dependency
+            from transformers import pipeline as _hf_pipeline
+
+            hf_pipeline = _hf_pipeline
+        except Exception:  # pragma: no cover
+            pass
     if hf_pipeline is None:
         raise ImportError(
             "transformers.pipeline is not available. Please install transformers:\n"
@@ -125,6 +233,14 @@ def _ensure_hf_pipeline_available() -> None:
 
 
 def _ensure_skimage_available() -> None:
+    global skio, segmentation
+    if skio is None or segmentation is None:
+        try:  # pragma: no cover - optional dependency
+            from skimage import io as _skio, segmentation as _segmentation
+
+            skio, segmentation = _skio, _segmentation
+        except Exception:  # pragma: no cover
+            pass
     if skio is None or segmentation is None:
         raise ImportError(
             "scikit-image is not available. Please install scikit-image:\n"
@@ -133,6 +249,14 @@ def _ensure_skimage_available() -> None:
 
 
 def _ensure_matplotlib_available() -> None:
+    global plt
+    if plt is None:
+        try:  # pragma: no cover - optional dependency
+            import matplotlib.pyplot as _plt
+
+            plt = _plt
+        except Exception:  # pragma: no cover
+            pass
     if plt is None:
         raise ImportError(
             "matplotlib is not available. Please install matplotlib:\n"
@@ -147,9 +271,109 @@ def _load_image_pil(image_path: str) -> Image.Image:
     return Image.open(p).convert("RGB")
 
 
-def _get_image_size(image_path: str) -> tuple[int, int]:
-    img = _load_image_pil(image_path)
-    return img.size  # (width, height)
+@lru_cache(maxsize=1024)
+def _read_image_size(image_path: str, mtime_ns: int) -> tuple[int, int]:
+    # Image.open 只解析文件头，不解码像素
+    with Image.open(image_path) as im:
+        return im.size  # (width, height)
+
+
+def _get_image_size_fast(image_path: str) -> tuple[int, int]:
+    """
+    只读文件头获取图片宽高 (width, height)；按 (路径, mtime) 做 LRU 缓存，文件被改写后自动失效。
+    """
+    st = os.stat(image_path)
+    return _read_image_size(os.path.abspath(image_path), st.st_mtime_ns)
+
+
+def _normalize_xyxy(xyxy: np.ndarray, width: int, height: int) -> np.ndarray:
+    """
+    将像素坐标 [N, 4] 的 xyxy 一次性裁剪到图像范围并归一化到 [0, 1]，返回 float64 数组。
+    """
+    upper = np.array([width, height, width, height], dtype=np.float64)
+    scale = np.array(
+        [max(width, 1), max(height, 1), max(width, 1), max(height, 1)], dtype=np.float64
+    )
+    xyxy = np.asarray(xyxy, dtype=np.float64).reshape(-1, 4)
+    return np.clip(xyxy, 0.0, upper) / scale
+
+
+def _masks_to_bool_numpy(mask_data: Any) -> np.ndarray:
+    """
+    将模型输出的 mask 概率张量 [N, H, W] 以 0.5 阈值二值化并转为 NumPy bool 数组。
+
+    CUDA 张量在 GPU 上先做阈值再拷回主机：传回的是 bool（float32 的 1/4 大小），
+    减少 PCIe 传输量。拷贝之后紧接着就要在主机上使用结果，没有可重叠的工作，
+    因此直接用同步的 .cpu()，不额外分配 pinned 缓冲区。
+    """
+    if getattr(mask_data, "is_cuda", False):
+        return (mask_data > 0.5).cpu().numpy()
+    return mask_data.cpu().numpy() > 0.5
+
+
+def _iter_batches(items: Sequence[Any], batch_size: int) -> Iterator[List[Any]]:
+    """
+    按 batch_size 切分序列，逐块产出列表（batch_size <= 0 时按 1 处理）。
+    """
+    it = iter(items)
+    size = max(1, int(batch_size))
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _release_model() -> None:
+    """
+    模型移出缓存后调用：回收引用环并清理 CUDA 缓存。
+    不把模型切回 CPU——nn.Module.to 是原地操作，其他调用方可能仍持有该模型；
+    没有其他引用时显存随对象回收而释放，仍被持有时则继续可用。
+    """
+    gc.collect()
+
+    # 若 torch 可用，则尝试清空 CUDA 缓存，减轻显存压力
+    if _load_torch() is not None and torch.cuda.is_available():
+        try:
+            torch.cuda.empty_cache()
+        except Exception:
+            # 防御式处理，确保不会因为清理失败影响主流程
+            pass
+
+
+def _compile_enabled() -> bool:
+    return (
+        _COMPILE_MODELS
+        and _load_torch() is not None
+        and hasattr(torch, "compile")
+        and torch.cuda.is_available()
+    )
+
+
+def _infer_kwargs() -> Dict[str, Any]:
+    """
+    推理时附加的 ultralytics 参数：开启编译时以半精度推理（由 ultralytics 统一转换输入与权重）。
+    """
+    return {"half": True} if _compile_enabled() else {}
+
+
+def _maybe_compile(module: Any) -> Any:
+    """torch.compile 包装模块；失败时原样返回，不影响推理。"""
+    try:
+        return torch.compile(module, mode="max-autotune", fullgraph=False)
+    except Exception:
+        return module
+
+
+def _warmup_model(model: Any, **kwargs: Any) -> None:
+    """
+    用一张空白图预热一次，把编译 / CUDA Graph 捕获开销放在加载阶段而不是首个真实请求。
+    """
+    dummy = np.zeros((_WARMUP_IMAGE_SIZE, _WARMUP_IMAGE_SIZE, 3), dtype=np.uint8)
+    try:
+        model(dummy, verbose=False, **_infer_kwargs(), **kwargs)
+    except Exception:
+        pass
 
 
 # -----------------------------------------------------------------------------
@@ -166,7 +390,12 @@ def _get_sam_model(
     if key not in _SAM_MODELS:
         # Note: in current ultralytics versions SAM(...) does not accept device= argument here.
         # Device is controlled at inference time, e.g. model(img, device="cuda").
-        _SAM_MODELS[key] = UltralyticsSAM(checkpoint)
+        model = UltralyticsSAM(checkpoint)
+        if _compile_enabled():
+            # 计算量集中在 ViT image encoder，predictor 直接调用该子模块，因此只编译它
+            model.model.image_encoder = _maybe_compile(model.model.image_encoder)
+            _warmup_model(model, device="cuda")
+        _SAM_MODELS[key] = model
     return _SAM_MODELS[key]
 
 
@@ -186,35 +415,111 @@ def free_sam_model(checkpoint: str = "sam_b.pt") -> None:
       无法调用 torch.cuda.empty_cache()。
     """
     global _SAM_MODELS
-    m = _SAM_MODELS.pop(checkpoint, None)
-    if m is not None:
-        # 尝试清理 ultralytics 内部引用
-        try:
-            # 一些 ultralytics 模型提供 model.to("cpu") 等接口，此处最好切到 CPU 再删除
-            if hasattr(m, "model"):
-                try:
-                    m.model.to("cpu")
-                except Exception:
-                    pass
-        except Exception:
-            pass
+    _SAM_MODELS.pop(checkpoint, None)
+    _release_model()
 
-        del m
 
-    # 若 torch 可用，则尝试清空 CUDA 缓存，减轻显存压力
-    if torch is not None and torch.cuda.is_available():
-        try:
-            torch.cuda.empty_cache()
-        except Exception:
-            # 防御式处理，确保不会因为清理失败影响主流程
-            pass
+@dataclass
+class SamResult:
+    """
+    单张图片 SAM 实例的结构化数组（SoA）表示，各字段按实例对齐：
+
+    - bboxes: np.ndarray[N, 4] float64，归一化 [x1, y1, x2, y2]
+    - scores: np.ndarray[N] float64，缺失得分记为 NaN
+    - areas:  np.ndarray[N] int64，mask 像素面积
+    - masks:  np.ndarray[N, H, W] bool
+
+    过滤 / NMS / Top-K 可直接作用于 SamResult（整体数组运算），
+    需要旧的字典列表时调用 to_list_of_dicts()。
+    """
+
+    bboxes: np.ndarray
+    scores: np.ndarray
+    areas: np.ndarray
+    masks: np.ndarray
+
+    @classmethod
+    def empty(cls) -> "SamResult":
+        return cls(
+            bboxes=np.zeros((0, 4), dtype=np.float64),
+            scores=np.zeros(0, dtype=np.float64),
+            areas=np.zeros(0, dtype=np.int64),
+            masks=np.zeros((0, 0, 0), dtype=bool),
+        )
+
+    def __len__(self) -> int:
+        return int(self.areas.shape[0])
+
+    def __getitem__(self, idx: Any) -> "SamResult":
+        """按整数索引数组或布尔掩码选取子集，返回新的 SamResult。"""
+        return SamResult(
+            bboxes=self.bboxes[idx],
+            scores=self.scores[idx],
+            areas=self.areas[idx],
+            masks=self.masks[idx],
+        )
+
+    def to_list_of_dicts(self, pack_masks: bool = False) -> List[Dict[str, Any]]:
+        """
+        转换为 run_sam_auto 的字典列表格式；mask 为共享 masks 数组的视图。
+        pack_masks=True 时不带 "mask"，改为 "mask_packed"（np.packbits 后的 uint8，
+        体积约为 bool 的 1/8）与 "mask_shape"，需要时用 unpack_mask(item) 还原。
+        """
+        bboxes = self.bboxes.tolist()
+        areas = self.areas.tolist()
+        scores = [None if np.isnan(v) else v for v in self.scores.tolist()]
+        if pack_masks:
+            n = len(self)
+            if n == 0:
+                # 无实例时 masks 为 (0, 0, 0)，不能 reshape(0, -1)
+                return []
+            shape = tuple(self.masks.shape[1:])
+            # 整批一次 packbits，每个实例取一行视图
+            packed = np.packbits(self.masks.reshape(n, -1), axis=1)
+            return [
+                {
+                    "mask_packed": packed[i],
+                    "mask_shape": shape,
+                    "bbox": bboxes[i],
+                    "score": scores[i],
+                    "area": areas[i],
+                }
+                for i in range(n)
+            ]
+        return [
+            {
+                "mask": self.masks[i],
+                "bbox": bboxes[i],
+                "score": scores[i],
+                "area": areas[i],
+            }
+            for i in range(len(self))
+        ]
+
+
+def unpack_mask(item: Dict[str, Any]) -> Optional[np.ndarray]:
+    """
+    返回实例的布尔 mask：优先取 "mask"，否则从 "mask_packed" + "mask_shape" 解包，
+    两者都没有时返回 None。
+    """
+    mask = item.get("mask")
+    if mask is not None:
+        return mask
+    packed = item.get("mask_packed")
+    if packed is None:
+        return None
+    shape = tuple(item["mask_shape"])
+    count = int(np.prod(shape))
+    return np.unpackbits(packed, count=count).view(bool).reshape(shape)
 
 
 def run_sam_auto(
     image_path: str,
     checkpoint: str = "sam_b.pt",
     device: str = "cuda",
-) -> List[Dict[str, Any]]:
+    return_type: str = "items",  # "items" | "result"
+    pack_masks: bool = False,
+) -> Union[List[Dict[str, Any]], SamResult]:
     """
     Run automatic segmentation on a single image using SAM (ultralytics backend).
 
@@ -226,76 +531,162 @@ def run_sam_auto(
         SAM checkpoint to use, by default "sam_b.pt".
     device : str, optional
         Device string for torch (e.g. "cuda", "cpu"), by default "cuda".
+    return_type : {"items", "result"}, optional
+        - "items": list of per-instance dicts (default)
+        - "result": a `SamResult` holding contiguous per-field arrays
+    pack_masks : bool, optional
+        If True (items only), each dict carries "mask_packed" / "mask_shape"
+        (bit-packed, ~8x smaller) instead of "mask"; use `unpack_mask(item)`.
 
     Returns
     -------
     List[Dict[str, Any]]
         Each dict contains at least:
-            - mask: np.ndarray[H, W] bool
+            - mask: np.ndarray[H, W] bool (or mask_packed / mask_shape)
             - bbox: [x1, y1, x2, y2] in normalized coordinates [0,1]
             - score: float or None
             - area: int (number of True pixels in mask)
+    SamResult
+        If return_type == "result".
     """
-    model = _get_sam_model(checkpoint=checkpoint)
-    # In recent ultralytics versions, SAM models can receive `device` at call time.
-    # If your installed version does not support this, you can remove `device=device`.
-    try:
-        results = model(image_path, device=device)  # ultralytics will load image internally
-    except TypeError:
-        # Fallback: older/newer API without device argument
-        results = model(image_path)
+    return run_sam_auto_batch(
+        [image_path],
+        checkpoint=checkpoint,
+        device=device,
+        batch_size=1,
+        return_type=return_type,
+        pack_masks=pack_masks,
+    )[0]
 
-    width, height = _get_image_size(image_path)
 
-    all_items: List[Dict[str, Any]] = []
-    for r in results:
-        # r.masks: ultralytics Masks object or None
-        masks = getattr(r, "masks", None)
-        boxes = getattr(r, "boxes", None)
+def _sam_result_from_ultralytics(r: Any, width: int, height: int) -> SamResult:
+    """
+    将单张图片的 ultralytics SAM 结果转换为 SamResult。
+    """
+    # r.masks: ultralytics Masks object or None
+    masks = getattr(r, "masks", None)
+    boxes = getattr(r, "boxes", None)
+
+    if masks is None:
+        return SamResult.empty()
+
+    mask_data = getattr(masks, "data", None)
+    if mask_data is None:
+        return SamResult.empty()
+
+    mbools = _masks_to_bool_numpy(mask_data)  # [N, H, W] bool
+    n_instances = mbools.shape[0]
+    if n_instances == 0:
+        return SamResult.empty()
+
+    # boxes may be None (SAM auto masks can be box-less); handle gracefully
+    if boxes is not None:
+        xyxy = boxes.xyxy.cpu().numpy()  # [N, 4], in pixels
+        scores = getattr(boxes, "conf", None)
+        scores_np = scores.cpu().numpy() if scores is not None else None
+    else:
+        xyxy = np.zeros((n_instances, 4), dtype=np.float32)
+        scores_np = None
+
+    # 整批求面积 / 归一化 bbox，不产生逐实例的 Python 对象
+    return SamResult(
+        bboxes=_normalize_xyxy(xyxy, width, height),
+        scores=(
+            scores_np.astype(np.float64)
+            if scores_np is not None
+            else np.full(n_instances, np.nan, dtype=np.float64)
+        ),
+        areas=mbools.sum(axis=(1, 2)).astype(np.int64),
+        masks=mbools,
+    )
 
-        if masks is None:
-            continue
 
-        mask_data = getattr(masks, "data", None)
-        if mask_data is None:
-            continue
+def _normalize_server_urls(server_urls: Union[str, List[str]]) -> List[str]:
+    if isinstance(server_urls, str):
+        urls = [server_urls]
+    else:
+        urls = list(server_urls)
+    if not urls:
+        raise ValueError("No server URLs provided")
+    return urls
 
-        mask_np = mask_data.cpu().numpy()  # [N, H, W]
-        n_instances = mask_np.shape[0]
 
-        # boxes may be None (SAM auto masks can be box-less); handle gracefully
-        if boxes is not None:
-            xyxy = boxes.xyxy.cpu().numpy()  # [N, 4], in pixels
-            scores = getattr(boxes, "conf", None)
-            scores_np = scores.cpu().numpy() if scores is not None else None
-        else:
-            xyxy = np.zeros((n_instances, 4), dtype=np.float32)
-            scores_np = None
+def _sam_server_payload(image_path: str, checkpoint: str, device: str) -> Dict[str, Any]:
+    return {
+        # Ensure image path is absolute for server to access
+        "image_path": os.path.abspath(image_path),
+        "checkpoint": checkpoint,
+        "device": device,
+        # 按位打包的 mask 传输体积约为逐字节 bool 的 1/8；旧版服务端忽略该字段仍返回 bool
+        "mask_encoding": "packbits",
+    }
 
-        for i in range(n_instances):
-            m = mask_np[i] > 0.5  # bool
-            area = int(m.sum())
 
-            x1, y1, x2, y2 = xyxy[i]
-            # clamp & normalize
-            x1 = float(max(0, min(width, x1))) / max(width, 1)
-            x2 = float(max(0, min(width, x2))) / max(width, 1)
-            y1 = float(max(0, min(height, y1))) / max(height, 1)
-            y2 = float(max(0, min(height, y2))) / max(height, 1)
-            bbox_norm = [x1, y1, x2, y2]
+def _parse_sam_server_items(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    将 SAM 服务端的 JSON 响应转换为与 run_sam_auto 相同结构的实例列表。
+    """
+    items_raw = data.get("items", [])
+    # zlib 解压在 C 层释放 GIL，mask 较多时放到线程池并行解码
+    if len(items_raw) > 1:
+        masks = list(_get_mask_decode_pool().map(_decode_server_mask, items_raw))
+    else:
+        masks = [_decode_server_mask(it) for it in items_raw]
 
-            score = float(scores_np[i]) if scores_np is not None else None
+    all_items: List[Dict[str, Any]] = []
+    for it, mask in zip(items_raw, masks):
+        all_items.append({
+            "mask": mask,
+            "bbox": it.get("bbox"),
+            "score": it.get("score"),
+            "area": it.get("area", 0)
+        })
+    return all_items
 
-            all_items.append(
-                {
-                    "mask": m,
-                    "bbox": bbox_norm,
-                    "score": score,
-                    "area": area,
-                }
-            )
 
-    return all_items
+def _get_mask_decode_pool() -> ThreadPoolExecutor:
+    """
+    懒加载 mask 解码线程池（进程内共享）。
+    """
+    global _MASK_DECODE_POOL
+    if _MASK_DECODE_POOL is None:
+        _MASK_DECODE_POOL = ThreadPoolExecutor(
+            max_workers=min(8, os.cpu_count() or 1),
+            thread_name_prefix="sam_mask_decode",
+        )
+    return _MASK_DECODE_POOL
+
+
+def _decode_server_mask(it: Dict[str, Any]) -> Optional[np.ndarray]:
+    """
+    解码 SAM 服务端返回的单个 mask：base64 -> zlib 解压 -> bool 数组。
+
+    mask_encoding 为 "packbits" 时按位解包，否则按逐字节 bool 解析；
+    未压缩的数据（旧版服务端）直接按原始字节处理。
+    """
+    mask_b64 = it.get("mask_b64")
+    mask_shape = it.get("mask_shape")
+    if not mask_b64 or not mask_shape:
+        return None
+
+    shape = tuple(mask_shape)
+    try:
+        raw = base64.b64decode(mask_b64)
+        try:
+            mask_bytes = zlib.decompress(raw)
+        except zlib.error:
+            # Backward compatibility: uncompressed payload
+            mask_bytes = raw
+
+        if it.get("mask_encoding") == "packbits":
+            count = int(np.prod(shape))
+            bits = np.unpackbits(np.frombuffer(mask_bytes, dtype=np.uint8), count=count)
+            return bits.view(bool).reshape(shape)
+        # Note: mask_bytes is flattened bool bytes
+        return np.frombuffer(mask_bytes, dtype=bool).reshape(shape)
+    except Exception as e:
+        print(f"Failed to decode/decompress mask: {e}")
+        return None
 
 
 def run_sam_auto_server(
@@ -324,83 +715,115 @@ def run_sam_auto_server(
     List[Dict[str, Any]]
         Same structure as run_sam_auto.
     """
-    if isinstance(server_urls, str):
-        urls = [server_urls]
-    else:
-        urls = list(server_urls)
-    
-    if not urls:
-        raise ValueError("No server URLs provided")
-    
+    urls = _normalize_server_urls(server_urls)
+
     # Simple random load balancing
     base_url = random.choice(urls)
     api_url = f"{base_url.rstrip('/')}/predict"
-    
-    # Ensure image path is absolute for server to access
-    abs_image_path = os.path.abspath(image_path)
-    
-    payload = {
-        "image_path": abs_image_path,
-        "checkpoint": checkpoint,
-        "device": device
-    }
-    
+    payload = _sam_server_payload(image_path, checkpoint, device)
+
     try:
-        response = requests.post(api_url, json=payload, timeout=300)
+        # 复用模块级 Session 的 keep-alive 连接，避免每次调用重新建立 TCP 连接
+        response = _HTTP_SESSION.post(api_url, json=payload, timeout=_SAM_SERVER_TIMEOUT)
         response.raise_for_status()
-        data = response.json()
-        
-        items_raw = data.get("items", [])
-        all_items: List[Dict[str, Any]] = []
-        
-        for it in items_raw:
-            # Deserialize mask
-            mask_b64 = it.get("mask_b64")
-            mask_shape = it.get("mask_shape")
-            
-            if mask_b64 and mask_shape:
-                try:
-                    compressed_bytes = base64.b64decode(mask_b64)
-                    # Decompress using zlib
-                    mask_bytes = zlib.decompress(compressed_bytes)
-                    # Reconstruct numpy bool array
-                    # Note: mask_bytes is flattened bool bytes
-                    mask_flat = np.frombuffer(mask_bytes, dtype=bool)
-                    mask = mask_flat.reshape(tuple(mask_shape))
-                except Exception as e:
-                    # Fallback for uncompressed data (backward compatibility) or decompression error
-                    try:
-                        mask_bytes = base64.b64decode(mask_b64)
-                        mask_flat = np.frombuffer(mask_bytes, dtype=bool)
-                        mask = mask_flat.reshape(tuple(mask_shape))
-                    except Exception:
-                        print(f"Failed to decode/decompress mask: {e}")
-                        mask = None
-            else:
-                mask = None
-            
-            all_items.append({
-                "mask": mask,
-                "bbox": it.get("bbox"),
-                "score": it.get("score"),
-                "area": it.get("area", 0)
-            })
-            
-        return all_items
-        
+        return _parse_sam_server_items(response.json())
     except Exception as e:
         # Log error or handle retry logic here if needed
         raise RuntimeError(f"Failed to call SAM server at {api_url}: {e}")
 
 
-def run_sam_auto_batch(
+async def run_sam_auto_server_batch_async(
     image_paths: List[str],
+    server_urls: Union[str, List[str]],
     checkpoint: str = "sam_b.pt",
     device: str = "cuda",
+    max_inflight: Optional[int] = None,
 ) -> List[List[Dict[str, Any]]]:
+    """
+    Run SAM auto segmentation for many images concurrently across server(s).
+
+    Images are assigned to ``server_urls`` round-robin and dispatched over
+    the shared async HTTP client; at most ``max_inflight`` requests
+    (default ``2 * len(server_urls)``) are in flight at once.
+
+    Returns
+    -------
+    List[List[Dict[str, Any]]]
+        One list of items per input image (same order as ``image_paths``),
+        see `run_sam_auto`.
+    """
+    # 延迟导入：http_client 会带入 httpx / providers，只做本地分割或后处理的调用方不需要
+    from dataflow_agent.toolkits.multimodaltool.http_client import get_async_client
+
+    urls = _normalize_server_urls(server_urls)
+    sem = asyncio.Semaphore(max_inflight or 2 * len(urls))
+    client = get_async_client()
+
+    async def _one(image_path: str, base_url: str) -> List[Dict[str, Any]]:
+        api_url = f"{base_url.rstrip('/')}/predict"
+        payload = _sam_server_payload(image_path, checkpoint, device)
+        async with sem:
+            try:
+                response = await client.post(api_url, json=payload, timeout=_SAM_SERVER_TIMEOUT)
+                response.raise_for_status()
+            except Exception as e:
+                raise RuntimeError(f"Failed to call SAM server at {api_url}: {e}")
+        # JSON 解析与 mask 解码是 CPU 工作，放到线程中避免阻塞事件循环
+        return await asyncio.to_thread(lambda: _parse_sam_server_items(response.json()))
+
+    # 轮询分配服务端，保证负载确定且均匀；gather 保持输入顺序
+    return list(
+        await asyncio.gather(*(_one(p, u) for p, u in zip(image_paths, cycle(urls))))
+    )
+
+
+def run_sam_auto_server_batch(
+    image_paths: List[str],
+    server_urls: Union[str, List[str]],
+    checkpoint: str = "sam_b.pt",
+    device: str = "cuda",
+    max_inflight: Optional[int] = None,
+) -> List[List[Dict[str, Any]]]:
+    """
+    Synchronous wrapper of `run_sam_auto_server_batch_async`.
+
+    Must not be called from a running event loop; await
+    `run_sam_auto_server_batch_async` directly in async code.
+    """
+
+    from dataflow_agent.toolkits.multimodaltool.http_client import MultimodalSession
+
+    async def _run() -> List[List[Dict[str, Any]]]:
+        async with MultimodalSession():
+            return await run_sam_auto_server_batch_async(
+                image_paths,
+                server_urls,
+                checkpoint=checkpoint,
+                device=device,
+                max_inflight=max_inflight,
+            )
+
+    return asyncio.run(_run())
+
+
+def run_sam_auto_batch(
+    image_paths: List[str],
+    checkpoint: str = "sam_b.pt",
+    device: str = "cuda",
+    batch_size: int = 8,
+    return_type: str = "items",  # "items" | "result"
+    server_urls: Optional[Union[str, List[str]]] = None,
+    max_inflight: Optional[int] = None,
+    pack_masks: bool = False,
+) -> Union[List[List[Dict[str, Any]]], List[SamResult]]:
     """
     Batch automatic segmentation using SAM.
 
+    Images are sent to the model in chunks of ``batch_size`` paths per call,
+    so each chunk is handled by a single predictor invocation instead of one
+    call per file. If ``server_urls`` is given, images are instead dispatched
+    concurrently across the SAM server pool (see `run_sam_auto_server_batch`).
+
     Parameters
     ----------
     image_paths : list[str]
@@ -409,30 +832,125 @@ def run_sam_auto_batch(
         SAM checkpoint to use, by default "sam_b.pt".
     device : str, optional
         Device string, by default "cuda".
+    batch_size : int, optional
+        Number of images per model call, by default 8.
+    return_type : {"items", "result"}, optional
+        Per-image output format, see `run_sam_auto`. Only "items" is
+        supported together with ``server_urls``.
+    server_urls : str or List[str], optional
+        SAM server URL(s). When set, inference runs remotely with images
+        assigned to servers round-robin.
+    max_inflight : int, optional
+        Max concurrent server requests, by default ``2 * len(server_urls)``.
+    pack_masks : bool, optional
+        Return bit-packed masks ("mask_packed" / "mask_shape"), see `run_sam_auto`.
 
     Returns
     -------
-    List[List[Dict[str, Any]]]
-        One list of items per input image, see `run_sam_auto`.
+    List[List[Dict[str, Any]]] or List[SamResult]
+        One entry per input image (same order as ``image_paths``),
+        see `run_sam_auto`.
     """
-    return [run_sam_auto(p, checkpoint=checkpoint, device=device) for p in image_paths]
+    if return_type not in ("items", "result"):
+        raise ValueError(f"Unsupported return_type: {return_type!r}, must be 'items' or 'result'.")
+
+    if server_urls:
+        if return_type != "items":
+            raise ValueError("return_type='result' is not supported with server_urls.")
+        per_image = run_sam_auto_server_batch(
+            image_paths,
+            server_urls,
+            checkpoint=checkpoint,
+            device=device,
+            max_inflight=max_inflight,
+        )
+        if pack_masks:
+            for items in per_image:
+                for it in items:
+                    mask = it.pop("mask", None)
+                    if mask is not None:
+                        it["mask_packed"] = np.packbits(mask.ravel())
+                        it["mask_shape"] = tuple(mask.shape)
+        return per_image
+
+    model = _get_sam_model(checkpoint=checkpoint)
+
+    outputs: List[SamResult] = []
+    for chunk in _iter_batches(image_paths, batch_size):
+        # In recent ultralytics versions, SAM models can receive `device` at call time.
+        # If your installed version does not support this, you can remove `device=device`.
+        try:
+            # ultralytics will load images internally
+            results = model(chunk, device=device, **_infer_kwargs())
+        except TypeError:
+            # Fallback: older/newer API without device argument
+            results = model(chunk)
+
+        chunk_results: List[SamResult] = [SamResult.empty() for _ in chunk]
+        for i, (p, r) in enumerate(zip(chunk, results)):
+            width, height = _get_image_size_fast(p)
+            chunk_results[i] = _sam_result_from_ultralytics(r, width, height)
+        outputs.extend(chunk_results)
+
+    if return_type == "result":
+        return outputs
+    return [res.to_list_of_dicts(pack_masks=pack_masks) for res in outputs]
 
 
 # -----------------------------------------------------------------------------
 # 1.1 SAM post-processing helpers (过滤 / 去重 / Top-K)
 # -----------------------------------------------------------------------------
+def _order_items(items: List[Dict[str, Any]], key: str) -> List[Dict[str, Any]]:
+    """
+    按 key（"score" 或 "area"）从大到小稳定排序实例列表；score 缺失或无法转为数值时回退为 area。
+
+    排序键一次性提取成数组后用 np.argsort 排序，不再对每个元素回调 Python 闭包。
+    """
+    n = len(items)
+    if n == 0:
+        return []
+    areas = np.array([it.get("area", 0) for it in items], dtype=np.float64)
+    keys = areas
+    if key == "score":
+        raw = [it.get("score") for it in items]
+        try:
+            # None 会被转成 NaN
+            scores = np.array(raw, dtype=np.float64)
+        except (TypeError, ValueError):
+            scores = np.full(n, np.nan, dtype=np.float64)
+            for i, v in enumerate(raw):
+                try:
+                    scores[i] = float(v)
+                except (TypeError, ValueError):
+                    pass
+        keys = np.where(np.isnan(scores), areas, scores)
+    order = np.argsort(-keys, kind="stable")
+    return [items[i] for i in order]
+
+
+def _sam_result_order(res: SamResult, key: str) -> np.ndarray:
+    """
+    SamResult 按 key 从大到小的稳定排序下标；score 缺失（NaN）时回退为 area，与字典版一致。
+    """
+    if key == "score":
+        values = np.where(np.isnan(res.scores), res.areas, res.scores)
+    else:
+        values = res.areas.astype(np.float64)
+    return np.argsort(-values, kind="stable")
+
+
 def filter_sam_items_by_area_and_score(
-    items: List[Dict[str, Any]],
+    items: Union[List[Dict[str, Any]], SamResult],
     min_area: int = 0,
     min_score: float = 0.0,
-) -> List[Dict[str, Any]]:
+) -> Union[List[Dict[str, Any]], SamResult]:
     """
     简单按面积和得分过滤 SAM 实例。
 
     Parameters
     ----------
-    items : List[Dict[str, Any]]
-        run_sam_auto 返回的实例列表。
+    items : List[Dict[str, Any]] | SamResult
+        run_sam_auto 返回的实例列表（或 SamResult）。
     min_area : int, optional
         保留的最小像素面积，默认 0（不过滤）。
     min_score : float, optional
@@ -440,9 +958,14 @@ def filter_sam_items_by_area_and_score(
 
     Returns
     -------
-    List[Dict[str, Any]]
-        过滤后的实例列表。
+    List[Dict[str, Any]] | SamResult
+        过滤后的实例，类型与输入一致。
     """
+    if isinstance(items, SamResult):
+        keep = items.areas >= min_area
+        keep &= np.isnan(items.scores) | (items.scores >= float(min_score))
+        return items[keep]
+
     filtered: List[Dict[str, Any]] = []
     for it in items:
         area = int(it.get("area", 0))
@@ -455,6 +978,32 @@ def filter_sam_items_by_area_and_score(
     return filtered
 
 
+if njit is not None:
+
+    @njit(cache=True)
+    def _mask_iou_nb(m1_flat, m2_flat):  # pragma: no cover - compiled
+        inter = 0
+        union = 0
+        for k in range(m1_flat.size):
+            a = m1_flat[k]
+            b = m2_flat[k]
+            if a and b:
+                inter += 1
+            if a or b:
+                union += 1
+        if inter == 0 or union == 0:
+            return 0.0
+        return inter / union
+
+    # 导入时预热一次，把 JIT 编译开销挪出首次调用（cache=True 时后续进程直接读取编译缓存）
+    try:
+        _mask_iou_nb(np.zeros(1, dtype=bool), np.zeros(1, dtype=bool))
+    except Exception:  # pragma: no cover - fall back to pure Python
+        _mask_iou_nb = None  # type: ignore
+else:
+    _mask_iou_nb = None  # type: ignore
+
+
 def bbox_iou(box1: Sequence[float], box2: Sequence[float]) -> float:
     """
     计算两个归一化 bbox 的 IoU。
@@ -502,8 +1051,12 @@ def mask_iou(m1: np.ndarray, m2: np.ndarray) -> float:
         # 简单兜底：形状不一致时不计算 IoU
         return 0.0
 
-    m1_bool = m1.astype(bool)
-    m2_bool = m2.astype(bool)
+    m1_bool = m1.astype(bool, copy=False)
+    m2_bool = m2.astype(bool, copy=False)
+
+    if _mask_iou_nb is not None:
+        # 单次遍历同时统计交集与并集，不生成 logical_and / logical_or 临时数组
+        return float(_mask_iou_nb(m1_bool.ravel(), m2_bool.ravel()))
 
     inter = np.logical_and(m1_bool, m2_bool).sum()
     if inter == 0:
@@ -514,11 +1067,111 @@ def mask_iou(m1: np.ndarray, m2: np.ndarray) -> float:
     return float(inter) / float(union)
 
 
+def _pairwise_mask_iou(masks: Sequence[Any]) -> np.ndarray:
+    """
+    计算一组 mask 两两之间的 IoU 矩阵 [N, N]。
+
+    同形状的 mask 视为 [N, H*W] 的 0/1 矩阵 M，交集为 M @ M.T（按像素分块累加，见 _gram_iou），
+    并集为 areas[:, None] + areas[None, :] - inter。形状不同的 mask 之间 IoU 记为 0（与 mask_iou 一致）。
+    """
+    if isinstance(masks, np.ndarray) and masks.ndim == 3:
+        # 已经堆叠好的 [N, H, W]（如 SamResult.masks）：展平为视图，不做整体转换
+        return _gram_iou(masks.reshape(masks.shape[0], -1))
+
+    n = len(masks)
+    iou = np.zeros((n, n), dtype=np.float64)
+
+    # 按形状分组；展平只取视图，阈值化推迟到 _gram_iou 的分块里
+    groups: Dict[tuple, List[int]] = {}
+    flat: List[np.ndarray] = []
+    for idx, m in enumerate(masks):
+        m_arr = np.asarray(m)
+        groups.setdefault(m_arr.shape, []).append(idx)
+        flat.append(m_arr.ravel())
+
+    for idxs in groups.values():
+        iou[np.ix_(idxs, idxs)] = _gram_iou([flat[i] for i in idxs])
+
+    return iou
+
+
+# _gram_iou 每块 float32 缓冲区的字节上限；单块像素数不超过 2**24，保证 float32 计数精确
+_IOU_CHUNK_BYTES = 64 << 20
+
+
+def _gram_iou(rows: Union[np.ndarray, Sequence[np.ndarray]]) -> np.ndarray:
+    """
+    rows 为 [N, P] 的 mask 矩阵或 N 个长度为 P 的扁平 mask（非零即前景），返回两两 IoU [N, N]。
+
+    沿像素维分块：每块直接把 bool 写入复用的 float32 缓冲区 [N, step] 再做一次 matmul，
+    交集累加到 float64 矩阵，峰值内存约为 _IOU_CHUNK_BYTES 而不是 N * P * 4 字节。
+    """
+    n = len(rows)
+    p = rows.shape[1] if isinstance(rows, np.ndarray) else (rows[0].size if n else 0)
+    inter = np.zeros((n, n), dtype=np.float64)
+    if n == 0 or p == 0:
+        return inter
+
+    step = max(1, min(p, 1 << 24, _IOU_CHUNK_BYTES // (4 * n)))
+    buf = np.empty((n, step), dtype=np.float32)
+    for p0 in range(0, p, step):
+        p1 = min(p, p0 + step)
+        blk = buf[:, : p1 - p0]
+        if isinstance(rows, np.ndarray):
+            _fill_mask_block(blk, rows[:, p0:p1])
+        else:
+            for r, row in enumerate(rows):
+                _fill_mask_block(blk[r], row[p0:p1])
+        inter += blk @ blk.T
+
+    areas = np.diag(inter)
+    union = areas[:, None] + areas[None, :] - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=(inter > 0) & (union > 0))
+
+
+def _fill_mask_block(out: np.ndarray, src: np.ndarray) -> None:
+    """把 mask 片段按 0/1 写入 float32 缓冲区（bool 直接转换，其他类型按 > 0 阈值化）。"""
+    if src.dtype == bool:
+        np.copyto(out, src)
+    else:
+        np.greater(src, 0, out=out)
+
+
+def _bbox_nms_keep(boxes: np.ndarray, iou_threshold: float) -> List[int]:
+    """
+    对已按优先级排好序的 [N, 4] bbox 做贪心 NMS，返回保留的下标。
+
+    一次性用广播算出 [N, N] 的重叠判定矩阵，再在其上做贪心“淘汰”扫描。
+    """
+    boxes = np.asarray(boxes, dtype=np.float64)
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = np.maximum(0.0, x2 - x1) * np.maximum(0.0, y2 - y1)
+
+    inter_w = np.maximum(0.0, np.minimum(x2[:, None], x2[None, :]) - np.maximum(x1[:, None], x1[None, :]))
+    inter_h = np.maximum(0.0, np.minimum(y2[:, None], y2[None, :]) - np.maximum(y1[:, None], y1[None, :]))
+    inter = inter_w * inter_h
+    union = areas[:, None] + areas[None, :] - inter
+    # iou >= t 改写为 inter >= t * union，省去除法；与 bbox_iou 一致，无交集或 union 非正时 IoU 记为 0
+    valid = (inter > 0.0) & (union > 0.0)
+    overlap = np.where(valid, inter >= iou_threshold * union, 0.0 >= iou_threshold)
+
+    n = boxes.shape[0]
+    killed = np.zeros(n, dtype=bool)
+    keep: List[int] = []
+    for i in range(n):
+        if killed[i]:
+            continue
+        keep.append(i)
+        # 只看上三角：当前保留框只会淘汰排在它后面的候选
+        killed[i + 1:] |= overlap[i, i + 1:]
+    return keep
+
+
 def nms_sam_items_by_bbox(
-    items: List[Dict[str, Any]],
+    items: Union[List[Dict[str, Any]], SamResult],
     iou_threshold: float = 0.5,
     score_key: str = "score",  # "score" | "area"
-) -> List[Dict[str, Any]]:
+) -> Union[List[Dict[str, Any]], SamResult]:
     """
     基于 bbox IoU 的 Non-Maximum Suppression（NMS）去重。
 
@@ -527,8 +1180,8 @@ def nms_sam_items_by_bbox(
 
     Parameters
     ----------
-    items : List[Dict[str, Any]]
-        run_sam_auto 返回的实例列表。
+    items : List[Dict[str, Any]] | SamResult
+        run_sam_auto 返回的实例列表（或 SamResult）。
     iou_threshold : float, optional
         IoU 阈值，超过则认为“太重叠”，默认 0.5。
     score_key : str, optional
@@ -536,50 +1189,64 @@ def nms_sam_items_by_bbox(
 
     Returns
     -------
-    List[Dict[str, Any]]
-        经过 NMS 去重后的实例列表。
+    List[Dict[str, Any]] | SamResult
+        经过 NMS 去重后的实例，类型与输入一致。
     """
-
-    def _score(it: Dict[str, Any]) -> float:
-        if score_key == "score":
-            v = it.get("score")
-            if v is not None:
-                try:
-                    return float(v)
-                except Exception:
-                    pass
-        # fallback to area
-        return float(it.get("area", 0))
-
-    # 从高分/大面积到低分/小面积排序
-    items_sorted = sorted(items, key=_score, reverse=True)
-
-    kept: List[Dict[str, Any]] = []
-    for it in items_sorted:
-        bbox = it.get("bbox")
-        if not bbox or len(bbox) != 4:
+    if isinstance(items, SamResult):
+        order = _sam_result_order(items, score_key)
+        keep = _bbox_nms_keep(items.bboxes[order], iou_threshold)
+        return items[order[keep]]
+
+    # 从高分/大面积到低分/小面积排序（无有效 bbox 的实例直接丢弃）
+    items_sorted = [
+        it
+        for it in _order_items(items, score_key)
+        if it.get("bbox") and len(it["bbox"]) == 4
+    ]
+    if not items_sorted:
+        return []
+
+    keep = _bbox_nms_keep(np.asarray([it["bbox"] for it in items_sorted]), iou_threshold)
+    return [items_sorted[i] for i in keep]
+
+
+def _mask_nms_keep(
+    masks: Sequence[Any],
+    iou_threshold: float,
+    order: Optional[np.ndarray] = None,
+) -> List[int]:
+    """
+    对已按优先级排好序的 mask 做贪心 NMS，返回保留的下标；形状不同的 mask 互不抑制。
+    给定 order 时 masks 不必预先排序：在 IoU 矩阵上按 order 重排（不复制整组 mask），
+    返回的是 order 中的位置。
+    """
+    n = len(masks)
+    iou = _pairwise_mask_iou(masks)
+    if order is not None:
+        iou = iou[np.ix_(order, order)]
+    # 形状不同则不参与去重（已堆叠的 [N, H, W] 形状必然一致）
+    if isinstance(masks, np.ndarray) and masks.ndim == 3:
+        shape_of = np.zeros(n, dtype=np.int64)
+    else:
+        shape_ids: Dict[tuple, int] = {}
+        shape_of = np.array([shape_ids.setdefault(np.shape(m), len(shape_ids)) for m in masks])
+
+    # 在预先算好的 IoU 矩阵上做贪心抑制，不再逐对做像素级运算
+    suppressed = np.zeros(n, dtype=bool)
+    keep: List[int] = []
+    for i in range(n):
+        if suppressed[i]:
             continue
-
-        keep = True
-        for kept_it in kept:
-            kept_bbox = kept_it.get("bbox")
-            if not kept_bbox or len(kept_bbox) != 4:
-                continue
-            iou = bbox_iou(bbox, kept_bbox)
-            if iou >= iou_threshold:
-                keep = False
-                break
-        if keep:
-            kept.append(it)
-
-    return kept
+        keep.append(i)
+        suppressed[i + 1:] |= (iou[i, i + 1:] >= iou_threshold) & (shape_of[i + 1:] == shape_of[i])
+    return keep
 
 
 def nms_sam_items_by_mask(
-    items: List[Dict[str, Any]],
+    items: Union[List[Dict[str, Any]], SamResult],
     iou_threshold: float = 0.5,
     score_key: str = "score",
-) -> List[Dict[str, Any]]:
+) -> Union[List[Dict[str, Any]], SamResult]:
     """
     基于 mask IoU 的 Non-Maximum Suppression（NMS）去重。
 
@@ -588,8 +1255,8 @@ def nms_sam_items_by_mask(
 
     Parameters
     ----------
-    items : List[Dict[str, Any]]
-        run_sam_auto 返回的实例列表。
+    items : List[Dict[str, Any]] | SamResult
+        run_sam_auto 返回的实例列表（或 SamResult）。
     iou_threshold : float, optional
         IoU 阈值，默认 0.5。
     score_key : str, optional
@@ -597,66 +1264,43 @@ def nms_sam_items_by_mask(
 
     Returns
     -------
-    List[Dict[str, Any]]
-        经过 NMS 去重后的实例列表。
+    List[Dict[str, Any]] | SamResult
+        经过 NMS 去重后的实例，类型与输入一致。
     """
-
-    def _score(it: Dict[str, Any]) -> float:
-        if score_key == "score":
-            v = it.get("score")
-            if v is not None:
-                try:
-                    return float(v)
-                except Exception:
-                    pass
-        return float(it.get("area", 0))
-
-    items_sorted = sorted(items, key=_score, reverse=True)
-    kept: List[Dict[str, Any]] = []
-
-    for it in items_sorted:
-        m = it.get("mask")
-        if m is None:
-            continue
-        m_arr = np.array(m)
-        if m_arr.dtype != bool:
-            m_arr = m_arr > 0
-
-        keep = True
-        for kept_it in kept:
-            m2 = kept_it.get("mask")
-            if m2 is None:
-                continue
-            m2_arr = np.array(m2)
-            if m2_arr.dtype != bool:
-                m2_arr = m2_arr > 0
-
-            # 形状不同则视作 IoU=0（不去重）
-            if m_arr.shape != m2_arr.shape:
-                continue
-
-            iou = mask_iou(m_arr, m2_arr)
-            if iou >= iou_threshold:
-                keep = False
-                break
-        if keep:
-            kept.append(it)
-
-    return kept
+    if isinstance(items, SamResult):
+        if len(items) == 0:
+            return items
+        order = _sam_result_order(items, score_key)
+        keep = _mask_nms_keep(items.masks, iou_threshold, order=order)
+        return items[order[keep]]
+
+    # packbits 的实例在这里才解包，且每个只解包一次
+    items_sorted: List[Dict[str, Any]] = []
+    masks: List[np.ndarray] = []
+    for it in _order_items(items, score_key):
+        mask = unpack_mask(it)
+        if mask is not None:
+            items_sorted.append(it)
+            masks.append(mask)
+    if not items_sorted:
+        return []
+
+    keep = _mask_nms_keep(masks, iou_threshold)
+    return [items_sorted[i] for i in keep]
 
 
 def topk_sam_items(
-    items: List[Dict[str, Any]],
+    items: Union[List[Dict[str, Any]], SamResult],
     k: int = 0,
     sort_key: str = "area",  # "area" | "score"
-) -> List[Dict[str, Any]]:
+) -> Union[List[Dict[str, Any]], SamResult]:
     """
     只保留 Top-K 个 SAM 实例。
 
     Parameters
     ----------
-    items : List[Dict[str, Any]]
-        run_sam_auto 返回的实例列表。
+    items : List[Dict[str, Any]] | SamResult
+        run_sam_auto 返回的实例列表（或 SamResult）。
     k : int, optional
         要保留的实例数量；小于等于 0 时不截断，默认 0。
     sort_key : str, optional
@@ -664,28 +1308,20 @@ def topk_sam_items(
 
     Returns
     -------
-    List[Dict[str, Any]]
-        截断后的实例列表。
+    List[Dict[str, Any]] | SamResult
+        截断后的实例，类型与输入一致。
     """
     if k is None or k <= 0:
         return items
 
-    def _score(it: Dict[str, Any]) -> float:
-        if sort_key == "score":
-            v = it.get("score")
-            if v is not None:
-                try:
-                    return float(v)
-                except Exception:
-                    pass
-        return float(it.get("area", 0))
+    if isinstance(items, SamResult):
+        return items[_sam_result_order(items, sort_key)[:k]]
 
-    items_sorted = sorted(items, key=_score, reverse=True)
-    return items_sorted[:k]
+    return _order_items(items, sort_key)[:k]
 
 
 def postprocess_sam_items(
-    items: List[Dict[str, Any]],
+    items: Union[List[Dict[str, Any]], SamResult],
     min_area: int = 0,
     min_score: float = 0.0,
     iou_threshold: float = 0.0,
@@ -693,7 +1329,7 @@ def postprocess_sam_items(
     nms_by: str = "bbox",  # "bbox" | "mask"
     score_key_for_nms: str = "score",  # "score" | "area"
     sort_key_for_topk: str = "area",  # "area" | "score"
-) -> List[Dict[str, Any]]:
+) -> Union[List[Dict[str, Any]], SamResult]:
     """
     统一封装 SAM 实例的后处理流程（过滤 + NMS + Top-K）。
 
@@ -710,8 +1346,8 @@ def postprocess_sam_items(
 
     Parameters
     ----------
-    items : List[Dict[str, Any]]
-        run_sam_auto 返回的实例列表。
+    items : List[Dict[str, Any]] | SamResult
+        run_sam_auto 返回的实例列表（或 SamResult，此时全程按数组处理并返回 SamResult）。
     min_area : int, optional
         最小保留面积，默认 0（不过滤）。
     min_score : float, optional
@@ -729,8 +1365,8 @@ def postprocess_sam_items(
 
     Returns
     -------
-    List[Dict[str, Any]]
-        经过后处理的 SAM 实例列表。
+    List[Dict[str, Any]] | SamResult
+        经过后处理的 SAM 实例，类型与输入一致。
     """
     # 1) 面积 / 得分过滤
     out = filter_sam_items_by_area_and_score(
@@ -778,7 +1414,12 @@ def _get_yolo_model(
     _ensure_ultralytics_yolo_available()
     key = (weights, device)
     if key not in _YOLO_MODELS:
-        _YOLO_MODELS[key] = YOLO(weights).to(device)
+        # 每个 (weights, device) 独立加载；旧设备上的模型由 LRU 淘汰，不做原地迁移
+        model = YOLO(weights).to(device)
+        if _compile_enabled() and str(device).startswith("cuda"):
+            model.model = _maybe_compile(model.model)
+            _warmup_model(model)
+        _YOLO_MODELS[key] = model
     return _YOLO_MODELS[key]
 
 
@@ -808,66 +1449,76 @@ def run_yolov8_seg(
             - label: str
             - score: float
     """
-    model = _get_yolo_model(weights=weights, device=device)
-    results = model(image_path)
-
-    width, height = _get_image_size(image_path)
-    all_items: List[Dict[str, Any]] = []
-
-    for r in results:
-        masks = getattr(r, "masks", None)
-        boxes = getattr(r, "boxes", None)
-        names = getattr(r, "names", None) or {}
-
-        if masks is None or boxes is None:
-            continue
-
-        mask_data = masks.data.cpu().numpy()  # [N, H, W]
-        xyxy = boxes.xyxy.cpu().numpy()  # [N, 4]
-        conf = boxes.conf.cpu().numpy()  # [N]
-        cls = boxes.cls.cpu().numpy()  # [N]
+    return run_yolov8_seg_batch(
+        [image_path], weights=weights, device=device, batch_size=1
+    )[0]
 
-        n_instances = mask_data.shape[0]
-        for i in range(n_instances):
-            m = mask_data[i] > 0.5  # bool
 
-            x1, y1, x2, y2 = xyxy[i]
-            x1 = float(max(0, min(width, x1))) / max(width, 1)
-            x2 = float(max(0, min(width, x2))) / max(width, 1)
-            y1 = float(max(0, min(height, y1))) / max(height, 1)
-            y2 = float(max(0, min(height, y2))) / max(height, 1)
-            bbox_norm = [x1, y1, x2, y2]
-
-            c = int(cls[i])
-            label = names.get(c, str(c))
-            score = float(conf[i])
-
-            all_items.append(
-                {
-                    "mask": m,
-                    "bbox": bbox_norm,
-                    "label": label,
-                    "score": score,
-                }
-            )
-
-    return all_items
+def _yolo_items_from_result(r: Any, width: int, height: int) -> List[Dict[str, Any]]:
+    """
+    将单张图片的 ultralytics YOLO 结果转换为实例列表（结构见 run_yolov8_seg）。
+    """
+    masks = getattr(r, "masks", None)
+    boxes = getattr(r, "boxes", None)
+    names = getattr(r, "names", None) or {}
+
+    if masks is None or boxes is None:
+        return []
+
+    mbools = _masks_to_bool_numpy(masks.data)  # [N, H, W] bool
+    xyxy = boxes.xyxy.cpu().numpy()  # [N, 4]
+    conf = boxes.conf.cpu().numpy()  # [N]
+    cls = boxes.cls.cpu().numpy()  # [N]
+
+    n_instances = mbools.shape[0]
+    bboxes = _normalize_xyxy(xyxy, width, height).tolist()
+    scores_list = conf.tolist()
+    cls_list = cls.astype(np.int64).tolist()
+
+    items: List[Dict[str, Any]] = []
+    for i in range(n_instances):
+        c = cls_list[i]
+        items.append(
+            {
+                "mask": mbools[i],
+                "bbox": bboxes[i],
+                "label": names.get(c, str(c)),
+                "score": scores_list[i],
+            }
+        )
+    return items
 
 
 def run_yolov8_seg_batch(
     image_paths: List[str],
     weights: str = "yolov8n-seg.pt",
     device: str = "cuda",
+    batch_size: int = 8,
 ) -> List[List[Dict[str, Any]]]:
     """
     Batch instance segmentation using YOLOv8.
 
+    Images are passed to the model ``batch_size`` paths at a time, so each
+    chunk runs as one batched forward pass.
+
     Returns
     -------
     List[List[Dict[str, Any]]]
         One list of items per input image, see `run_yolov8_seg`.
     """
-    return [run_yolov8_seg(p, weights=weights, device=device) for p in image_paths]
+    model = _get_yolo_model(weights=weights, device=device)
+
+    outputs: List[List[Dict[str, Any]]] = []
+    for chunk in _iter_batches(image_paths, batch_size):
+        results = model(chunk, **_infer_kwargs())
+
+        chunk_items: List[List[Dict[str, Any]]] = [[] for _ in chunk]
+        for i, (p, r) in enumerate(zip(chunk, results)):
+            width, height = _get_image_size_fast(p)
+            chunk_items[i] = _yolo_items_from_result(r, width, height)
+        outputs.extend(chunk_items)
+
+    return outputs
 
 
 # -----------------------------------------------------------------------------
@@ -962,12 +1613,101 @@ def run_hf_semantic_seg_batch(
 # -----------------------------------------------------------------------------
 # 4. Classical segmentation: Felzenszwalb graph-based segmentation
 # -----------------------------------------------------------------------------
+@lru_cache(maxsize=64)
+def _run_felz_cached(
+    image_path: str,
+    mtime_ns: int,
+    scale: float,
+    sigma: float,
+    min_size: int,
+) -> np.ndarray:
+    img = skio.imread(image_path)
+    segments = segmentation.felzenszwalb(
+        img, scale=scale, sigma=sigma, min_size=min_size
+    )
+    # 缓存对象被多次复用，置为只读防止调用方原地修改污染缓存
+    segments.setflags(write=False)
+    return segments
+
+
+def _get_felzenszwalb_segments(
+    image_path: str,
+    scale: float,
+    sigma: float,
+    min_size: int,
+) -> np.ndarray:
+    """
+    返回 Felzenszwalb 标签图（只读）；按 (路径, mtime, 参数) 做 LRU 缓存，
+    同一张图先后调用 run_felzenszwalb / save_felzenszwalb_visualization 时只分割一次。
+    """
+    st = os.stat(image_path)
+    return _run_felz_cached(
+        os.path.abspath(image_path), st.st_mtime_ns, float(scale), float(sigma), int(min_size)
+    )
+
+
+def _label_pixel_index(segments: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    为整数标签图建立 CSR 风格的“标签 → 像素下标”索引。
+
+    Returns
+    -------
+    (order, offsets, labels)
+        order 为按标签稳定排序后的扁平像素下标；第 k 个标签 labels[k] 的像素为
+        order[offsets[k]:offsets[k + 1]]。labels 升序且只包含实际出现的标签。
+    """
+    flat = segments.ravel()
+    base = int(flat.min()) if flat.size else 0
+    shifted = flat - base if base != 0 else flat
+    order = np.argsort(shifted, kind="stable")
+    counts = np.bincount(shifted)
+    present = np.flatnonzero(counts)
+    offsets = np.zeros(present.size + 1, dtype=np.int64)
+    np.cumsum(counts[present], out=offsets[1:])
+    return order, offsets, present + base
+
+
+if njit is not None:
+
+    @njit(parallel=True, cache=True)
+    def _labels_to_masks_nb(segments, label_to_idx, out):  # pragma: no cover - compiled
+        h, w = segments.shape
+        # 按行并行，各行写入互不重叠的像素
+        for y in prange(h):
+            for x in range(w):
+                idx = label_to_idx[segments[y, x]]
+                if idx >= 0:
+                    out[idx, y, x] = 1
+else:
+    _labels_to_masks_nb = None  # type: ignore
+
+
+def _labels_to_masks(segments: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    用 numba 并行内核一次扫描标签图，写出预分配的 [L, H, W] 掩膜（uint8 缓冲区按 bool 视图返回）。
+
+    Returns
+    -------
+    (masks, labels)
+        masks[k] 为标签 labels[k] 的布尔掩膜；labels 升序且只包含实际出现的标签。
+    """
+    base = int(segments.min()) if segments.size else 0
+    shifted = segments - base if base != 0 else segments
+    counts = np.bincount(shifted.ravel())
+    present = np.flatnonzero(counts)
+    label_to_idx = np.full(counts.size, -1, dtype=np.int32)
+    label_to_idx[present] = np.arange(present.size, dtype=np.int32)
+    out = np.zeros((present.size,) + segments.shape, dtype=np.uint8)
+    _labels_to_masks_nb(np.ascontiguousarray(shifted), label_to_idx, out)
+    return out.view(bool), present + base
+
+
 def run_felzenszwalb(
     image_path: str,
     scale: float = 100.0,
     sigma: float = 0.5,
     min_size: int = 50,
-    return_type: str = "labels",  # "labels" | "masks"
+    return_type: str = "labels",  # "labels" | "masks" | "indices"
 ) -> Dict[str, Any]:
     """
     Perform Felzenszwalb's efficient graph-based segmentation.
@@ -982,9 +1722,11 @@ def run_felzenszwalb(
         Gaussian smoothing parameter, by default 0.5.
     min_size: int, optional
         Minimum component size, by default 50.
-    return_type: {"labels", "masks"}, optional
+    return_type: {"labels", "masks", "indices"}, optional
         - "labels": return an integer label map [H, W]
         - "masks": return a list of bool masks for each segment id
+        - "indices": return a CSR-style pixel index per segment (no per-segment
+          full-image masks; accepted directly by `save_sam_instances`)
 
     Returns
     -------
@@ -999,34 +1741,61 @@ def run_felzenszwalb(
                 "masks": list[np.ndarray[H, W] bool],
                 "labels": list[int],
             }
+        If return_type == "indices":
+            {
+                "pixel_indices": np.ndarray[H*W] int32/int64,  # flat pixel ids grouped by label
+                "offsets": np.ndarray[L+1] int64,
+                "labels": np.ndarray[L] int,
+                "shape": (H, W),
+            }
+            Pixels of labels[k] are pixel_indices[offsets[k]:offsets[k + 1]].
     """
     _ensure_skimage_available()
 
-    img = skio.imread(image_path)
-    segments = segmentation.felzenszwalb(
-        img, scale=scale, sigma=sigma, min_size=min_size
-    )
-    unique_labels = np.unique(segments)
+    segments = _get_felzenszwalb_segments(image_path, scale, sigma, min_size)
 
     if return_type == "labels":
         return {
-            "segments": segments,
-            "num_segments": int(unique_labels.size),
+            # 缓存中的标签图是只读的，返回副本供调用方自由修改
+            "segments": segments.copy(),
+            "num_segments": int(np.unique(segments).size),
         }
 
     if return_type == "masks":
+        if _labels_to_masks_nb is not None and segments.size:
+            # numba 可用时单次并行扫描写出全部掩膜
+            mask_block, unique_labels = _labels_to_masks(segments)
+            return {
+                "masks": list(mask_block),
+                "labels": unique_labels.tolist(),
+            }
+
+        # 一次排序得到每个标签的像素下标，逐标签只写入自己的像素，不再对整张标签图做 K 次比较
+        order, offsets, unique_labels = _label_pixel_index(segments)
         masks: List[np.ndarray] = []
-        labels: List[int] = []
-        for lab in unique_labels:
-            m = segments == lab
-            masks.append(m)
-            labels.append(int(lab))
+        for k in range(unique_labels.size):
+            m = np.zeros(segments.size, dtype=bool)
+            m[order[offsets[k]:offsets[k + 1]]] = True
+            masks.append(m.reshape(segments.shape))
         return {
             "masks": masks,
-            "labels": labels,
+            "labels": unique_labels.tolist(),
+        }
+
+    if return_type == "indices":
+        order, offsets, unique_labels = _label_pixel_index(segments)
+        if order.size <= np.iinfo(np.int32).max:
+            order = order.astype(np.int32)
+        return {
+            "pixel_indices": order,
+            "offsets": offsets,
+            "labels": unique_labels,
+            "shape": tuple(segments.shape),
         }
 
-    raise ValueError(f"Unsupported return_type: {return_type!r}, must be 'labels' or 'masks'.")
+    raise ValueError(
+        f"Unsupported return_type: {return_type!r}, must be 'labels', 'masks' or 'indices'."
+    )
 
 
 def save_felzenszwalb_visualization(
@@ -1061,9 +1830,7 @@ def save_felzenszwalb_visualization(
     _ensure_matplotlib_available()
 
     img = skio.imread(image_path)
-    segments = segmentation.felzenszwalb(
-        img, scale=scale, sigma=sigma, min_size=min_size
-    )
+    segments = _get_felzenszwalb_segments(image_path, scale, sigma, min_size)
     vis = segmentation.mark_boundaries(img, segments)
 
     out_p = Path(output_path)
@@ -1082,9 +1849,140 @@ def save_felzenszwalb_visualization(
 # -----------------------------------------------------------------------------
 # 5. Save SAM instances as images
 # -----------------------------------------------------------------------------
+class _RGBABufferPool:
+    """
+    按字节容量复用 uint8 缓冲区：acquire 返回指定形状的视图，release 后供后续实例复用。
+    各实例的 bbox 形状不同，按容量而不是按形状匹配，顺序处理时通常只分配一块最大的缓冲区。
+    """
+
+    def __init__(self, max_buffers: int = 4):
+        self.max_buffers = max(1, int(max_buffers))
+        self._free: List[np.ndarray] = []
+        # release 会在 PNG 保存线程的回调里调用
+        self._lock = threading.Lock()
+
+    def acquire(self, shape: Tuple[int, ...]) -> np.ndarray:
+        need = int(np.prod(shape))
+        with self._lock:
+            for i, buf in enumerate(self._free):
+                if buf.size >= need:
+                    del self._free[i]
+                    return buf[:need].reshape(shape)
+        return np.empty(need, dtype=np.uint8).reshape(shape)
+
+    def release(self, arr: np.ndarray) -> None:
+        # acquire 返回的视图 .base 即底层的扁平缓冲区
+        buf = arr.base if arr.base is not None else arr.reshape(-1)
+        with self._lock:
+            self._free.append(buf)
+            if len(self._free) > self.max_buffers:
+                # 只保留容量最大的几块
+                self._free.sort(key=lambda b: b.size, reverse=True)
+                del self._free[self.max_buffers:]
+
+
+def _get_png_save_pool() -> ThreadPoolExecutor:
+    """
+    懒加载 PNG 保存线程池（进程内共享）。
+    """
+    global _PNG_SAVE_POOL
+    if _PNG_SAVE_POOL is None:
+        _PNG_SAVE_POOL = ThreadPoolExecutor(
+            max_workers=min(8, os.cpu_count() or 1),
+            thread_name_prefix="sam_png_save",
+        )
+    return _PNG_SAVE_POOL
+
+
+def _write_png(patch: Image.Image, out_path: Path) -> None:
+    """
+    先在内存中编码 PNG，再一次 write 写出整个文件，避免 Pillow 逐 chunk 写文件产生的大量小 write 系统调用。
+    """
+    buf = BytesIO()
+    patch.save(buf, format="PNG", compress_level=_PNG_COMPRESS_LEVEL)
+    with open(out_path, "wb") as f:
+        f.write(buf.getbuffer())
+
+
+def _submit_png_save(
+    patch: Image.Image,
+    out_path: Path,
+    futures: List[Any],
+    buf_pool: Optional[_RGBABufferPool] = None,
+    buf: Optional[np.ndarray] = None,
+) -> None:
+    """
+    把一张实例截图提交到 PNG 保存线程池；给定 buf 时在保存完成后归还到 buf_pool
+    （fromarray 得到的图片可能与 buf 共享内存）。
+    """
+    fut = _get_png_save_pool().submit(_write_png, patch, out_path)
+    if buf_pool is not None and buf is not None:
+        fut.add_done_callback(lambda _f: buf_pool.release(buf))
+    futures.append(fut)
+
+
+def _save_indexed_instances(
+    img: Image.Image,
+    index: Dict[str, Any],
+    out_dir: Path,
+    prefix: str,
+    mode: str,
+) -> List[str]:
+    """
+    按 run_felzenszwalb(return_type="indices") 的 CSR 像素索引逐个保存实例：
+    每个实例只把自己的像素下标 divmod 成 (ys, xs)，bbox 和 mask 都只在 bbox 范围内构造。
+    """
+    width, height = img.size
+    h, w = (int(v) for v in index["shape"])
+    if (h, w) != (height, width):
+        raise ValueError(
+            f"Index shape {(h, w)} does not match image size {(height, width)}."
+        )
+
+    order = index["pixel_indices"]
+    offsets = index["offsets"]
+    if mode == "bbox":
+        rgb_img = img.convert("RGB")
+    else:
+        rgba_full = np.asarray(img)  # H x W x 4
+        pool = _RGBABufferPool()
+
+    saved_paths: List[str] = []
+    futures: List[Any] = []
+    for k in range(len(offsets) - 1):
+        pix = order[offsets[k]:offsets[k + 1]]
+        if pix.size == 0:
+            continue
+        ys, xs = np.divmod(pix, w)
+        top, bottom = int(ys.min()), int(ys.max()) + 1
+        left, right = int(xs.min()), int(xs.max()) + 1
+
+        if mode == "bbox":
+            patch = rgb_img.crop((left, top, right, bottom))
+        else:
+            sub = pool.acquire((bottom - top, right - left, 4))
+            np.copyto(sub, rgba_full[top:bottom, left:right])
+            inside = np.zeros(sub.shape[:2], dtype=bool)
+            inside[ys - top, xs - left] = True
+            sub[~inside, 3] = 0
+            patch = Image.fromarray(sub)
+
+        out_path = out_dir / f"{prefix}{k}.png"
+        if mode == "rgba":
+            _submit_png_save(patch, out_path, futures, pool, sub)
+        else:
+            _submit_png_save(patch, out_path, futures)
+        saved_paths.append(str(out_path.resolve()))
+
+    # 等待全部写出完成，并把保存时的异常抛给调用方
+    for fut in futures:
+        fut.result()
+    return saved_paths
+
+
 def save_sam_instances(
     image_path: str,
-    items: List[Dict[str, Any]],
+    items: Union[List[Dict[str, Any]], Dict[str, Any]],
     output_dir: Union[str, Path],
     prefix: str = "sam_inst_",
     mode: str = "bbox",  # "bbox" | "rgba"
@@ -1098,8 +1996,10 @@ def save_sam_instances(
         Original image path.
     items : List[Dict[str, Any]]
         The list returned by `run_sam_auto`, each item must contain:
-          - "mask": np.ndarray[H, W] bool
+          - "mask": np.ndarray[H, W] bool (or "mask_packed" / "mask_shape")
           - "bbox": [x1, y1, x2, y2] normalized
+        A `run_felzenszwalb(..., return_type="indices")` result is also
+        accepted; each segment is then saved from its pixel index slice.
     output_dir : str | Path
         Directory to save cropped images. Will be created if not exists.
     prefix : str, optional
@@ -1120,12 +2020,25 @@ def save_sam_instances(
     img = _load_image_pil(image_path).convert("RGBA")
     width, height = img.size
 
+    if isinstance(items, dict) and "pixel_indices" in items:
+        if mode not in ("bbox", "rgba"):
+            raise ValueError(f"Unsupported mode: {mode!r}, must be 'bbox' or 'rgba'.")
+        return _save_indexed_instances(img, items, out_dir, prefix, mode)
+
+    # 整图的 RGB / RGBA 数组只转换一次，循环内只按 bbox 取局部
+    rgb_img = img.convert("RGB") if mode == "bbox" else None
+    rgba_full = np.asarray(img) if mode == "rgba" else None  # H x W x 4
+    pool = _RGBABufferPool()
+
     saved_paths: List[str] = []
+    futures: List[Any] = []
 
     for idx, item in enumerate(items):
-        mask = item.get("mask")
         bbox = item.get("bbox")
-        if mask is None or bbox is None:
+        if bbox is None:
+            continue
+        mask = unpack_mask(item)
+        if mask is None:
             continue
 
         if not isinstance(mask, np.ndarray):
@@ -1155,23 +2068,26 @@ def save_sam_instances(
 
         if mode == "bbox":
             # Simple rectangular crop from original image (no transparency)
-            rgb_img = img.convert("RGB")
             patch = rgb_img.crop((left, top, right, bottom))
         elif mode == "rgba":
-            # Apply mask as alpha to original image, then crop
-            rgba = np.array(img)  # H x W x 4
-            alpha = rgba[:, :, 3]
-            alpha[~m_bool] = 0
-            rgba[:, :, 3] = alpha
-            masked_img = Image.fromarray(rgba)
-            patch = masked_img.crop((left, top, right, bottom))
+            # Crop first, then apply the cropped mask as alpha (bbox-sized pooled buffer)
+            sub = pool.acquire((bottom - top, right - left, 4))
+            np.copyto(sub, rgba_full[top:bottom, left:right])
+            sub[~m_bool[top:bottom, left:right], 3] = 0
+            patch = Image.fromarray(sub)
         else:
             raise ValueError(f"Unsupported mode: {mode!r}, must be 'bbox' or 'rgba'.")
 
         out_path = out_dir / f"{prefix}{idx}.png"
-        patch.save(out_path)
+        if mode == "rgba":
+            _submit_png_save(patch, out_path, futures, pool, sub)
+        else:
+            _submit_png_save(patch, out_path, futures)
         saved_paths.append(str(out_path.resolve()))
 
+    # 等待全部写出完成，并把保存时的异常抛给调用方
+    for fut in futures:
+        fut.result()
     return saved_paths
 
 
@@ -1,12 +1,27 @@
 import os
 import re
 import base64
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
+from functools import lru_cache
 from io import BytesIO
-from typing import Tuple
+from typing import Any, Callable, Tuple, TypeVar
 from PIL import Image
 from dataflow_agent.logger import get_logger
 
+try:
+    from pybase64 import b64encode_as_string as _b64encode_as_string  # SIMD 加速的 base64 编码
+except ImportError:
+    _b64encode_as_string = None
+
+try:
+    from blake3 import blake3 as _content_hash  # SIMD 加速的内容哈希
+except ImportError:
+    from hashlib import blake2b as _content_hash
+
 log = get_logger(__name__)
 
 class Provider(str, Enum):
@@ -16,6 +31,19 @@ class Provider(str, Enum):
 
 _B64_RE = re.compile(r"[A-Za-z0-9+/=]+")
 
+_T = TypeVar("_T")
+
+# 图片读取 / 压缩 / base64 编解码专用线程池，不与事件循环默认 executor 上的其它任务争用
+_ENCODE_POOL = ThreadPoolExecutor(
+    max_workers=min(32, (os.cpu_count() or 1) * 2),
+    thread_name_prefix="mm-enc",
+)
+
+async def run_in_encode_pool(fn: Callable[..., _T], *args: Any) -> _T:
+    """在专用线程池中执行阻塞的编解码 / 文件读写函数"""
+    return await asyncio.get_running_loop().run_in_executor(_ENCODE_POOL, fn, *args)
+
+@lru_cache(maxsize=256)
 def detect_provider(api_url: str) -> Provider:
     """
     根据 api_url 粗略识别服务商
@@ -34,32 +62,60 @@ def extract_base64(s: str) -> str:
     matches = _B64_RE.findall(s)          # 提取候选段
     return max(matches, key=len) if matches else ""
 
+def encode_bytes_to_base64(raw: bytes) -> str:
+    """
+    二进制数据编码为 Base64 字符串；安装了 pybase64 时使用其 SIMD 实现
+    """
+    if _b64encode_as_string is not None:
+        return _b64encode_as_string(raw)
+    return base64.b64encode(raw).decode("utf-8")
+
+# 按图片内容摘要缓存编码结果：不同路径下的同一张图（如多页共用的参考图）只编码一次
+_B64_BY_DIGEST_MAXSIZE = 16
+_b64_by_digest: "OrderedDict[Tuple[bytes, str], Tuple[str, str]]" = OrderedDict()
+_b64_by_digest_lock = threading.Lock()
+
 def encode_image_to_base64(image_path: str) -> Tuple[str, str]:
     """
     读取本地图片并编码为 Base64，同时返回图片格式（jpeg / png）。
     如果图片过大（>3MB），则自动进行压缩/Resize以避免 413 错误。
+    内容相同的图片（按内容摘要判断）直接复用之前的编码结果。
     """
-    MAX_SIZE = 6 * 1024 * 1024  # 6MB
-    MAX_DIM = 2048              # 最大边长 2048
-
     if not os.path.exists(image_path):
          raise FileNotFoundError(f"Image not found: {image_path}")
 
-    file_size = os.path.getsize(image_path)
     ext = image_path.rsplit(".", 1)[-1].lower()
     fmt = "jpeg" if ext in {"jpg", "jpeg"} else "png"
 
-    # 如果文件小于 3MB 且是常见格式，直接读取
-    if file_size < MAX_SIZE and fmt in ["jpeg", "png"]:
-        with open(image_path, "rb") as f:
-            raw = f.read()
-        b64 = base64.b64encode(raw).decode("utf-8")
-        return b64, fmt
+    with open(image_path, "rb") as f:
+        raw = f.read()
+
+    key = (_content_hash(raw).digest(), fmt)
+    with _b64_by_digest_lock:
+        cached = _b64_by_digest.get(key)
+        if cached is not None:
+            _b64_by_digest.move_to_end(key)
+            return cached
+
+    result = _encode_image_bytes(raw, fmt, image_path)
+    with _b64_by_digest_lock:
+        _b64_by_digest[key] = result
+        if len(_b64_by_digest) > _B64_BY_DIGEST_MAXSIZE:
+            _b64_by_digest.popitem(last=False)
+    return result
+
+def _encode_image_bytes(raw: bytes, fmt: str, image_path: str) -> Tuple[str, str]:
+    MAX_SIZE = 6 * 1024 * 1024  # 6MB
+    MAX_DIM = 2048              # 最大边长 2048
+
+    # 如果文件小于 3MB 且是常见格式，直接编码
+    if len(raw) < MAX_SIZE and fmt in ["jpeg", "png"]:
+        return encode_bytes_to_base64(raw), fmt
 
     # 否则进行压缩处理
-    log.info(f"[utils] Image {os.path.basename(image_path)} too large ({file_size/1024/1024:.2f}MB), compressing...")
+    log.info(f"[utils] Image {os.path.basename(image_path)} too large ({len(raw)/1024/1024:.2f}MB), compressing...")
     try:
-        with Image.open(image_path) as img:
+        with Image.open(BytesIO(raw)) as img:
             # 1. Resize if too large
             if max(img.size) > MAX_DIM:
                 scale = MAX_DIM / max(img.size)
@@ -73,27 +129,41 @@ def encode_image_to_base64(image_path: str) -> Tuple[str, str]:
             # 3. Save to buffer as JPEG
             buffer = BytesIO()
             img.save(buffer, format="JPEG", quality=85)
-            raw = buffer.getvalue()
+            compressed = buffer.getvalue()
             
-            log.info(f"[utils] Compressed size: {len(raw)/1024/1024:.2f}MB")
-            b64 = base64.b64encode(raw).decode("utf-8")
-            return b64, "jpeg"
+            log.info(f"[utils] Compressed size: {len(compressed)/1024/1024:.2f}MB")
+            return encode_bytes_to_base64(compressed), "jpeg"
             
     except Exception as e:
         log.warning(f"[utils] Compression failed: {e}, falling back to original.")
-        with open(image_path, "rb") as f:
-            raw = f.read()
-        b64 = base64.b64encode(raw).decode("utf-8")
-        return b64, fmt
+        return encode_bytes_to_base64(raw), fmt
+
+@lru_cache(maxsize=16)
+def _encode_image_to_base64_cached(image_path: str, mtime_ns: int, size: int) -> Tuple[str, str]:
+    return encode_image_to_base64(image_path)
+
+def encode_image_to_base64_cached(image_path: str) -> Tuple[str, str]:
+    """
+    同 encode_image_to_base64，但按 (路径, mtime, 文件大小) 缓存编码结果：
+    迭代编辑时反复传入的未修改图片不再重复读取与编码；文件被改写后自动失效。
+    """
+    try:
+        st = os.stat(image_path)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Image not found: {image_path}") from None
+    return _encode_image_to_base64_cached(image_path, st.st_mtime_ns, st.st_size)
 
+@lru_cache(maxsize=256)
 def is_gemini_model(model: str) -> bool:
     """判断是否为Gemini系列模型"""
     return 'gemini' in model.lower()
 
+@lru_cache(maxsize=256)
 def is_gemini_25(model: str) -> bool:
     """是否为 Gemini 2.5 系列"""
     return "gemini-2.5" in model.lower()
 
+@lru_cache(maxsize=256)
 def is_gemini_3_pro(model: str) -> bool:
     """是否为 Gemini 3 Pro 系列"""
     return "gemini-3-pro" in model.lower()
@@ -0,0 +1,43 @@
+import asyncio
+import gc
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dataflow_agent.toolkits.multimodaltool import http_client
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+def test_shared_client_closed_after_each_asyncio_run():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/"
+
+    async def one_request():
+        client = http_client.get_async_client()
+        resp = await client.get(url)
+        assert resp.text == "ok"
+        return client
+
+    try:
+        clients = [asyncio.run(one_request()) for _ in range(3)]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    gc.collect()
+    # keep-alive 连接不应让已结束事件循环的客户端滞留在缓存中
+    assert len(http_client._clients) == 0
+    assert not http_client._closers
+    assert all(c.is_closed for c in clients)
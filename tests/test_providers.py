@@ -0,0 +1,19 @@
+import json
+
+from dataflow_agent.toolkits.multimodaltool import providers
+
+
+def test_payload_chunks_keep_marker_text_in_prompt():
+    image = "data:image/png;base64," + "A" * 4096
+    payload = {
+        "model": "m",
+        "messages": [{"role": "user", "content": [
+            {"type": "text", "text": "0 and 1"},
+            {"type": "image_url", "image_url": {"url": image}},
+        ]}],
+    }
+    total, chunks = providers.iter_payload_chunks(payload)
+    body = b"".join(chunks)
+    # 提示词中与占位符形式相同的文本不应被当作图片拆分
+    assert len(body) == total
+    assert json.loads(body) == payload
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("requests")
+
+from dataflow_agent.toolkits.multimodaltool import sam_tool
+
+
+def test_empty_sam_result_packs_to_empty_list():
+    assert sam_tool.SamResult.empty().to_list_of_dicts(pack_masks=True) == []
+    assert sam_tool.SamResult.empty().to_list_of_dicts() == []
+
+
+def test_packed_masks_round_trip():
+    masks = np.random.default_rng(0).random((3, 7, 11)) > 0.5
+    res = sam_tool.SamResult(
+        bboxes=np.zeros((3, 4)),
+        scores=np.array([0.9, np.nan, 0.1]),
+        areas=masks.sum(axis=(1, 2)),
+        masks=masks,
+    )
+    items = res.to_list_of_dicts(pack_masks=True)
+    assert [it["score"] for it in items] == [0.9, None, 0.1]
+    for it, m in zip(items, masks):
+        assert "mask" not in it
+        assert np.array_equal(sam_tool.unpack_mask(it), m)
+
+
+class _FakeTensor:
+    def __init__(self, arr):
+        self._arr = arr
+        self.is_cuda = False
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self._arr
+
+
+def test_ultralytics_result_with_zero_instances():
+    masks = type("Masks", (), {"data": _FakeTensor(np.zeros((0, 32, 48), dtype=np.float32))})()
+    boxes = type("Boxes", (), {"xyxy": _FakeTensor(np.zeros((0, 4))), "conf": None})()
+    r = type("Result", (), {"masks": masks, "boxes": boxes})()
+    res = sam_tool._sam_result_from_ultralytics(r, 48, 32)
+    assert len(res) == 0
+    assert res.to_list_of_dicts() == []